@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Iterable
+
+import discord
+from discord import app_commands
+
+from ConfigStore import write_atomic
+
+logger = logging.getLogger(__name__)
+
+COMMAND_SYNC_FILE_NAME = Path("./command_sync.json")
+# Sync anyway once the last one is this old, in case the commands were changed from somewhere else
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class CommandSync:
+    """
+    Only syncs the command tree to a guild when the commands changed since the last sync.
+
+    tree.sync is a rate limited call that sends every command, and Discord keeps them until the next one, so syncing
+    the same commands on every start is wasted time. Each sync stores a fingerprint (a hash of the payloads sync would
+    send, and the application id) per guild in command_sync.json, and the next start compares against it.
+    force=True (FORCE_COMMAND_SYNC=1) syncs regardless, e.g. after deleting the commands by hand.
+    The file is written in the default executor like the config, one write at a time so the newest one lands last.
+    """
+
+    def __init__(self, tree: app_commands.CommandTree, path: Path = COMMAND_SYNC_FILE_NAME,
+                 max_age: float = DEFAULT_MAX_AGE, force: bool = False):
+        self.tree = tree
+        self.path = path
+        self.max_age = max_age
+        self.force = force
+        self.synced: Dict[str, dict] = self.read()
+        self.results: Dict[int, str] = {}  # guild id -> "synced", "skipped" or the error
+        self._write_lock = asyncio.Lock()
+
+    def read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("%s is not valid JSON, syncing every guild", self.path)
+            return {}
+
+    def fingerprint(self, guild: discord.abc.Snowflake) -> str:
+        commands = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+                          key=lambda command: (command.get("type", 1), command["name"]))
+        payload = json.dumps({"application_id": self.tree.client.application_id, "commands": commands},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def up_to_date(self, guild_id: int, fingerprint: str) -> bool:
+        last = self.synced.get(str(guild_id))
+        return (not self.force and last is not None and last.get("fingerprint") == fingerprint
+                and time.time() - last.get("time", 0) < self.max_age)
+
+    async def sync(self, guild_id: int) -> bool:
+        """Copies the global commands to the guild, and syncs them if they changed. Returns whether it synced."""
+        guild = discord.Object(id=guild_id)
+        self.tree.copy_global_to(guild=guild)
+        fingerprint = self.fingerprint(guild)
+        if self.up_to_date(guild_id, fingerprint):
+            logger.info("Commands of guild %d havent changed since the last sync, skipping it", guild_id)
+            self.results[guild_id] = "skipped"
+            return False
+        synced = await self.tree.sync(guild=guild)
+        logger.info("Synced %d command(s) to guild %d", len(synced), guild_id)
+        self.synced[str(guild_id)] = {"fingerprint": fingerprint, "time": time.time()}
+        async with self._write_lock:
+            # Copied once the lock is ours, so it has every guild synced before it
+            await asyncio.get_running_loop().run_in_executor(None, write_atomic, self.path, dict(self.synced))
+        self.results[guild_id] = "synced"
+        return True
+
+    async def sync_all(self, guild_ids: Iterable[int]) -> Dict[int, str]:
+        """Every guild at once. A guild that fails is logged and left for the next start, the others still sync."""
+        guild_ids = list(guild_ids)
+        results = await asyncio.gather(*(self.sync(guild_id) for guild_id in guild_ids), return_exceptions=True)
+        for guild_id, result in zip(guild_ids, results):
+            if isinstance(result, Exception):
+                logger.error("Couldn't sync the commands of guild %d: %s", guild_id, result)
+                self.results[guild_id] = f"{type(result).__name__}: {result}"
+        return dict(self.results)
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import discord
+
+from Metrics import ENABLED as METRICS_ENABLED, METRICS, labels_of
+from OperationQueue import interactive
+
+logger = logging.getLogger(__name__)
+
+# Called with a short status line while the work runs
+Progress = Callable[[str], Awaitable[None]]
+
+
+class CommandTasks:
+    """
+    Runs slash command work in the background, so the interaction is acknowledged right away.
+
+    Discord gives a command 3 seconds to respond. run() defers first (the user sees "thinking..."),
+    then does the work in a tracked task that can post progress, and sends the result as a followup.
+    If the same command (same key) is issued again while it is still running, the second one is told so instead of running twice.
+    """
+
+    def __init__(self, format_error: Callable[[Exception], str] = lambda e: f"```\n{e}\n```"):
+        self.format_error = format_error
+        self._running: Dict[tuple, asyncio.Task] = {}
+
+    async def run(self, interaction: discord.Interaction, key: tuple,
+                  work: Callable[[Progress], Awaitable[str]]) -> Optional[asyncio.Task]:
+        """
+        key identifies the command for deduplication, e.g. ("add_member", member.id).
+        work gets a progress callback and returns the final message.
+        Returns the task, or None if the same command was already running.
+        """
+        if not interaction.response.is_done():
+            await interaction.response.defer(thinking=True)
+
+        existing = self._running.get(key)
+        if existing is not None and not existing.done():
+            await interaction.followup.send(f"`/{key[0]}` is already running, I'll post the result when it finishes.")
+            return None
+
+        with interactive():  # The task copies this context, so its API calls jump ahead of scheduled work
+            task = asyncio.get_running_loop().create_task(self._run(interaction, work), name=f"command {key}")
+        self._running[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key: tuple, task: asyncio.Task):
+        if self._running.get(key) is task:
+            del self._running[key]
+
+    async def _run(self, interaction: discord.Interaction, work: Callable[[Progress], Awaitable[str]]):
+        name = interaction.command.name if interaction.command else "?"
+
+        async def progress(message: str):
+            try:
+                await interaction.edit_original_response(content=message)
+            except discord.HTTPException as e:
+                logger.warning("Couldn't post progress for /%s: %s", name, e)
+
+        start = time.perf_counter()
+        failed = False
+        try:
+            result = await work(progress)
+        except Exception as e:
+            logger.warning("Command /%s failed: %s", name, e)
+            result = self.format_error(e)
+            failed = True
+        if METRICS_ENABLED:
+            labels = labels_of(command=name)
+            METRICS.observe("command_work_seconds", time.perf_counter() - start, labels)
+            if failed:
+                METRICS.inc("command_errors_total", labels)
+        try:
+            await interaction.followup.send(result)
+        except discord.HTTPException as e:
+            # The interaction token only lasts 15 minutes
+            logger.error("Couldn't send the result of a command: %s\n%s", e, result)
+
+    @property
+    def running(self) -> list:
+        return [key for key, task in self._running.items() if not task.done()]
+
+    async def shutdown(self, timeout: float = 10):
+        """Gives running commands a moment to finish, then cancels whatever is left"""
+        tasks = [task for task in self._running.values() if not task.done()]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,307 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, FrozenSet, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for more changes before writing, so a burst of commands becomes one write
+DEFAULT_WRITE_DELAY = 0.5
+# Once the journal grows past this, the next flush writes a fresh snapshot and empties it
+DEFAULT_COMPACT_BYTES = 64 * 1024
+# Stored in the snapshot so replay knows which journal records it already contains
+JOURNAL_SEQ_KEY = "journal_seq"
+# A temp file this old was left by a write that got killed before its rename. A write takes milliseconds
+STALE_TEMP_SECONDS = 60
+
+
+def write_atomic(path: Path, config: dict):
+    """
+    Writes the config to a temp file next to `path`, fsyncs it, then renames it over `path`.
+    A crash at any point leaves either the old file or the new one, never a truncated one.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(config, fp, indent=4)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+def remove_stale_temp_files(path: Path):
+    """Deletes the temp files write_atomic left next to `path` when it was killed before renaming them"""
+    cutoff = time.time() - STALE_TEMP_SECONDS
+    try:
+        candidates = [tmp for tmp in path.parent.iterdir()
+                      if tmp.name.startswith(f".{path.name}.") and tmp.name.endswith(".tmp")]
+    except FileNotFoundError:
+        return
+    for tmp in candidates:
+        try:
+            if tmp.stat().st_mtime < cutoff:
+                tmp.unlink()
+                logger.info("Removed %s, left by an interrupted write", tmp)
+        except FileNotFoundError:
+            pass  # Renamed or removed by whoever else writes the config meanwhile
+
+
+def _fsync_dir(directory: Path):
+    # A rename or a new file is only durable once the directory entry is synced
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def append_lines(path: Path, lines: List[str]) -> int:
+    """Appends lines to the journal and fsyncs it. Returns the new size of the file."""
+    with open(path, "a") as fp:
+        fp.write("".join(lines))
+        fp.flush()
+        os.fsync(fp.fileno())
+        return fp.tell()
+
+
+class ConfigStore:
+    """
+    Persists the config without blocking the event loop.
+
+    The config file is a snapshot. Every change after it is appended to a journal next to it (conf.journal)
+    as one small JSON line, so a change costs the same no matter how long the member list is.
+    Reading loads the snapshot and replays the journal records newer than it.
+    Once the journal passes `compact_bytes` a new snapshot is written and the journal is emptied.
+
+    append() and save() only queue work and schedule a flush `delay` seconds later, so a burst of changes is written once.
+    The disk I/O runs in the default executor.
+    Await flush() to make sure everything so far is on disk (before acknowledging a rotation, and on shutdown).
+
+    changed_on_disk() tells whether someone else edited the files since they were last read or written here,
+    so a watcher can tell a hand edit apart from the bot's own writes.
+    A hand edit is found before the journal is replayed, by comparing the snapshot with the one last read or written
+    here. A record in the tail that sets a key which was edited leaves the edit alone, and the key ends up in
+    `conflicts`. Nothing is known to compare with on the first read, so the tail wins then.
+
+    While ready() is false (the config failed to load, so what snapshot() returns isnt the config) no snapshot is
+    written at all. Records still go to the journal, and the files are left for whoever fixes the config.
+    """
+
+    def __init__(self, path: Path, snapshot: Callable[[], dict],
+                 apply: Callable[[dict, dict, FrozenSet[str]], Iterable[str]], delay: float = DEFAULT_WRITE_DELAY,
+                 compact_bytes: int = DEFAULT_COMPACT_BYTES, ready: Callable[[], bool] = lambda: True):
+        """
+        snapshot returns the full current config, used when compacting.
+        apply(config, record, keep) replays one journal record onto a config dict, without setting the keys in keep.
+        It returns the ones in keep that it would have set.
+        ready says whether snapshot() can be written over the config file right now.
+        """
+        self.path = Path(path)
+        self.journal_path = self.path.with_suffix(".journal")
+        self.snapshot = snapshot
+        self.apply = apply
+        self.delay = delay
+        self.compact_bytes = compact_bytes
+        self.ready = ready
+        remove_stale_temp_files(self.path)
+
+        self.writes: int = 0  # How many times the disk was actually written to
+        self.last_error: Optional[Exception] = None
+        self._seq: int = 0  # Sequence number of the newest journal record
+        self._journal_bytes: int = 0
+        self._pending_records: List[str] = []
+        self._snapshot_requested: bool = False
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._known_files: Optional[tuple] = None  # file_signature() as of our last read or write
+        self._on_disk: Optional[dict] = None  # The snapshot as of our last read or write, before any replay
+        self.conflicts: List[str] = []  # Keys the last read kept as edited by hand over a journal record
+
+    def read(self) -> dict:
+        """Loads the snapshot and replays the journal tail on top of it. A plain conf.json with no journal works too."""
+        try:
+            return self._read()
+        finally:
+            # Also when it fails, so changed_on_disk waits for the next edit instead of retrying the broken one
+            self._known_files = self.file_signature()
+
+    def _read(self) -> dict:
+        with open(self.path, "r") as fp:
+            config = json.load(fp)
+        edited = self._edited_keys(config)
+        self._on_disk = copy.deepcopy(config)
+        self.conflicts = []
+        self._seq = config.get(JOURNAL_SEQ_KEY, 0)
+        self._journal_bytes = 0
+
+        if not self.journal_path.is_file():
+            return config
+
+        replayed = 0
+        good_bytes = 0
+        with open(self.journal_path, "rb") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash during an append can leave half a line at the end. Everything before it is fine.
+                    logger.warning("Ignoring a torn record at the end of %s", self.journal_path)
+                    break
+                good_bytes += len(line)
+                if record["seq"] <= self._seq:
+                    continue  # Already part of the snapshot
+                for key in self.apply(config, record, edited):
+                    if key not in self.conflicts:
+                        self.conflicts.append(key)
+                self._seq = record["seq"]
+                replayed += 1
+
+        if good_bytes != self.journal_path.stat().st_size:
+            # Cut the torn tail off, otherwise new records would be appended after it and never replayed
+            os.truncate(self.journal_path, good_bytes)
+        self._journal_bytes = good_bytes
+        if replayed:
+            logger.info("Replayed %d journal record(s) onto %s", replayed, self.path)
+        if self.conflicts:
+            logger.warning("Kept the hand edits to %s in %s over the journal", ", ".join(self.conflicts), self.path)
+        return config
+
+    def _edited_keys(self, config: dict) -> FrozenSet[str]:
+        """The keys of a snapshot just read that differ from the one last read or written here"""
+        if self._on_disk is None:
+            return frozenset()
+        return frozenset(key for key in config.keys() | self._on_disk.keys()
+                         if key != JOURNAL_SEQ_KEY and config.get(key) != self._on_disk.get(key))
+
+    def append(self, op: str, **fields):
+        """Queues one state change to be journaled."""
+        self._seq += 1
+        record = {"seq": self._seq, "op": op, **fields}
+        self._pending_records.append(json.dumps(record) + "\n")
+        self._schedule()
+
+    def save(self):
+        """Queues a full snapshot. Use it when the change cant be described as a journal record."""
+        self._snapshot_requested = True
+        self._schedule()
+
+    async def flush(self, compact=False):
+        """
+        Writes everything pending now. compact=True also writes a fresh snapshot and empties the journal,
+        unless the config isnt ready (see the class docstring).
+        Raises if the write fails, and what wasnt written stays pending.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while self.dirty or compact:
+                records, snapshot = self._take_step(compact)
+                compact = False
+                if not records and snapshot is None:
+                    break  # Only a compaction that isnt allowed right now
+                try:
+                    await loop.run_in_executor(None, self._write_step, records, snapshot)
+                except Exception as e:
+                    self._restore(records, snapshot, e)
+                    raise e
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the newest journal record read or queued"""
+        return self._seq
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending_records) or self._snapshot_requested
+
+    def file_signature(self) -> tuple:
+        """(mtime, size) of the config and the journal. Cheap enough to poll."""
+        signature = []
+        for path in (self.path, self.journal_path):
+            try:
+                stat = path.stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def changed_on_disk(self) -> bool:
+        """True if the files changed since this store last read or wrote them. Our own pending or running writes dont count."""
+        if self._known_files is None or self.dirty or self._lock.locked():
+            return False
+        return self.file_signature() != self._known_files
+
+    def _schedule(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Nothing to defer to, so just write it now
+            records, snapshot = self._take_step(False)
+            try:
+                self._write_step(records, snapshot)
+            except Exception as e:
+                self._restore(records, snapshot, e)
+                raise e
+            return
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._write_later())
+
+    async def _write_later(self):
+        await asyncio.sleep(self.delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            # Nobody is awaiting this task, so report it here. The next append, save or flush will try again
+            logger.error("Background config write failed: %s", e)
+
+    def _take_step(self, compact: bool):
+        """Grabs what is pending, on the event loop, so the state can keep changing while the executor writes."""
+        records, self._pending_records = self._pending_records, []
+        snapshot = None
+        if not self.ready():
+            if self._snapshot_requested:
+                logger.warning("Not writing a snapshot of %s, the config isnt loaded", self.path)
+            self._snapshot_requested = False
+        elif compact or self._snapshot_requested or self._journal_bytes + sum(map(len, records)) > self.compact_bytes:
+            # Taken now, so it covers every record up to self._seq including the ones in this step
+            snapshot = {**self.snapshot(), JOURNAL_SEQ_KEY: self._seq}
+            self._snapshot_requested = False
+        return records, snapshot
+
+    def _write_step(self, records: List[str], snapshot: Optional[dict]):
+        """Runs in the executor"""
+        if records:
+            self._journal_bytes = append_lines(self.journal_path, records)
+            self.writes += 1
+        if snapshot is not None:
+            write_atomic(self.path, snapshot)
+            self._on_disk = json.loads(json.dumps(snapshot))  # The keys as the file has them, plain str
+            # The snapshot covers every record so far. Replay skips them by seq even if this truncate never happens
+            with open(self.journal_path, "w") as fp:
+                os.fsync(fp.fileno())
+            self._journal_bytes = 0
+            self.writes += 1
+        self._known_files = self.file_signature()
+        self.last_error = None
+
+    def _restore(self, records: List[str], snapshot: Optional[dict], e: Exception):
+        """Puts back what a failed write was holding, in front of anything newer."""
+        # Re-appending records that did make it is harmless, replay skips a seq it has already seen
+        self._pending_records[:0] = records
+        if snapshot is not None:
+            self._snapshot_requested = True
+        self.last_error = e
+        e.add_note(f"Failed to write {self.path}")
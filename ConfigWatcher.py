@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks. A stat() of two files per rotation, so this can be short
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class ConfigWatcher:
+    """
+    Hot reloads a rotation when its config or journal is edited by hand, so nobody has to remember /reload.
+
+    Polls each ConfigStore.changed_on_disk(), which ignores the bot's own writes, and submits reload_config to the
+    rotation's executor, so only the parts of the config that changed are redone.
+    `reports` keeps the result of the last reload of each rotation.
+    """
+
+    def __init__(self, rotations: Callable[[], Iterable], interval: float = DEFAULT_POLL_INTERVAL):
+        """rotations returns the RoleRotations to watch. It is called on every check, so rotations can come and go."""
+        self.rotations = rotations
+        self.interval = interval
+        self.reports: Dict[str, object] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch(), name="ConfigWatcher")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def check(self) -> Dict[str, object]:
+        """Reloads every rotation whose files changed. Returns their ReloadReport (or error) by name."""
+        reloaded = {}
+        for rotation in self.rotations():
+            if not rotation.store.changed_on_disk():
+                continue
+            rotation.log.info("Config changed on disk, reloading it")
+            try:
+                report = await rotation.executor.submit("reload_config", rotation.reload_config, merge=True)
+            except Exception as e:
+                # Only this rotation, the others still get reloaded
+                report = e
+            if isinstance(report, Exception):
+                rotation.log.error("Couldn't reload, still using the old config: %s", report)
+            reloaded[rotation.name] = report
+        self.reports.update(reloaded)
+        return reloaded
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                # Keep watching, the next edit may well fix it
+                logger.exception("Config watcher failed: %s", e)
@@ -0,0 +1,300 @@
+"""
+An in-process stand-in for the parts of discord.py the bot uses, so RoleRotation can be run and measured without a token.
+
+Every API call goes through FakeAPI, which counts it, waits `latency` seconds,
+and can inject 429s (slept through and retried, like discord.py does) or failures.
+"""
+import asyncio
+import random
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+import discord
+from discord import app_commands
+
+
+class FakeResponse:
+    """Just enough of an aiohttp response for discord.HTTPException"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class FakeAPI:
+    """
+    Counts and delays every REST and gateway request.
+
+    rate_limit: at most this many calls per `rate_window` seconds per route before a 429 is simulated
+    inject_429_every: every Nth call gets a 429 regardless
+    retry_after: how long a simulated 429 makes the caller sleep before retrying
+    fail_ids: member ids whose fetch raises NotFound
+    failure_rate: chance that any call raises a 500
+    route_latency: a different latency for some routes, e.g. {"sync_commands": 1.0}
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit: Optional[int] = None, rate_window: float = 1.0,
+                 inject_429_every: int = 0, retry_after: float = 0.0, fail_ids: Iterable[int] = (),
+                 failure_rate: float = 0.0, seed: int = 0, route_latency: Optional[Dict[str, float]] = None):
+        self.latency = latency
+        self.route_latency: Dict[str, float] = dict(route_latency or {})
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.inject_429_every = inject_429_every
+        self.retry_after = retry_after
+        self.fail_ids: Set[int] = set(fail_ids)
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+        self.calls: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        self.in_flight: int = 0
+        self.max_in_flight: int = 0
+        self._windows: Dict[str, List[float]] = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls.clear()
+        self.rate_limited.clear()
+        self.max_in_flight = 0
+        self._windows.clear()
+
+    async def request(self, route: str, member_id: Optional[int] = None):
+        """Call this at the start of every fake API method."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self.calls[route] += 1
+            if self._should_429(route, loop.time()):
+                self.rate_limited[route] += 1
+                await asyncio.sleep(self.retry_after or self.rate_window)
+                continue
+            break
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            latency = self.route_latency.get(route, self.latency)
+            if latency:
+                await asyncio.sleep(latency)
+        finally:
+            self.in_flight -= 1
+
+        if member_id is not None and member_id in self.fail_ids:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Member")
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise discord.HTTPException(FakeResponse(500, "Internal Server Error"), "Injected failure")
+
+    def _should_429(self, route: str, now: float) -> bool:
+        if self.inject_429_every and self.total % self.inject_429_every == 0:
+            return True
+        if self.rate_limit is None:
+            return False
+        window = [t for t in self._windows.get(route, ()) if now - t < self.rate_window]
+        if len(window) >= self.rate_limit:
+            self._windows[route] = window
+            return True
+        window.append(now)
+        self._windows[route] = window
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "total_calls": self.total,
+            "rate_limited": dict(self.rate_limited),
+            "max_in_flight": self.max_in_flight,
+        }
+
+
+class FakeRole:
+    def __init__(self, guild: "FakeGuild", role_id: int, name: str, position: int):
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+        self.position = position
+
+    @property
+    def members(self) -> List["FakeMember"]:
+        """Like discord.Role.members, this only sees the gateway cache"""
+        if not self.guild.gateway_cache:
+            return []
+        members = self.guild.members.values()
+        if self.guild.trimmed:
+            members = (self.guild.members[member_id] for member_id in self.guild.cached)
+        return [member for member in members if self in member.roles]
+
+    def __le__(self, other: "FakeRole") -> bool:
+        return self.position <= other.position
+
+    def __lt__(self, other: "FakeRole") -> bool:
+        return self.position < other.position
+
+    def __repr__(self):
+        return f"<FakeRole id={self.id} name={self.name!r}>"
+
+
+class FakeMember:
+    def __init__(self, guild: "FakeGuild", member_id: int, name: str):
+        self.guild = guild
+        self.id = member_id
+        self.name = name
+        self.display_name = name
+        self.roles: List[FakeRole] = []
+
+    @property
+    def top_role(self) -> FakeRole:
+        return max(self.roles, key=lambda role: role.position, default=self.guild.default_role)
+
+    async def add_roles(self, *roles: FakeRole):
+        await self.guild.api.request("add_roles")
+        # The guild's own member is the server's state, and what the gateway cache shows. A copy isnt updated
+        current = self.guild.members[self.id]
+        for role in roles:
+            if role not in current.roles:
+                current.roles.append(role)
+
+    async def remove_roles(self, *roles: FakeRole):
+        await self.guild.api.request("remove_roles")
+        current = self.guild.members[self.id]
+        for role in roles:
+            if role in current.roles:
+                current.roles.remove(role)
+
+    def _copy(self) -> "FakeMember":
+        """A REST fetch hands back a new object each time, like discord.py, with the roles as they were then"""
+        copy = FakeMember(self.guild, self.id, self.name)
+        copy.roles = list(self.roles)
+        return copy
+
+    def __repr__(self):
+        return f"<FakeMember id={self.id} name={self.name!r}>"
+
+
+class FakeGuild:
+    """
+    gateway_cache: whether get_member and Role.members can see members, like a connected bot with the members intent
+    chunking: whether query_members works
+    trimmed: the gateway cache only holds members that query_members cached, like MyClient(trim_member_cache=True)
+    """
+
+    def __init__(self, api: FakeAPI, guild_id: int = 1, gateway_cache: bool = True, chunking: bool = True,
+                 trimmed: bool = False):
+        self.api = api
+        self.id = guild_id
+        self.gateway_cache = gateway_cache
+        self.chunking = chunking
+        self.trimmed = trimmed
+        self.cached: set = set()  # Member ids visible to a trimmed gateway cache
+        self.members: Dict[int, FakeMember] = {}
+        self.roles: Dict[int, FakeRole] = {}
+        self.default_role = self.add_role(guild_id, "@everyone", 0)
+
+    # --- Setup helpers ---
+    def add_role(self, role_id: int, name: str, position: int) -> FakeRole:
+        role = FakeRole(self, role_id, name, position)
+        self.roles[role_id] = role
+        return role
+
+    def add_member(self, member_id: int, name: Optional[str] = None, roles: Iterable[FakeRole] = ()) -> FakeMember:
+        member = FakeMember(self, member_id, name or f"member{member_id}")
+        member.roles.extend(roles)
+        self.members[member_id] = member
+        return member
+
+    # --- discord.Guild ---
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        if not self.gateway_cache or (self.trimmed and member_id not in self.cached):
+            return None
+        return self.members.get(member_id)
+
+    async def fetch_member(self, member_id: int) -> FakeMember:
+        await self.api.request("fetch_member", member_id)
+        if member_id not in self.members:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Member")
+        return self.members[member_id]._copy()
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.roles.get(role_id) if self.gateway_cache else None
+
+    async def fetch_role(self, role_id: int) -> FakeRole:
+        await self.api.request("fetch_role")
+        if role_id not in self.roles:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Role")
+        return self.roles[role_id]
+
+    async def query_members(self, query=None, *, limit=5, user_ids=None, presences=False, cache=True):
+        if not self.chunking:
+            raise discord.ClientException("Intents.members must be enabled to use this.")
+        await self.api.request("query_members")
+        found = [self.members[member_id] for member_id in user_ids or () if member_id in self.members
+                 and member_id not in self.api.fail_ids][:limit]
+        if cache:
+            self.cached.update(member.id for member in found)
+        return found
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = "RoleRotationBot"
+
+
+class FakeClient:
+    """Stands in for MyClient. Holds one or more FakeGuilds and a single FakeAPI, like one gateway connection."""
+
+    def __init__(self, api: Optional[FakeAPI] = None, user_id: int = 999):
+        self.api = api or FakeAPI()
+        self.user = FakeUser(user_id)
+        self.guilds: Dict[int, FakeGuild] = {}
+
+    def add_guild(self, guild_id: int = 1, gateway_cache: bool = True, chunking: bool = True,
+                  trimmed: bool = False) -> FakeGuild:
+        guild = FakeGuild(self.api, guild_id, gateway_cache, chunking, trimmed)
+        self.guilds[guild_id] = guild
+        return guild
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        guild = self.guilds.get(guild_id)
+        return guild if guild is not None and guild.gateway_cache else None
+
+    async def fetch_guild(self, guild_id: int) -> FakeGuild:
+        await self.api.request("fetch_guild")
+        return self.guilds[guild_id]
+
+
+class FakeCommandTree(app_commands.CommandTree):
+    """
+    A real CommandTree, so the command payloads (and CommandSync's fingerprints of them) are the real ones,
+    but sync is a FakeAPI call. Its client is never logged in.
+    """
+
+    def __init__(self, api: FakeAPI):
+        super().__init__(discord.Client(intents=discord.Intents.none()))
+        self.api = api
+
+    async def sync(self, *, guild: Optional[discord.abc.Snowflake] = None) -> list:
+        await self.api.request("sync_commands")
+        return self.get_commands(guild=guild)
+
+
+def build_guild(client: FakeClient, members: int, guild_id: int = 1, role_id: int = 500, holder: int = 0,
+                gateway_cache: bool = True, chunking: bool = True, trimmed: bool = False) -> FakeGuild:
+    """
+    A guild with the bot (top role high enough), a managed role, and `members` members with ids 1000, 1001, ...
+    The member at position `holder` starts with the managed role.
+    """
+    guild = client.add_guild(guild_id, gateway_cache, chunking, trimmed)
+    role = guild.add_role(role_id, "On Duty", 1)
+    bot_role = guild.add_role(role_id + 1, "Bot", 10)
+    guild.add_member(client.user.id, client.user.name, [bot_role])
+    for i in range(members):
+        guild.add_member(1000 + i, roles=[role] if i == holder else [])
+    return guild
+
+
+def member_ids(members: int) -> List[int]:
+    """The ids build_guild gives its members, in order"""
+    return list(range(1000, 1000 + members))
@@ -0,0 +1,176 @@
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from SQLiteWriter import SQLiteWriter, connect
+
+HISTORY_DB_NAME = "history.db"
+# The ops that put someone on duty, so they count as a shift
+SHIFT_OPS = ("rotate", "set_index")
+# The ops that get recorded. Schedule changes are in the journal but dont say anything about who did what
+HISTORY_OPS = SHIFT_OPS + ("add", "remove", "move")
+DEFAULT_PAGE_SIZE = 20
+
+
+class HistoryEvent:
+    """
+    One recorded change. member_id is who the change was about: the member who came on duty for rotate and set_index,
+    otherwise the member added, removed or moved. name is their display name at the time, so it still reads right after
+    they leave the server.
+    """
+    __slots__ = ("id", "rotation", "time", "op", "member_id", "name", "previous_id", "index", "position")
+
+    def __init__(self, event_id: int, rotation: str, time: datetime, op: str, member_id: Optional[int],
+                 name: Optional[str], previous_id: Optional[int], index: int, position: Optional[int]):
+        self.id = event_id
+        self.rotation = rotation
+        self.time = time
+        self.op = op
+        self.member_id = member_id
+        self.name = name
+        self.previous_id = previous_id
+        self.index = index
+        self.position = position
+
+    def __str__(self):
+        where = f" to {self.position}" if self.op in ("add", "move") and self.position is not None else ""
+        return f"#{self.id} {self.time:%Y-%m-%d %H:%M} UTC {self.op:<9} {self.name or self.member_id}{where} (index {self.index})"
+
+
+class ShiftStats:
+    def __init__(self, member_id: int, name: Optional[str], shifts: int, last_shift: datetime):
+        self.member_id = member_id
+        self.name = name
+        self.shifts = shifts
+        self.last_shift = last_shift
+
+    def __str__(self):
+        return f"{self.name or self.member_id}: {self.shifts} shift(s), last on {self.last_shift:%Y-%m-%d}"
+
+
+class HistoryStore:
+    """
+    An append-only log of every rotation, set_index, add, remove and move, in a small SQLite file (history.db).
+
+    Rows are never updated or deleted. They are indexed by (rotation, time) and (rotation, member_id, time),
+    so "who was on duty at X", a member's own history and the per member shift counts stay quick over years of rows.
+    Pages are keyset paginated: the next page starts below the last event id shown, so only one page is ever read.
+    Events are written by a SQLiteWriter, and reads see one once that write is committed.
+    One store can be shared by every rotation, rows are keyed by rotation name.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = connect(path)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY,
+                    rotation TEXT NOT NULL,
+                    time REAL NOT NULL,
+                    op TEXT NOT NULL,
+                    member_id INTEGER,
+                    name TEXT,
+                    previous_id INTEGER,
+                    idx INTEGER NOT NULL,
+                    position INTEGER
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS history_time ON history (rotation, time)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS history_member ON history (rotation, member_id, time)")
+        self.writer = SQLiteWriter(path, "HistoryStore")
+
+    def record(self, rotation: str, op: str, member_id: Optional[int], name: Optional[str], index: int,
+               previous_id: Optional[int] = None, position: Optional[int] = None, at: Optional[float] = None) -> Future:
+        """Queues one event. at is a time.time() timestamp, now by default. The future has the event id."""
+        return self.writer.submit(_insert, (rotation, time.time() if at is None else at, op, member_id, name,
+                                            previous_id, index, position))
+
+    def record_many(self, rotation: str, op: str, events: Iterable[Tuple[int, Optional[str], Optional[int]]],
+                    index: int) -> Future:
+        """Queues one event per (member_id, name, position), written in a single transaction, e.g. for an import"""
+        now = time.time()
+        # Listed now, the caller may change what events iterates over before the thread gets to it
+        rows = [(rotation, now, op, member_id, name, None, index, position) for member_id, name, position in events]
+        return self.writer.submit(_insert_many, rows)
+
+    async def wait(self):
+        """Until every event recorded so far is written"""
+        await self.writer.wait()
+
+    def page(self, rotation: str, before: Optional[int] = None, member_id: Optional[int] = None,
+             until: Optional[datetime] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[HistoryEvent]:
+        """
+        Up to `limit` events, newest first. before is the id of the last event of the previous page.
+        member_id only shows events about that member, until only shows events at or before that time.
+        """
+        where = ["rotation = ?"]
+        params: list = [rotation]
+        if member_id is not None:
+            where.append("member_id = ?")
+            params.append(member_id)
+        if until is not None:
+            where.append("time <= ?")
+            params.append(until.timestamp())
+        if before is not None:
+            # Keyset on (time, id), so the index hands back the page in order and nothing before it is read
+            where.append("(time, id) < (SELECT time, id FROM history WHERE id = ?)")
+            params.append(before)
+        rows = self._db.execute(
+            f"SELECT {_COLUMNS} FROM history WHERE {' AND '.join(where)} ORDER BY time DESC, id DESC LIMIT ?",
+            (*params, limit)).fetchall()
+        return [_event(row) for row in rows]
+
+    def on_duty_at(self, rotation: str, at: datetime) -> Optional[HistoryEvent]:
+        """The rotate or set_index that put whoever was on duty at `at` there, or None if nothing was recorded before it"""
+        row = self._db.execute(
+            f"SELECT {_COLUMNS} FROM history WHERE rotation = ? AND time <= ? AND op IN ({_SHIFT_OPS_SQL}) "
+            f"ORDER BY time DESC, id DESC LIMIT 1", (rotation, at.timestamp())).fetchone()
+        return _event(row) if row is not None else None
+
+    def shift_stats(self, rotation: str, since: Optional[datetime] = None) -> List[ShiftStats]:
+        """Shifts per member (rotations and set_index onto them), most first. Only counts shifts after since."""
+        rows = self._db.execute(
+            # SQLite fills name from the row MAX(time) picked, so it is their latest known name
+            f"SELECT member_id, name, MAX(time), COUNT(*) FROM history "
+            f"WHERE rotation = ? AND member_id IS NOT NULL AND time >= ? AND op IN ({_SHIFT_OPS_SQL}) "
+            f"GROUP BY member_id ORDER BY COUNT(*) DESC, MAX(time) DESC",
+            (rotation, since.timestamp() if since is not None else 0)).fetchall()
+        return [ShiftStats(row[0], row[1], row[3], _from_timestamp(row[2])) for row in rows]
+
+    def names(self, rotation: str) -> Dict[int, str]:
+        """The latest name recorded for each member, for showing members without asking Discord"""
+        rows = self._db.execute(
+            "SELECT member_id, name, MAX(time) FROM history WHERE rotation = ? AND member_id IS NOT NULL "
+            "GROUP BY member_id", (rotation,)).fetchall()
+        return {row[0]: row[1] for row in rows if row[1] is not None}
+
+    def count(self, rotation: str) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM history WHERE rotation = ?", (rotation,)).fetchone()[0]
+
+    def close(self):
+        self.writer.close()
+        self._db.close()
+
+
+_COLUMNS = "id, rotation, time, op, member_id, name, previous_id, idx, position"
+_INSERT_COLUMNS = "rotation, time, op, member_id, name, previous_id, idx, position"
+_SHIFT_OPS_SQL = ", ".join(f"'{op}'" for op in SHIFT_OPS)
+
+
+def _insert(db: sqlite3.Connection, row: tuple) -> int:
+    return db.execute(f"INSERT INTO history ({_INSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row).lastrowid
+
+
+def _insert_many(db: sqlite3.Connection, rows: List[tuple]):
+    db.executemany(f"INSERT INTO history ({_INSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def _event(row) -> HistoryEvent:
+    return HistoryEvent(row[0], row[1], _from_timestamp(row[2]), *row[3:])
+
+
+def _from_timestamp(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
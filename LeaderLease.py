@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A leader that stops renewing (crashed, hung, lost the volume) can be replaced this many seconds after its last renewal
+DEFAULT_LEASE_SECONDS = 15.0
+LEASE_NAME = "leader"
+
+
+def default_holder() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderLease:
+    """
+    Picks one leader among the replicas sharing a SharedState, with a lease that expires unless it is renewed.
+
+    Every `interval` seconds (ttl / 3 by default) each replica tries to take the lease, which only works if it is free
+    or expired, and the leader renews it. A new holder bumps term. held() only trusts the lease until the last
+    renewal plus ttl minus one interval, so a leader that is stuck stops leading a little before anyone can take over.
+    A leader that crashes is replaced at most ttl + interval after its last renewal. One that shuts down cleanly
+    releases the lease, and is replaced within an interval.
+    Expiry is compared against each replica's own clock, so their clocks have to agree, which they do on one machine.
+    The renewals run on the SharedState's writer thread (renew_lease), so waiting on another replica's write
+    never holds up the event loop.
+    """
+
+    def __init__(self, state, holder: Optional[str] = None, ttl: float = DEFAULT_LEASE_SECONDS,
+                 interval: Optional[float] = None, on_elected: Callable[[], None] = lambda: None,
+                 on_demoted: Callable[[], None] = lambda: None, name: str = LEASE_NAME):
+        """state is a SharedState. on_elected and on_demoted are called on the event loop when leadership changes."""
+        self.state = state
+        self.holder = holder or default_holder()
+        self.ttl = ttl
+        self.interval = interval or ttl / 3
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.name = name
+
+        self.leading: bool = False  # As of the last check, held() is the one to ask before doing leader work
+        self.term: int = 0  # Of the lease this replica holds or last held
+        self.leader: Optional[str] = None  # Whoever held it at the last check
+        self.elections: int = 0  # How many times this replica became the leader
+        self._valid_until: float = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def held(self) -> bool:
+        """Whether this replica is the leader right now. No database read, so it is cheap to ask before each job."""
+        return time.time() < self._valid_until
+
+    def check(self) -> bool:
+        """Takes or renews the lease once, and calls on_elected or on_demoted if that changed anything"""
+        try:
+            claimed = self.state.claim_lease(self.name, self.holder, self.ttl)
+        except sqlite3.Error as e:
+            # Keep what we had, held() runs out on its own if this keeps failing
+            logger.warning("Couldn't renew the leader lease: %s", e)
+            claimed = None
+        return self._update(claimed)
+
+    async def renew(self) -> bool:
+        """check() with the write on the writer thread, what the renewal loop runs"""
+        try:
+            claimed = await self.state.renew_lease(self.name, self.holder, self.ttl)
+        except sqlite3.Error as e:
+            logger.warning("Couldn't renew the leader lease: %s", e)
+            claimed = None
+        return self._update(claimed)
+
+    def _update(self, claimed: Optional[Tuple[str, float, int]]) -> bool:
+        if claimed is not None:
+            holder, expires, term = claimed
+            self.leader = holder
+            if holder == self.holder:
+                self.term = term
+                self._valid_until = expires - self.interval
+            else:
+                self._valid_until = 0.0
+
+        leading = self.held()
+        if leading and not self.leading:
+            self.leading = True
+            self.elections += 1
+            logger.info("%s is the leader now (term %d)", self.holder, self.term)
+            self.on_elected()
+        elif not leading and self.leading:
+            self.leading = False
+            logger.warning("%s is not the leader anymore, %s is", self.holder, self.leader)
+            self.on_demoted()
+        return leading
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self.check()  # Right away, so a lone replica leads from the start instead of one interval later
+            self._task = asyncio.get_running_loop().create_task(self._loop(), name="LeaderLease")
+
+    def stop(self, release=True):
+        """Stops renewing. release=True also gives the lease up, so another replica takes over without waiting it out."""
+        if self._task is not None:
+            self._task.cancel()
+        if not release:
+            return
+        # Even when not leading, a renewal cancelled above may still have taken the lease on the writer thread
+        try:
+            self.state.release_lease(self.name, self.holder)
+        except sqlite3.Error as e:
+            logger.warning("Couldn't release the leader lease, it expires in %.0f s: %s", self.ttl, e)
+        self._valid_until = 0.0
+        if self.leading:
+            self.leading = False
+            self.on_demoted()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.renew()
+            except Exception as e:
+                # A failing callback shouldnt stop the renewals
+                logger.exception("Leader lease check failed: %s", e)
+
+    def stats(self) -> dict:
+        return {"holder": self.holder, "leading": self.held(), "leader": self.leader, "term": self.term,
+                "elections": self.elections}
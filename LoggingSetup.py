@@ -0,0 +1,166 @@
+import collections
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from typing import Dict, List, Optional, TextIO
+
+# Lines kept in memory for /debug
+DEFAULT_RECENT_LINES = 500
+# Keep 1 in this many records below WARNING from these loggers (and their children). WARNING and up are always kept
+DEFAULT_SAMPLING = {"discord.http": 10, "discord.gateway": 5}
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"
+
+# Everything a LogRecord has on its own, so the rest must have come from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def extra_fields(record: logging.LogRecord) -> dict:
+    """The structured fields a record was logged with (extra=..., or a LoggerAdapter)"""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    The usual text line, with the record's extra fields appended as key=value.
+    With as_json=True every record is one JSON object instead, for log collectors.
+    """
+
+    def __init__(self, as_json: bool = False):
+        super().__init__(TEXT_FORMAT)
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = extra_fields(record)
+        if self.as_json:
+            entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage(), **fields}
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps 1 in N records below WARNING from noisy loggers, e.g. discord.http logs every request at DEBUG.
+    Counts per logger prefix, so the kept ones are spread evenly instead of random.
+    """
+
+    def __init__(self, every: Dict[str, int]):
+        super().__init__()
+        # Longest prefix first, so "discord.http" wins over "discord"
+        self.every = sorted(every.items(), key=lambda item: -len(item[0]))
+        self.seen: Dict[str, int] = collections.Counter()
+        self.dropped: Dict[str, int] = collections.Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, every in self.every:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                self.seen[prefix] += 1
+                if (self.seen[prefix] - 1) % every:
+                    self.dropped[prefix] += 1
+                    return False
+                return True
+        return True
+
+
+class RecentLogs(logging.Handler):
+    """Keeps the last `capacity` formatted lines in memory, so /debug can show them without reading any file"""
+
+    def __init__(self, capacity: int = DEFAULT_RECENT_LINES):
+        super().__init__()
+        self.lines: collections.deque = collections.deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord):
+        # handle() holds self.lock around this
+        self.lines.append(self.format(record))
+
+    def recent(self, count: int, max_chars: Optional[int] = None) -> List[str]:
+        """
+        The newest `count` lines, oldest first. With max_chars, only as many of the newest as fit in that many
+        characters (joined by newlines), e.g. for a Discord message. Safe to call while the writer thread appends.
+        """
+        with self.lock:
+            lines = list(self.lines)[-count:] if count > 0 else []
+        if max_chars is None:
+            return lines
+        kept = []
+        for line in reversed(lines):
+            max_chars -= len(line) + 1
+            if max_chars < 0:
+                break
+            kept.append(line)
+        return kept[::-1]
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare formats and copies every record, so it can be pickled to another process. That is most of
+    the cost of a log call, and it runs on the event loop. The queue only goes to a thread here, so just fill in
+    the message (the args may change later) and leave the formatting to the writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class LogPipeline:
+    """
+    Routes logging off the event loop. Loggers only put records on a queue (QueueHandler), and a background thread
+    (QueueListener) formats them and writes them to stderr and to the in-memory RecentLogs.
+    Noisy loggers are sampled before they are even queued.
+    """
+
+    def __init__(self, level: int = logging.INFO, sampling: Optional[Dict[str, int]] = None, as_json: bool = False,
+                 recent_lines: int = DEFAULT_RECENT_LINES, levels: Optional[Dict[str, int]] = None,
+                 stream: Optional[TextIO] = None):
+        """levels sets the level of individual loggers, e.g. {"discord.http": logging.DEBUG}. stream defaults to stderr."""
+        self.level = level
+        self.levels = levels or {}
+        self.sampling = SamplingFilter(DEFAULT_SAMPLING if sampling is None else sampling)
+        self.recent = RecentLogs(recent_lines)
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.queue_handler = _LocalQueueHandler(self.queue)
+        self.queue_handler.addFilter(self.sampling)
+
+        formatter = StructuredFormatter(as_json)
+        writer = logging.StreamHandler(stream)
+        writer.setFormatter(formatter)
+        self.recent.setFormatter(StructuredFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, writer, self.recent, respect_handler_level=True)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Puts the queue in front of every logger (the root logger) and starts the writer thread"""
+        with self._lock:
+            if self._started:
+                return
+            root = logging.getLogger()
+            root.setLevel(self.level)
+            root.addHandler(self.queue_handler)
+            for name, level in self.levels.items():
+                logging.getLogger(name).setLevel(level)
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        """Writes out whatever is still queued, then stops the thread"""
+        with self._lock:
+            if not self._started:
+                return
+            logging.getLogger().removeHandler(self.queue_handler)
+            self.listener.stop()
+            self._started = False
+
+    def stats(self) -> dict:
+        return {"buffered": len(self.recent.lines), "sampled_out": dict(self.sampling.dropped)}
@@ -0,0 +1,83 @@
+import time
+from typing import Dict, Optional, Tuple
+
+import discord
+
+# Entries older than this are refetched even if no gateway event said they changed. Events can be missed during a reconnect.
+DEFAULT_TTL = 6 * 60 * 60
+
+
+class MemberCache:
+    """
+    Caches the managed members and roles, and keeps them correct from gateway events
+    (on_member_update, on_member_remove, on_guild_role_update, on_guild_role_delete).
+
+    Only entries that were put() are tracked, so the events for the rest of the guild are ignored.
+    Members are kept per guild, so one cache can be shared by rotations in several guilds.
+    A lookup misses when the entry was never cached or is older than `ttl`, and the caller falls back to REST.
+    hits/misses count lookups, so you can check rotations are not going to the API for data that is already fresh.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+        self._members: Dict[Tuple[int, int], Tuple[discord.Member, float]] = {}  # (guild id, member id)
+        self._roles: Dict[int, Tuple[discord.Role, float]] = {}
+
+    def get_member(self, guild_id: int, member_id: int) -> Optional[discord.Member]:
+        return self._get(self._members, (guild_id, member_id))
+
+    def put_member(self, member: discord.Member):
+        self._members[(member.guild.id, member.id)] = (member, time.monotonic())
+
+    def forget_member(self, guild_id: int, member_id: int):
+        if self._members.pop((guild_id, member_id), None) is not None:
+            self.invalidations += 1
+
+    def get_role(self, role_id: int) -> Optional[discord.Role]:
+        return self._get(self._roles, role_id)
+
+    def put_role(self, role: discord.Role):
+        self._roles[role.id] = (role, time.monotonic())
+
+    def forget_role(self, role_id: int):
+        if self._roles.pop(role_id, None) is not None:
+            self.invalidations += 1
+
+    # --- Gateway events ---
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        if (after.guild.id, after.id) in self._members:
+            self.put_member(after)
+
+    def on_member_remove(self, member: discord.Member):
+        self.forget_member(member.guild.id, member.id)
+
+    def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if after.id in self._roles:
+            self.put_role(after)
+
+    def on_guild_role_delete(self, role: discord.Role):
+        self.forget_role(role.id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "members": len(self._members),
+            "roles": len(self._roles),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+    def _get(self, entries: dict, key):
+        entry = entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            del entries[key]  # Expired
+        self.misses += 1
+        return None
@@ -0,0 +1,259 @@
+"""
+Bulk adds members to a rotation, or writes its members out as CSV. No token needed.
+
+    python MemberImport.py export --rotation oncall > members.csv
+    python MemberImport.py import members.csv --rotation oncall
+    python MemberImport.py import - < ids.txt
+
+A file is member ids or mentions separated by spaces, commas or new lines, or a CSV with a member_id column
+(what export writes). Imports are written to the config like a hand edit. A running bot picks them up within a couple
+of seconds and fetches only the new members, and if any of them cant be found it keeps the old config.
+/import_members does the same in Discord and checks every member first.
+
+With SHARED_STATE set (or --shared), the rotation is read from and written to the replicas' state.db instead.
+"""
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from ConfigStore import JOURNAL_SEQ_KEY, write_atomic
+from SharedState import SharedState, SharedConfigStore, StaleConfig
+
+# An import is one message or one attachment, anything bigger than this is probably the wrong file
+MAX_IMPORT_ROWS = 1000
+MAX_IMPORT_BYTES = 256 * 1024
+# A shared import that keeps losing to the bot's own changes gives up after this many tries
+MAX_IMPORT_TRIES = 3
+# Column headers that hold the member id in a CSV
+ID_COLUMNS = ("member_id", "id", "user_id")
+EXPORT_COLUMNS = ("position", "member_id", "name", "weight", "on_duty")
+
+_MEMBER_TOKEN = re.compile(r"<@!?(\d+)>|(\d+)")
+_SEPARATORS = re.compile(r"[\s,;]+")
+_MAX_SNOWFLAKE = 2 ** 64 - 1
+
+# Row statuses
+ADDED = "added"
+ALREADY_LISTED = "already in the rotation"
+DUPLICATE = "listed twice"
+INVALID = "not a member id"
+NOT_FOUND = "not found"
+
+
+class ImportRow:
+    """One entry of an import: where it came from, the id it names, and what happened to it"""
+    __slots__ = ("row", "text", "member_id", "status", "detail")
+
+    def __init__(self, row: int, text: str, member_id: Optional[int], status: Optional[str] = None):
+        self.row = row
+        self.text = text
+        self.member_id = member_id
+        self.status = status  # None until the import has looked at it
+        self.detail = ""
+
+    def __str__(self):
+        detail = f" ({self.detail})" if self.detail else ""
+        return f"{self.row:>4}  {self.text[:24]:<24} {self.status}{detail}"
+
+
+class ImportReport:
+    """What an import did with every row, in the order they were given"""
+
+    def __init__(self, rows: List[ImportRow], seconds: float = 0.0):
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def added(self) -> List[ImportRow]:
+        return [row for row in self.rows if row.status == ADDED]
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for row in self.rows:
+            counts[row.status] = counts.get(row.status, 0) + 1
+        return counts
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{count} {status}" for status, count in self.counts().items())
+        return f"{len(self.rows)} row(s) in {self.seconds * 1000:.1f} ms: {counts or 'nothing to import'}"
+
+    def render(self, max_chars: Optional[int] = None) -> str:
+        """
+        The summary, then one line per row. With max_chars, the rows that werent added come first and whatever
+        doesnt fit is counted at the end, e.g. for a Discord message.
+        """
+        rows = self.rows
+        if max_chars is not None:
+            rows = [row for row in rows if row.status != ADDED] + self.added
+        lines = [self.summary()]
+        used = len(lines[0])
+        for shown, row in enumerate(rows):
+            line = row.__str__()
+            # Leave room for the "...and N more" line
+            if max_chars is not None and used + len(line) + 1 > max_chars - 24:
+                lines.append(f"...and {len(rows) - shown} more")
+                break
+            lines.append(line)
+            used += len(line) + 1
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.render()
+
+
+def parse_member_rows(text: str, first_row: int = 1) -> List[ImportRow]:
+    """
+    Reads ids and mentions (<@123>) separated by spaces, commas or new lines. If the first line is a CSV header with
+    a member_id (or id, user_id) column, only that column is read, so an export can be imported as it is.
+    Anything that isnt an id is kept as an INVALID row, so the report can point it out.
+    Raises ValueError for more than MAX_IMPORT_ROWS rows.
+    """
+    lines = text.splitlines()
+    header = next((line for line in lines if line.strip()), "")
+    columns = [column.strip().lower() for column in next(csv.reader([header]), [])]
+    id_column = next((columns.index(name) for name in ID_COLUMNS if name in columns), None)
+
+    if id_column is not None:
+        tokens = []
+        reader = csv.reader(io.StringIO(text))
+        next(reader)
+        for cells in reader:
+            if len(cells) > id_column and cells[id_column].strip():
+                tokens.append(cells[id_column].strip())
+    else:
+        tokens = [token for token in _SEPARATORS.split(text) if token]
+
+    if len(tokens) > MAX_IMPORT_ROWS:
+        raise ValueError(f"That is {len(tokens)} rows, at most {MAX_IMPORT_ROWS} can be imported at once")
+    return [member_row(first_row + number, token) for number, token in enumerate(tokens)]
+
+
+def member_row(row: int, token: str) -> ImportRow:
+    match = _MEMBER_TOKEN.fullmatch(token)
+    member_id = int(match.group(1) or match.group(2)) if match else None
+    if member_id is None or not 0 < member_id <= _MAX_SNOWFLAKE:
+        return ImportRow(row, token, None, INVALID)
+    return ImportRow(row, token, member_id)
+
+
+def check_duplicates(rows: Iterable[ImportRow], listed) -> List[int]:
+    """
+    Marks rows whose member is already in `listed` (anything supporting `in`, e.g. a RotationOrder),
+    or named by an earlier row. Returns the ids left to add, in order.
+    """
+    seen = set()
+    new_ids = []
+    for row in rows:
+        if row.status is not None:
+            continue
+        if row.member_id in listed:
+            row.status = ALREADY_LISTED
+        elif row.member_id in seen:
+            row.status = DUPLICATE
+        else:
+            seen.add(row.member_id)
+            new_ids.append(row.member_id)
+    return new_ids
+
+
+def export_csv(members: Iterable, index: int, weights: Dict[int, float]) -> str:
+    """The members in rotation order, as CSV with EXPORT_COLUMNS. members are MemberRecords."""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for position, member in enumerate(members):
+        writer.writerow((position, member.id, _cell(member.name), weights.get(member.id, 1),
+                         "yes" if position == index else ""))
+    return out.getvalue()
+
+
+def _cell(value: str) -> str:
+    # Names are chosen by the members. Spreadsheets run a cell starting with one of these as a formula
+    return "'" + value if value[:1] in ("=", "+", "-", "@") else value
+
+
+def import_into_config(store, rows: List[ImportRow], member_ids_key: str, index_key: str) -> ImportReport:
+    """
+    Appends the new ids of `rows` to a config on disk, for the CLI. store is the rotation's ConfigStore.
+    The config is read with its journal replayed, and written back as one snapshot that keeps journal_seq,
+    so the journal records it already contains arent replayed twice.
+    A SharedConfigStore gets one add_many record instead, like /import_members writes. It raises StaleConfig
+    if a replica changed the rotation in between, and then nothing was written.
+    """
+    start = time.perf_counter()
+    conf = store.read()
+    listed = conf[member_ids_key]
+    new_ids = check_duplicates(rows, set(listed))
+    for row in rows:
+        if row.status is None:
+            row.status = ADDED
+            row.detail = f"position {len(listed)}"
+            listed.append(row.member_id)
+    if new_ids and isinstance(store, SharedConfigStore):
+        store.append("add_many", member_ids=new_ids, index=conf[index_key])
+    elif new_ids:
+        write_atomic(store.path, {**conf, JOURNAL_SEQ_KEY: store.seq})
+    return ImportReport(rows, time.perf_counter() - start)
+
+
+def main():
+    # Only the CLI needs these, and RotationManager imports RoleRotation which imports this module
+    from RoleRotation import CONFIG_FILE_NAME, ConfKeys
+    from RotationManager import RotationManager, ROTATIONS_FILE_NAME, DEFAULT_ROTATION
+    from RotationPreview import rotation_from_config
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("file", nargs="?", type=argparse.FileType("r", encoding="utf-8-sig"), default="-",
+                        help="what to import, - (the default) reads stdin")
+    parser.add_argument("--rotation", default=DEFAULT_ROTATION, help="a name from rotations.json")
+    parser.add_argument("--rotations", type=Path, default=ROTATIONS_FILE_NAME, help="where rotations.json is")
+    parser.add_argument("--shared", type=Path, default=os.getenv("SHARED_STATE") or None,
+                        help="the replicas' state.db, SHARED_STATE by default")
+    args = parser.parse_args()
+
+    registry = RotationManager.read_registry(args.rotations)
+    if args.rotation not in registry:
+        parser.error(f"There is no rotation called '{args.rotation}'. Try one of: {', '.join(registry)}")
+    state = SharedState(args.shared) if args.shared is not None else None
+    rotation = rotation_from_config(Path(registry[args.rotation].get("config", CONFIG_FILE_NAME)), args.rotation, state)
+    try:
+        if args.action == "export":
+            sys.stdout.write(export_csv(rotation.members, rotation.index, rotation.weights))
+            return
+        text = args.file.read(MAX_IMPORT_BYTES + 1)
+        if len(text) > MAX_IMPORT_BYTES:
+            parser.error(f"The file is bigger than {MAX_IMPORT_BYTES // 1024} KiB")
+        for attempt in range(MAX_IMPORT_TRIES):
+            try:
+                rows = parse_member_rows(text)
+            except ValueError as e:
+                parser.error(str(e))
+            try:
+                report = import_into_config(rotation.store, rows, ConfKeys.MEMBER_IDS.value, ConfKeys.INDEX.value)
+                break
+            except StaleConfig:
+                if attempt + 1 == MAX_IMPORT_TRIES:
+                    parser.error("The bot kept changing the rotation while importing, nothing was written. Try again")
+        print(report)
+        if report.added and state is not None:
+            print(f"Wrote rotation '{args.rotation}' in {state.path}. "
+                  "These members are only checked with Discord once the replicas reload it.")
+        elif report.added:
+            print(f"Wrote {rotation.store.path}. These members are only checked with Discord once the bot reloads it.")
+    finally:
+        rotation.schedules.close()
+        rotation.history.close()
+        rotation.outbox.close()
+        if state is not None:
+            state.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import discord
+
+from MemberCache import MemberCache
+from OperationQueue import OperationQueue
+
+logger = logging.getLogger(__name__)
+
+# How many fetch_member REST calls may be in flight at once
+DEFAULT_FETCH_CONCURRENCY = 8
+# Discord caps a single gateway member request (op 8) at 100 user ids
+QUERY_MEMBERS_LIMIT = 100
+
+
+class MemberResolutionError(Exception):
+    """Raised (or returned) when some member ids could not be resolved. Holds the per-id failures."""
+
+    def __init__(self, failures: Dict[int, Exception]):
+        self.failures = failures
+        lines = (f"  {member_id}: {type(e).__name__} {e}" for member_id, e in failures.items())
+        super().__init__(f"Could not resolve {len(failures)} member(s):\n" + "\n".join(lines))
+
+
+class ResolveResult:
+    """The outcome of resolving a list of ids. `members` keeps the order of the ids that resolved."""
+
+    def __init__(self):
+        self.members: List[discord.Member] = []
+        self.failures: Dict[int, Exception] = {}
+        self.cache_hits: int = 0
+        self.chunked: int = 0
+        self.rest_calls: int = 0
+
+    def error(self) -> Optional[MemberResolutionError]:
+        return MemberResolutionError(self.failures) if self.failures else None
+
+    def __str__(self):
+        return (f"<ResolveResult resolved={len(self.members)} failed={len(self.failures)} "
+                f"cache={self.cache_hits} chunked={self.chunked} rest={self.rest_calls}>")
+
+
+class MemberResolver:
+    """
+    Turns member ids into discord.Member objects as cheaply as possible.
+
+    Lookup order:
+    0. The MemberCache, if one was given. Everything that resolves is put back into it
+    1. The gateway cache (guild.get_member), which costs nothing
+    2. Gateway chunking (guild.query_members), one request per 100 ids. Needs the members intent and a live websocket
+    3. REST (guild.fetch_member), run concurrently but never more than `concurrency` at once.
+       Goes through the OperationQueue if one was given, so it is rate limited and prioritized with everything else
+
+    A member that fails to resolve is reported in ResolveResult.failures, it never discards the members that did resolve.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_FETCH_CONCURRENCY, use_chunking: bool = True,
+                 cache: Optional[MemberCache] = None, operations: Optional[OperationQueue] = None):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.use_chunking = use_chunking
+        self.cache = cache
+        self.operations = operations
+
+    async def resolve(self, guild: discord.Guild, member_ids: Iterable[int]) -> ResolveResult:
+        member_ids = list(member_ids)
+        result = ResolveResult()
+        found: Dict[int, discord.Member] = {}
+
+        # 0 + 1. Our cache, then the gateway cache
+        misses = []
+        for member_id in dict.fromkeys(member_ids):  # dedupe but keep order
+            member = self.cache.get_member(guild.id, member_id) if self.cache is not None else None
+            if member is not None:
+                found[member_id] = member
+                result.cache_hits += 1
+                continue
+            member = guild.get_member(member_id)
+            if member is not None:
+                self._found(found, member)
+                result.cache_hits += 1
+            else:
+                misses.append(member_id)
+
+        # 2. Gateway chunking
+        if misses and self.use_chunking:
+            misses = await self._query_members(guild, misses, found, result)
+
+        # 3. REST, bounded
+        if misses:
+            await self._fetch_members(guild, misses, found, result)
+
+        result.members = [found[member_id] for member_id in member_ids if member_id in found]
+        return result
+
+    async def _query_members(self, guild, member_ids, found, result) -> List[int]:
+        """Asks the gateway for the members in batches. Returns the ids that are still missing."""
+        for start in range(0, len(member_ids), QUERY_MEMBERS_LIMIT):
+            batch = member_ids[start:start + QUERY_MEMBERS_LIMIT]
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+            except Exception as e:
+                # No members intent, not connected yet (setup_hook runs before the gateway), or a chunk timeout.
+                # REST still works in all of those cases so just fall through to it.
+                logger.info("Gateway member query unavailable, falling back to REST: %s %s", type(e).__name__, e)
+                break
+            for member in members:
+                self._found(found, member)
+                result.chunked += 1
+        return [member_id for member_id in member_ids if member_id not in found]
+
+    async def _fetch_members(self, guild, member_ids, found, result):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(member_id):
+            async with semaphore:
+                result.rest_calls += 1
+                try:
+                    if self.operations is not None:
+                        member = await self.operations.fetch_member(guild, member_id)
+                    else:
+                        member = await guild.fetch_member(member_id)
+                    self._found(found, member)
+                except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+                    result.failures[member_id] = e
+
+        await asyncio.gather(*(fetch(member_id) for member_id in member_ids))
+
+    def _found(self, found: Dict[int, discord.Member], member: discord.Member):
+        found[member.id] = member
+        if self.cache is not None:
+            self.cache.put_member(member)
@@ -0,0 +1,238 @@
+import bisect
+import contextvars
+import functools
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# METRICS=0 turns all of this off. The decorators then hand back the function untouched and nothing is registered,
+# so a disabled build runs exactly the code it would without this module.
+ENABLED = os.getenv("METRICS", "1").lower() not in ("0", "false", "no", "off")
+DEFAULT_METRICS_PORT = 9464
+PREFIX = "rolebot_"
+# Seconds. Everything from a cache hit to a slow chunked load fits in here
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    "operation_seconds": "How long each RoleRotation operation took",
+    "operation_errors_total": "RoleRotation operations that raised or returned an error",
+    "api_calls_total": "Discord API calls made through the operation queue, by call and by the operation that asked",
+    "api_errors_total": "Discord API calls that failed",
+    "api_seconds": "How long each Discord API call took, not counting the time queued",
+    "command_seconds": "How long each slash command handler took",
+    "command_errors_total": "Slash commands that failed",
+    "command_work_seconds": "How long the background work of a slash command took",
+    "scheduler_lag_seconds": "How late APScheduler started a rotation job after its scheduled time",
+}
+
+# The RoleRotation operation running in this task, so the API calls it makes can be counted against it
+current_operation: contextvars.ContextVar = contextvars.ContextVar("current_operation", default="")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def labels_of(**labels) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """Cumulative-style buckets like Prometheus expects, counted per bucket so an observation is one bisect"""
+    __slots__ = ("bounds", "counts", "sum", "count", "max")
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """An upper bound: the edge of the bucket the q-th observation fell in, or the max for the last bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by name and labels, kept in plain dicts on the event loop (no locks needed).
+    render() gives the Prometheus text format, summary() a short version for /metrics.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.started = time.time()
+
+    def inc(self, name: str, labels: Labels = (), amount: float = 1):
+        series = self.counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram()
+        histogram.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        series = self.counters.get(name, {})
+        wanted = set(labels_of(**labels))
+        return sum(value for key, value in series.items() if wanted <= set(key))
+
+    def render(self) -> str:
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines += _header(name, "counter")
+            lines += [f"{PREFIX}{name}{_format_labels(labels)} {_number(value)}" for labels, value in sorted(series.items())]
+        for name, series in sorted(self.histograms.items()):
+            lines += _header(name, "histogram")
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_number(histogram.sum)}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """One line per histogram series: count, errors, p50, p95 and max in ms"""
+        lines = [f"Since {time.strftime('%Y-%m-%d %H:%M', time.localtime(self.started))}. "
+                 f"count / errors / p50 / p95 / max ms (percentiles are bucket edges)"]
+        errors_of = {"operation_seconds": "operation_errors_total", "api_seconds": "api_errors_total",
+                     "command_seconds": "command_errors_total"}
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"{name}:")
+            errors = self.counters.get(errors_of.get(name, ""), {})
+            for labels, histogram in sorted(series.items()):
+                failed = sum(value for key, value in errors.items() if set(labels) <= set(key))
+                label = ",".join(value for key, value in labels) or "-"
+                lines.append(f"  {label:<22} {histogram.count:>6} {int(failed):>4} {histogram.quantile(0.5) * 1000:>8.1f} "
+                             f"{histogram.quantile(0.95) * 1000:>8.1f} {histogram.max * 1000:>8.1f}")
+        calls = self.counters.get("api_calls_total", {})
+        if calls:
+            per_op: Dict[str, float] = {}
+            for labels, value in calls.items():
+                op = dict(labels).get("op") or "-"
+                per_op[op] = per_op.get(op, 0) + value
+            lines.append("api calls by operation: " + ", ".join(f"{op} {int(value)}" for op, value in sorted(per_op.items())))
+        return "\n".join(lines)
+
+
+METRICS = MetricsRegistry()
+
+
+def timed(name: str = "operation"):
+    """
+    Times an async method into <name>_seconds{op=<method>} and counts <name>_errors_total when it raises or returns
+    an Exception (load_config and reload_config return theirs). API calls made while it runs are counted against it.
+    When metrics are off this returns the method as it is.
+    """
+    def decorator(fn: Callable) -> Callable:
+        if not ENABLED:
+            return fn
+        labels = labels_of(op=fn.__name__)
+        seconds, errors = f"{name}_seconds", f"{name}_errors_total"
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = current_operation.set(fn.__name__)
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = await fn(*args, **kwargs)
+                failed = isinstance(result, Exception)
+                return result
+            finally:
+                METRICS.observe(seconds, time.perf_counter() - start, labels)
+                if failed:
+                    METRICS.inc(errors, labels)
+                current_operation.reset(token)
+        return wrapper
+    return decorator
+
+
+def record_api_call(kind: str, op: Optional[str], seconds: float, error: Optional[BaseException]):
+    labels = labels_of(call=kind, op=op or "")
+    METRICS.inc("api_calls_total", labels)
+    METRICS.observe("api_seconds", seconds, labels_of(call=kind))
+    if error is not None:
+        METRICS.inc("api_errors_total", labels_of(call=kind, error=type(error).__name__))
+
+
+def record_scheduler_lag(job_id: str, scheduled: List, now: float):
+    """For APScheduler's EVENT_JOB_SUBMITTED. Job ids are rotate:<name>, or rotate:<name>:catch_up:<time>"""
+    parts = job_id.split(":")
+    labels = labels_of(rotation=parts[1] if len(parts) > 1 else job_id)
+    for run_time in scheduled:
+        METRICS.observe("scheduler_lag_seconds", max(0.0, now - run_time.timestamp()), labels)
+
+
+class MetricsServer:
+    """
+    Serves METRICS in the Prometheus text format at http://127.0.0.1:<port>/metrics.
+    Only on localhost, it is for a scraper on the same machine and has no auth.
+    """
+
+    def __init__(self, registry: MetricsRegistry = METRICS, host: str = "127.0.0.1", port: int = DEFAULT_METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        # aiohttp comes with discord.py, but only the bot needs it, not the preview CLI
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if self.port == 0:
+            # An OS picked port, for the benchmark
+            self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def _header(name: str, kind: str) -> List[str]:
+    lines = []
+    if name in DESCRIPTIONS:
+        lines.append(f"# HELP {PREFIX}{name} {DESCRIPTIONS[name]}")
+    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+    return lines
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
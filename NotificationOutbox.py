@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import discord
+
+from OperationQueue import Bucket
+from SQLiteWriter import SQLiteWriter, connect
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_DB_NAME = "outbox.db"
+# Where a notification goes
+DM = "dm"
+CHANNEL = "channel"
+# (messages, per seconds) over every destination. Discord allows about 5 per 5 seconds in one channel
+DEFAULT_RATE = (5, 5.0)
+# A failed send is retried after retry_delay, doubling every attempt up to MAX_RETRY_DELAY, this many times in total
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 30.0
+MAX_RETRY_DELAY = 60 * 60
+# Sent and failed rows are kept this long so the same key isnt sent again, then pruned on start
+DEFAULT_KEEP = 7 * 24 * 60 * 60
+# How many due rows are read at once, and how many destinations are sent to at the same time
+BATCH_SIZE = 50
+DEFAULT_CONCURRENCY = 4
+MESSAGE_LIMIT = 2000
+
+# send(kind, target id, content), raises like discord.py does when it fails
+Send = Callable[[str, int, str], Awaitable[None]]
+
+
+class NotificationOutbox:
+    """
+    Delivers notifications (DMs and channel posts) in the background, from a small SQLite queue (outbox.db).
+
+    enqueue() only inserts a row (on a SQLiteWriter, like marking rows sent) and wakes the worker, so whoever notifies
+    never waits on Discord. Each row has a key, and a key that is already in the outbox is ignored, so planning the
+    same reminder again (after a restart or a /reload) doesnt send it twice.
+    The worker sends whatever is due through one rate limit bucket, to up to `concurrency` destinations at once.
+    Rows due for the same destination at the same time go out as one message. A failed send is retried with backoff,
+    except when it can never work (DMs closed, channel deleted), then the row is marked failed.
+    A row is only marked sent after the send returned, so a crash in between sends it again on the next start
+    rather than losing it.
+    """
+
+    def __init__(self, path: Path, send: Optional[Send] = None, rate: Tuple[int, float] = DEFAULT_RATE,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retry_delay: float = DEFAULT_RETRY_DELAY,
+                 keep: float = DEFAULT_KEEP, concurrency: int = DEFAULT_CONCURRENCY, poll: Optional[float] = None):
+        """
+        send can be set later, before start(). Without it rows are only queued.
+        poll is the longest the worker sleeps, for when other processes queue rows too. None only wakes for our own.
+        """
+        self.path = path
+        self.send = send
+        self.bucket = Bucket(*rate)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.keep = keep
+        self.concurrency = concurrency
+        self.poll = poll
+
+        self.sent: int = 0  # Messages, a batch of rows to one destination is one
+        self.retried: int = 0
+        self.failed: int = 0
+        self.duplicates: int = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # Of the worker, so the writer thread can wake it
+
+        self._db = connect(path)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    key TEXT PRIMARY KEY,
+                    rotation TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    target_id INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    next_attempt REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    done REAL,
+                    last_error TEXT
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)")
+        self.writer = SQLiteWriter(path, "NotificationOutbox")
+
+    def enqueue(self, key: str, rotation: str, kind: str, target_id: int, content: str,
+                due: Optional[float] = None) -> Future:
+        """
+        Queues a message to be sent at `due` (a time.time() timestamp, now by default). The row is inserted in the
+        background and the worker woken once it is. The future has False if a row with this key was already queued or sent.
+        """
+        now = time.time()
+        future = self.writer.submit(_insert, (key, rotation, kind, target_id, content, now, due or now))
+        future.add_done_callback(self._inserted)
+        return future
+
+    async def wait(self):
+        """Until every row enqueued so far is in the outbox"""
+        await self.writer.wait()
+
+    def start(self):
+        """Prunes old rows and starts the worker. Rows left pending by the last run are sent too."""
+        self.writer.submit(_prune, time.time() - self.keep)
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.get_running_loop().create_task(self._work(), name="NotificationOutbox")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def close(self):
+        """Stops the worker, then closes the writer"""
+        self.stop()
+        self._loop = None
+        self.writer.close()
+        self._db.close()
+
+    async def deliver_due(self) -> Optional[float]:
+        """Sends every row that is due now. Returns the seconds until the next row is due, None if none is pending."""
+        while True:
+            now = time.time()
+            rows = self._db.execute(
+                "SELECT key, kind, target_id, content, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt, rowid LIMIT ?",
+                (now, BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            batches: Dict[Tuple[str, int], List[tuple]] = {}
+            for row in rows:
+                batches.setdefault((row[1], row[2]), []).append(row)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def deliver(kind, target_id, batch):
+                # One destination at a time gets its messages in order
+                async with semaphore:
+                    for part in _fit(batch):
+                        await self._deliver(kind, target_id, part)
+
+            await asyncio.gather(*(deliver(kind, target_id, batch) for (kind, target_id), batch in batches.items()))
+
+        upcoming = self._db.execute("SELECT MIN(next_attempt) FROM outbox WHERE status = 'pending'").fetchone()[0]
+        return None if upcoming is None else max(0.0, upcoming - time.time())
+
+    async def _deliver(self, kind: str, target_id: int, rows: List[tuple]):
+        # Nothing awaits between the check and the take, so concurrent sends share the bucket correctly
+        wait = self.bucket.wait_time()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.bucket.wait_time()
+        self.bucket.take()
+        keys = [(row[0],) for row in rows]
+        try:
+            await self.send(kind, target_id, "\n".join(row[3] for row in rows))
+        except (discord.Forbidden, discord.NotFound) as e:
+            # DMs turned off, or the channel or member is gone. Trying again wont change that
+            logger.warning("Couldn't send a notification to %s %d, giving up: %s", kind, target_id, e)
+            await self._finish(keys, "failed", e)
+            self.failed += len(rows)
+        except Exception as e:
+            attempts = rows[0][4] + 1
+            if attempts >= self.max_attempts:
+                logger.error("Couldn't send a notification to %s %d after %d attempts: %s", kind, target_id, attempts, e)
+                await self._finish(keys, "failed", e)
+                self.failed += len(rows)
+                return
+            delay = min(self.retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+            logger.info("Couldn't send a notification to %s %d, retrying in %.0f s: %s", kind, target_id, delay, e)
+            await self._write(_mark_retry, [(time.time() + delay, f"{type(e).__name__}: {e}", key) for key, in keys])
+            self.retried += len(rows)
+        else:
+            await self._finish(keys, "sent")
+            self.sent += 1
+
+    async def _finish(self, keys: List[tuple], status: str, error: Optional[Exception] = None):
+        await self._write(_mark_done, [(status, time.time(), error and f"{type(error).__name__}: {error}", key)
+                                       for key, in keys])
+
+    async def _write(self, write, rows: List[tuple]):
+        # Shielded, stopping the worker right after a send should still mark it, or the next start sends it again
+        await asyncio.shield(asyncio.wrap_future(self.writer.submit(write, rows)))
+
+    def _inserted(self, future: Future):
+        # On the writer thread
+        if future.cancelled() or future.exception() is not None:
+            return  # The writer logged it
+        if not future.result():
+            self.duplicates += 1
+            return
+        loop, wake = self._loop, self._wake
+        if loop is not None and wake is not None:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # The loop is closed already, the row is sent on the next start
+
+    async def _work(self):
+        while True:
+            self._wake.clear()
+            try:
+                delay = await self.deliver_due() if self.send is not None else None
+            except Exception as e:
+                # Keep the worker alive, the rows are still there for the next pass
+                logger.exception("Notification delivery failed: %s", e)
+                delay = self.retry_delay
+            if self.poll is not None:
+                delay = self.poll if delay is None else min(delay, self.poll)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def pending(self, rotation: Optional[str] = None) -> List[tuple]:
+        """(key, kind, target id, next attempt) of the rows not sent yet, soonest first"""
+        query = "SELECT key, kind, target_id, next_attempt FROM outbox WHERE status = 'pending'"
+        params: tuple = ()
+        if rotation is not None:
+            query += " AND rotation = ?"
+            params = (rotation,)
+        return self._db.execute(query + " ORDER BY next_attempt", params).fetchall()
+
+    def stats(self) -> dict:
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {"pending": counts.get("pending", 0), "sent": self.sent, "retried": self.retried, "failed": self.failed,
+                "duplicates": self.duplicates}
+
+
+def _insert(db: sqlite3.Connection, row: tuple) -> bool:
+    cursor = db.execute("INSERT OR IGNORE INTO outbox (key, rotation, kind, target_id, content, created, next_attempt) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+    return bool(cursor.rowcount)
+
+
+def _mark_retry(db: sqlite3.Connection, rows: List[tuple]):
+    db.executemany("UPDATE outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE key = ?", rows)
+
+
+def _mark_done(db: sqlite3.Connection, rows: List[tuple]):
+    db.executemany("UPDATE outbox SET status = ?, done = ?, last_error = ? WHERE key = ?", rows)
+
+
+def _prune(db: sqlite3.Connection, before: float):
+    db.execute("DELETE FROM outbox WHERE status != 'pending' AND done < ?", (before,))
+
+
+def _fit(rows: List[tuple]) -> List[List[tuple]]:
+    """Splits rows for one destination into groups whose joined content fits in one message"""
+    parts, part, size = [], [], 0
+    for row in rows:
+        if part and size + len(row[3]) + 1 > MESSAGE_LIMIT:
+            parts.append(part)
+            part, size = [], 0
+        part.append(row)
+        size += len(row[3]) + 1
+    if part:
+        parts.append(part)
+    return parts
@@ -0,0 +1,239 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import discord
+
+from Metrics import ENABLED as METRICS_ENABLED, current_operation, record_api_call
+
+# Lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("operation_priority", default=BACKGROUND)
+
+# (calls, per seconds) for each bucket. Discord doesnt publish these, they are conservative guesses.
+# discord.py still handles any real 429, these just keep us from running into them in the first place.
+DEFAULT_BUCKETS = {
+    "member_roles": (10, 10.0),
+    "fetch_member": (50, 1.0),  # The global limit, 50 requests a second
+}
+DEFAULT_CONCURRENCY = 8
+
+
+@contextlib.contextmanager
+def interactive():
+    """Everything queued inside this block (and in tasks started from it) jumps ahead of scheduled work"""
+    token = _priority.set(INTERACTIVE)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class Bucket:
+    """
+    A stand-in for one Discord rate limit bucket: `calls` per window of `per` seconds. Like Discord's, the window
+    opens with the first call and the whole allowance comes back when it resets, so a burst goes out at once instead
+    of trickling out one call every per / calls seconds.
+    """
+
+    def __init__(self, calls: int, per: float):
+        self.calls = calls
+        self.per = per
+        self.remaining = calls
+        self.reset_at: Optional[float] = None  # None until a call opens the window
+
+    def wait_time(self) -> float:
+        """Seconds until a call is allowed. 0 means one can go now."""
+        now = time.monotonic()
+        if self.reset_at is not None and now >= self.reset_at:
+            self.remaining = self.calls
+            self.reset_at = None
+        return 0.0 if self.remaining >= 1 else self.reset_at - now
+
+    def take(self):
+        if self.reset_at is None:
+            self.reset_at = time.monotonic() + self.per
+        self.remaining -= 1
+
+
+class Operation:
+    def __init__(self, kind: str, bucket: str, key, priority: int, run: Callable[[], Awaitable]):
+        self.kind = kind
+        self.bucket = bucket
+        self.key = key
+        self.priority = priority
+        self.run = run
+        self.enqueued = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.started = False
+        self.caller = current_operation.get()  # The RoleRotation operation that queued it, for the metrics
+
+
+def _metered(execute):
+    """Counts and times every API call for Metrics, against the operation that queued it. Nothing at all when metrics are off."""
+    if not METRICS_ENABLED:
+        return execute
+
+    @functools.wraps(execute)
+    async def wrapper(self, op: Operation):
+        start = time.perf_counter()
+        await execute(self, op)
+        future = op.future
+        error = future.exception() if future.done() and not future.cancelled() else None
+        record_api_call(op.kind, op.caller, time.perf_counter() - start, error)
+    return wrapper
+
+
+class OperationQueue:
+    """
+    Every role add/remove and member fetch goes through here instead of straight to discord.py.
+
+    - Interactive work (slash commands, see interactive()) runs ahead of background work (scheduled rotations)
+    - Each operation waits for a token from its rate limit bucket instead of running into a 429
+    - An identical operation that is already queued is shared instead of sent twice
+    - A role add and remove for the same member and role supersede each other, only the newest one is kept.
+      Whether the member already has the role is up to the caller: the Member it passes may be a stale REST copy
+    - stats() reports the queue depth, wait times and how much was merged
+    """
+
+    def __init__(self, buckets: Dict[str, Tuple[int, float]] = None, concurrency: int = DEFAULT_CONCURRENCY):
+        self.buckets = {name: Bucket(*limits) for name, limits in (buckets or DEFAULT_BUCKETS).items()}
+        self.concurrency = concurrency
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._pending: Dict[tuple, Operation] = {}
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._running: set = set()  # Holds the tasks so they arent garbage collected mid-call
+
+        # --- Metrics ---
+        self.executed: Dict[str, int] = {}
+        self.merged: int = 0  # Shared with an identical queued operation
+        self.superseded: int = 0  # Replaced by a newer, opposite operation
+        self.waits: Dict[int, list] = {INTERACTIVE: [0, 0.0, 0.0], BACKGROUND: [0, 0.0, 0.0]}  # count, total, max
+
+    # --- Operations ---
+    async def add_role(self, member: discord.Member, role: discord.Role) -> bool:
+        """Returns False if no API call was needed (superseded by a remove)"""
+        return await self._role_op("add_role", member, role)
+
+    async def remove_role(self, member: discord.Member, role: discord.Role) -> bool:
+        """Returns False if no API call was needed (superseded by an add)"""
+        return await self._role_op("remove_role", member, role)
+
+    async def fetch_member(self, guild: discord.Guild, member_id: int) -> discord.Member:
+        key = ("fetch_member", guild.id, member_id)
+        existing = self._pending.get(key)
+        if existing is not None:
+            self.merged += 1
+            return await asyncio.shield(existing.future)
+        op = Operation("fetch_member", "fetch_member", key, _priority.get(), lambda: guild.fetch_member(member_id))
+        return await self._submit(op)
+
+    async def _role_op(self, kind: str, member: discord.Member, role: discord.Role) -> bool:
+        key = ("role", member.id, role.id)
+        priority = _priority.get()
+        existing = self._pending.get(key)
+        in_flight = existing is not None and existing.started
+        if existing is not None and not in_flight:
+            if existing.kind == kind:
+                self.merged += 1
+                return await asyncio.shield(existing.future)
+            # The newer operation decides the final state, the older one never needs to run
+            self._pending.pop(key)
+            existing.future.set_result(False)
+            self.superseded += 1
+            priority = min(priority, existing.priority)
+
+        if kind == "add_role":
+            run = lambda: member.add_roles(role)
+        else:
+            run = lambda: member.remove_roles(role)
+        return await self._submit(Operation(kind, "member_roles", key, priority, run)) is not False
+
+    # --- Queue ---
+    async def _submit(self, op: Operation):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        self._pending[op.key] = op
+        self._queue.put_nowait((op.priority, next(self._counter), op))
+        return await asyncio.shield(op.future)
+
+    async def _dispatch(self):
+        while True:
+            priority, order, op = await self._queue.get()
+            if op.future.done():
+                continue  # Superseded while it was waiting
+
+            bucket = self.buckets.get(op.bucket)
+            wait = bucket.wait_time() if bucket is not None else 0
+            if wait > 0:
+                # Put it back and sleep, so anything more urgent that shows up meanwhile gets picked first
+                self._queue.put_nowait((priority, order, op))
+                await asyncio.sleep(wait)
+                continue
+            if bucket is not None:
+                bucket.take()
+
+            await self._semaphore.acquire()
+            op.started = True
+            self._record_wait(op)
+            task = asyncio.get_running_loop().create_task(self._execute(op))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    @_metered
+    async def _execute(self, op: Operation):
+        try:
+            result = await op.run()
+            if not op.future.done():
+                op.future.set_result(True if result is None else result)
+        except Exception as e:
+            if not op.future.done():
+                op.future.set_exception(e)
+        finally:
+            self.executed[op.kind] = self.executed.get(op.kind, 0) + 1
+            if self._pending.get(op.key) is op:
+                del self._pending[op.key]
+            self._semaphore.release()
+
+    def _record_wait(self, op: Operation):
+        waited = time.monotonic() - op.enqueued
+        stats = self.waits.setdefault(op.priority, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for op in self._pending.values() if not op.started)
+
+    def stats(self) -> dict:
+        waits = {}
+        for priority, (count, total, longest) in self.waits.items():
+            waits[PRIORITY_NAMES.get(priority, priority)] = {
+                "count": count,
+                "avg_ms": total * 1000 / count if count else 0.0,
+                "max_ms": longest * 1000,
+            }
+        return {
+            "depth": self.depth,
+            "executed": dict(self.executed),
+            "merged": self.merged,
+            "superseded": self.superseded,
+            "wait": waits,
+        }
@@ -0,0 +1,51 @@
+import bisect
+from typing import Iterable, List, Set, Tuple
+
+
+class PrefixIndex:
+    """
+    Finds members by the start of their name, of any word in their name, or of their id, for autocomplete.
+
+    Every key is kept next to the member id in one sorted list of (key, id) pairs, so a search is a bisect to the
+    first key with the prefix and a walk while keys still start with it. It never looks at members that dont match.
+    add() and discard() keep the list sorted in place, so a member joining, leaving or being renamed costs
+    a few bisects instead of a rebuild. Keys are casefolded, so matching ignores case.
+    """
+
+    def __init__(self, members: Iterable[Tuple[int, str]] = ()):
+        """members are (id, name) pairs to start with, sorted once instead of inserted one by one"""
+        self._entries: List[Tuple[str, int]] = sorted(
+            (key, member_id) for member_id, name in members for key in self.keys(member_id, name))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def keys(member_id: int, name: str) -> Set[str]:
+        name = name.casefold()
+        return {str(member_id), name, *name.split()}
+
+    def add(self, member_id: int, name: str):
+        for key in self.keys(member_id, name):
+            bisect.insort(self._entries, (key, member_id))
+
+    def discard(self, member_id: int, name: str):
+        """Removes what add(member_id, name) added. name has to be the one it was added with."""
+        for key in self.keys(member_id, name):
+            position = bisect.bisect_left(self._entries, (key, member_id))
+            if position < len(self._entries) and self._entries[position] == (key, member_id):
+                del self._entries[position]
+
+    def search(self, prefix: str, limit: int) -> List[int]:
+        """Up to `limit` member ids with a key starting with `prefix`, in key order, each once"""
+        prefix = prefix.strip().casefold()
+        entries = self._entries
+        found = {}  # Keeps insertion order, and a member can match by several keys
+        position = bisect.bisect_left(entries, (prefix,))
+        while position < len(entries) and len(found) < limit:
+            key, member_id = entries[position]
+            if not key.startswith(prefix):
+                break
+            found[member_id] = None
+            position += 1
+        return list(found)
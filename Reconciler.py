@@ -0,0 +1,56 @@
+import asyncio
+import time
+from typing import Callable, Iterable, Optional
+
+# Seconds between drift checks. A check that finds nothing wrong makes no API calls
+DEFAULT_RECONCILE_INTERVAL = 15 * 60
+
+
+class Reconciler:
+    """
+    Periodically makes sure each rotation's role is held by exactly the member on duty.
+
+    Manual role edits, a failed add_roles or a crash halfway through a rotation would otherwise leave the role wrong
+    until the next rotation. Each check is RoleRotation.reconcile, submitted to the rotation's executor so it never
+    interleaves with a command. It only looks at the caches, and only the differences turn into (queued) API calls.
+    """
+
+    def __init__(self, rotations: Callable[[], Iterable], interval: float = DEFAULT_RECONCILE_INTERVAL):
+        """rotations returns the RoleRotations to check. It is called on every pass."""
+        self.rotations = rotations
+        self.interval = interval
+        self.checks: int = 0
+        self.repairs: int = 0  # Role changes made, over all checks
+        self.last_run: Optional[float] = None  # time.time() of the last pass
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop(), name="Reconciler")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def reconcile_all(self) -> int:
+        """One pass over every rotation. Returns how many role changes it made."""
+        repaired = 0
+        for rotation in self.rotations():
+            try:
+                added, removed = await rotation.executor.submit("reconcile", rotation.reconcile, merge=True)
+            except Exception as e:
+                rotation.log.error("Couldn't reconcile: %s", e)
+                continue
+            repaired += len(added) + len(removed)
+        self.checks += 1
+        self.repairs += repaired
+        self.last_run = time.time()
+        return repaired
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.reconcile_all()
+
+    def stats(self) -> dict:
+        return {"checks": self.checks, "repairs": self.repairs, "last_run": self.last_run}
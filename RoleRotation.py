@@ -1,17 +1,38 @@
 import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 from operator import index
 from pathlib import (Path)
 from random import random
-from typing import override, List, Optional
+from typing import override, Callable, FrozenSet, List, Optional, Tuple, Union
 
 import discord
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 import functools
 import asyncio
 
 from discord.ext.commands.parameters import empty
 
+from MemberCache import MemberCache
+from MemberImport import ImportReport, ImportRow, check_duplicates, ADDED, NOT_FOUND
+from OperationQueue import OperationQueue
+from MemberResolver import MemberResolver, DEFAULT_FETCH_CONCURRENCY
+from Metrics import timed
+from NotificationOutbox import NotificationOutbox, OUTBOX_DB_NAME, DM, CHANNEL
+from ConfigStore import ConfigStore, write_atomic
+from HistoryStore import HistoryStore, HISTORY_DB_NAME
+from RotationExecutor import RotationExecutor
+from RotationOrder import MemberRecord, RotationOrder, cursor_after_remove, cursor_after_move
+from RotationStrategy import (RotationStrategy, Availability, Window, make_strategy, ROUND_ROBIN, weights_from_conf,
+                              weights_to_conf, windows_from_conf, windows_to_conf)
+from ScheduleStore import ScheduleStore, SCHEDULE_DB_NAME
+from SharedState import SharedState, SharedConfigStore, StaleConfig
+
+logger = logging.getLogger(__name__)
+
 
 class Days(int, Enum):
     MONDAY = 0
@@ -30,10 +51,127 @@ class ConfKeys(str, Enum):
     SCHEDULE_MINUTE = "schedule_minute"
     INDEX = "index"
     MEMBER_IDS = "member_ids"
+    STRATEGY = "strategy"
+    WEIGHTS = "weights"  # member id -> weight, for the weighted strategy
+    UNAVAILABLE = "unavailable"  # member id -> [[start, end], ...] ISO times when they cant be put on duty
+    NOTIFY = "notify"  # {"dm": bool, "channel_id": id or null, "remind_hours": [hours before a rotation, ...]}
+
+
+# Keys an older config may not have yet, and what they mean when they are missing
+OPTIONAL_CONF_KEYS = {
+    ConfKeys.STRATEGY: ROUND_ROBIN,
+    ConfKeys.WEIGHTS: {},
+    ConfKeys.UNAVAILABLE: {},
+    ConfKeys.NOTIFY: {},
+}
+
+# The keys a journal op sets outright, instead of changing part of the member list
+JOURNAL_SETS = {
+    "rotate": (ConfKeys.INDEX.value,),
+    "set_index": (ConfKeys.INDEX.value,),
+    "set_schedule": (ConfKeys.SCHEDULE_DAY.value, ConfKeys.SCHEDULE_HOUR.value, ConfKeys.SCHEDULE_MINUTE.value),
+    "set_strategy": (ConfKeys.STRATEGY.value,),
+    "set_weight": (ConfKeys.WEIGHTS.value,),
+    "set_unavailable": (ConfKeys.UNAVAILABLE.value,),
+    "set_notify": (ConfKeys.NOTIFY.value,),
+}
 
+CONFIG_FILE_NAME = Path("./conf.json")
+# A rotation missed while the bot was down is still done on startup if it is at most this many seconds late.
+# None catches up no matter how late it is
+DEFAULT_MISFIRE_GRACE = 24 * 60 * 60
+# Stop counting missed rotations after this many, e.g. after the bot was down for a year
+MAX_MISSED_FIRES = 60
 
 
-CONFIG_FILE_NAME = Path("./conf.json")
+def apply_journal_record(conf: dict, record: dict, keep: FrozenSet[str] = frozenset()) -> Tuple[str, ...]:
+    """
+    Replays one record written by RoleRotation.journal onto a config dict read from disk.
+    Only rotate and set_index set the index. A remove or move shifts it like RoleRotation does, so whoever it pointed
+    at stays on duty, and an index edited by hand since the snapshot isnt overwritten by every later record.
+
+    A record that would set one of the keys in `keep` (edited by hand, see ConfigStore) is skipped. Returns the keys
+    it skipped it for. The member list is never kept, adds, removes and moves go on top of an edited one.
+    """
+    op = record["op"]
+    kept = tuple(key for key in JOURNAL_SETS.get(op, ()) if key in keep)
+    if kept:
+        return kept
+    member_ids = conf[ConfKeys.MEMBER_IDS.value]
+    if op == "add":
+        member_ids.insert(record["position"], record["member_id"])
+    elif op == "add_many":
+        member_ids.extend(record["member_ids"])
+    elif op == "remove":
+        position = member_ids.index(record["member_id"])
+        del member_ids[position]
+        conf[ConfKeys.INDEX.value] = cursor_after_remove(conf[ConfKeys.INDEX.value], position)
+        conf.get(ConfKeys.WEIGHTS.value, {}).pop(str(record["member_id"]), None)
+        conf.get(ConfKeys.UNAVAILABLE.value, {}).pop(str(record["member_id"]), None)
+    elif op == "move":
+        old = member_ids.index(record["member_id"])
+        del member_ids[old]
+        member_ids.insert(record["position"], record["member_id"])
+        conf[ConfKeys.INDEX.value] = cursor_after_move(conf[ConfKeys.INDEX.value], old, record["position"])
+    elif op == "set_schedule":
+        conf[ConfKeys.SCHEDULE_DAY.value] = record["day"]
+        conf[ConfKeys.SCHEDULE_HOUR.value] = record["hour"]
+        conf[ConfKeys.SCHEDULE_MINUTE.value] = record["minute"]
+    elif op == "set_strategy":
+        conf[ConfKeys.STRATEGY.value] = record["strategy"]
+    elif op == "set_weight":
+        weights = conf.setdefault(ConfKeys.WEIGHTS.value, {})
+        if record["weight"] is None:
+            weights.pop(str(record["member_id"]), None)
+        else:
+            weights[str(record["member_id"])] = record["weight"]
+    elif op == "set_unavailable":
+        unavailable = conf.setdefault(ConfKeys.UNAVAILABLE.value, {})
+        if record["windows"]:
+            unavailable[str(record["member_id"])] = record["windows"]
+        else:
+            unavailable.pop(str(record["member_id"]), None)
+    elif op == "set_notify":
+        conf[ConfKeys.NOTIFY.value] = record["notify"]
+    elif op in ("rotate", "set_index"):
+        conf[ConfKeys.INDEX.value] = record["index"]
+    else:
+        raise ValueError(f"Unknown journal op {op}")
+    return ()
+
+
+class RotationReport:
+    """Describes what a call to rotate_role actually changed"""
+
+    def __init__(self, previous_index: int, index: int, added: list, removed: list, repair: bool = False):
+        self.previous_index = previous_index
+        self.index = index
+        self.added = added
+        self.removed = removed
+        self.repair = repair
+
+    def __str__(self):
+        return (f"Rotated {self.previous_index} -> {self.index}{' (repair)' if self.repair else ''}\n"
+                f"Added: {[m.name for m in self.added]}\n"
+                f"Removed: {[m.name for m in self.removed]}")
+
+
+class ReloadReport:
+    """
+    Describes what a call to reload_config had to redo, and how long it took.
+    `conflicts` are the keys edited by hand that a change still in the journal also set. The hand edit was kept.
+    """
+
+    def __init__(self, parts: List[str], seconds: float, conflicts: List[str] = ()):
+        self.parts = parts
+        self.seconds = seconds
+        self.conflicts = list(conflicts)
+
+    def __str__(self):
+        text = f"Reloaded in {self.seconds * 1000:.1f} ms: {', '.join(self.parts) if self.parts else 'nothing changed'}"
+        if self.conflicts:
+            text += f". Kept your edit to {', '.join(self.conflicts)} over a change the bot hadnt written to the file yet"
+        return text
 
 
 # def config_required(func):
@@ -70,15 +208,28 @@ CONFIG_FILE_NAME = Path("./conf.json")
 class RoleRotation:
     """
     Manages the rotation of a Discord role among a list of members.
-    Unless otherwise noted, all functions immediately rewrite the entire config on change
+    Unless otherwise noted, all functions immediately persist the change (see ConfigStore and journal())
 
     Usage:
     1. Instanciate
     2. After the async loop, call load_config
     """
 
-    def __init__(self, client: discord.Client, guild_id: int):
-        """Initializes the RoleRotation object in an unconfigured state."""
+    def __init__(self, client: discord.Client, guild_id: int, fetch_concurrency: int = DEFAULT_FETCH_CONCURRENCY,
+                 config_path: Path = CONFIG_FILE_NAME, name: str = "default",
+                 scheduler: Optional[AsyncIOScheduler] = None, cache: Optional[MemberCache] = None,
+                 operations: Optional[OperationQueue] = None, schedules: Optional[ScheduleStore] = None,
+                 history: Optional[HistoryStore] = None, misfire_grace_time: Optional[int] = DEFAULT_MISFIRE_GRACE, coalesce: bool = True,
+                 outbox: Optional[NotificationOutbox] = None, state: Optional[SharedState] = None,
+                 leader: Optional[Callable[[], bool]] = None, holder: Optional[str] = None):
+        """
+        Initializes the RoleRotation object in an unconfigured state.
+        scheduler, cache, operations, schedules, history and outbox can be shared between rotations (see RotationManager),
+        otherwise each gets its own.
+        misfire_grace_time and coalesce decide what happens to rotations missed while the bot was down, see catch_up().
+        With a SharedState the config lives there instead of in config_path, for running several replicas. leader then
+        says whether this replica may run the scheduled work (see LeaderLease.held), and holder is its name.
+        """
 
         # Doesnt do much because we either need:
         # to be logged in with the discord button
@@ -86,14 +237,41 @@ class RoleRotation:
 
         # --- Config State ---
         self.config_good: bool = False  # Is false before running load_conf() or after load_conf() failed
-        self.scheduler = AsyncIOScheduler()
+        # True once load_config read the config and resolved its role and every member, even if nobody is in it yet.
+        # Until then what is in memory isnt the config, so it is never written back as a snapshot
+        self.loaded: bool = False
+        self.name = name
+        # Every line about this rotation carries rotation=<name>, so they can be told apart with several running
+        self.log = logging.LoggerAdapter(logger, {"rotation": name})
+        self.scheduler = scheduler or AsyncIOScheduler()
         self.guild_id: int = guild_id
         self.client = client
+        self.cache = cache or MemberCache()  # Kept fresh by the gateway events below
+        self.operations = operations or OperationQueue()  # All role changes and member fetches go through this
+        self.resolver = MemberResolver(concurrency=fetch_concurrency, cache=self.cache, operations=self.operations)
+        if state is not None:
+            self.store = SharedConfigStore(state, name, config_path, snapshot=self.config_dict, apply=apply_journal_record,
+                                           holder=holder, ready=lambda: self.loaded)
+        else:
+            self.store = ConfigStore(config_path, snapshot=self.config_dict, apply=apply_journal_record,
+                                     ready=lambda: self.loaded)
+        self.leader = leader  # None when there is only this process, which then always leads
+        self.executor = RotationExecutor(self)  # Commands and the scheduler submit their changes here, one at a time
+        data = Path(state.path if state is not None else config_path)  # Like in RotationManager
+        self.schedules = schedules or ScheduleStore(data.with_name(SCHEDULE_DB_NAME))
+        self.history = history or HistoryStore(data.with_name(HISTORY_DB_NAME))
+        self.outbox = outbox or NotificationOutbox(data.with_name(OUTBOX_DB_NAME))
+        self._reminder_jobs: List[str] = []  # Ids of the reminder jobs plan_reminders added
+        self.misfire_grace_time = misfire_grace_time
+        self.coalesce = coalesce
+        self.next_fire: Optional[datetime] = None  # Precomputed when the job is scheduled or fires
+        self._scheduled: Optional[tuple] = None  # The (day, hour, minute) the job was last scheduled with
 
         # --- Fetched Discord Objects ---
         self.managed_role: discord.Role = None
-        self.members: List[discord.Member] = []
+        self.members: RotationOrder = RotationOrder()
         self.guild: discord.Guild = None
+        self.member_failures: dict = {}  # member id -> exception, from the last time members were resolved
 
         # --- Config File Values ---
         self.role_id: Optional[int] = None
@@ -101,8 +279,14 @@ class RoleRotation:
         self.schedule_day: int = 0
         self.schedule_hour: int = 0
         self.schedule_minute: int = 0
+        self.strategy_name: str = ROUND_ROBIN
+        self.weights: dict = {}  # member id -> weight
+        self.unavailable: dict = {}  # member id -> list of (start, end) timestamps
+        self.strategy: RotationStrategy = make_strategy(ROUND_ROBIN)  # Picks who is next, rebuilt by load_config
+        self.notify: dict = self.read_notify_conf({})  # Who hears about a rotation, see notify_on_duty
 
     # todo finish error handling here
+    @timed()
     async def load_config(self) -> Optional[Exception]:
         """
         Loads configuration from disk and fetches required Discord objects.
@@ -111,42 +295,60 @@ class RoleRotation:
         If something is malformed, a flag is set to invalidate the configuration for @config_required
         """
 
-        if self.guild is None:
+        cached_guild = self.client.get_guild(self.guild_id)
+        if cached_guild is not None:
+            # Once the gateway is up, prefer its guild. Its member cache is what makes resolving members cheap
+            self.guild = cached_guild
+        elif self.guild is None:
             # Only runs on first call to load_config: the first time after the bot logs in
             self.guild = await self.client.fetch_guild(self.guild_id)
 
         # Reset state to unconfigured before attempting to load
         self.config_good = False
-        print("Attempting to load RoleRotation config...")
+        self.loaded = False
+        self.log.info("Attempting to load RoleRotation config...")
 
         try:
             # 1. Read config files from disk
+            await self.store.flush()  # Anything still queued has to be on disk before it is read back
             conf_json = self.read_config()
 
             # 2. Validate config keys
-            missing_keys = set(ConfKeys) - set(conf_json.keys())
+            missing_keys = set(ConfKeys) - set(conf_json.keys()) - set(OPTIONAL_CONF_KEYS)
             if missing_keys:
                 message = f"Config file is missing keys: {missing_keys}"
-                print(message)
+                self.log.error(message)
                 return KeyError(message)
 
-            # 3. Fetch Role and validate bot permissions
+            # 3. Fetch Role and validate bot permissions, and 4. Fetch members
+            # Neither needs the other, so the role is looked up while the members are fetched.
+            # Cant use fetch_members since that requires config to be loaded.
             role_id = conf_json[ConfKeys.ROLE_ID.value]
-            role = await self.guild.fetch_role(role_id)  # Fetch if not in cache
-            me = self.guild.get_member(self.client.user.id)
-            if not me:
-                me = await self.guild.fetch_member(self.client.user.id)
-            if me.top_role <= role:
-                print(f"Error: Bot's top role is not high enough to manage '{role.name}'")
-                return Exception(
-                    f"Error: Bot's top role is not high enough to manage '{role.name}'")  # todo custom errors?
-
-
-            # 4. Fetch members
-            # Cant use the method since that requires config to be loaded.
-            users = []
-            for member_id in conf_json[ConfKeys.MEMBER_IDS]:
-                users.append(await self.guild.fetch_member(member_id))
+            role_lookup = asyncio.ensure_future(self.fetch_role(role_id))
+            try:
+                resolved = await self.resolver.resolve(self.guild, conf_json[ConfKeys.MEMBER_IDS])
+            finally:
+                role = await role_lookup
+            if isinstance(role, Exception):
+                return role
+
+            self.log.debug("Resolved members: %s", resolved)
+            self.member_failures = resolved.failures
+            if resolved.failures:
+                # Keep whoever did resolve so /debug can show them, but leave the config invalid.
+                # Writing it back now would silently drop the ids that failed.
+                self.members = RotationOrder(MemberRecord.from_member(member, role) for member in resolved.members)
+                error = resolved.error()
+                error.add_note("Check the member ids are valid, and that they are still in the server.")
+                self.log.error("%s", error)
+                return error
+            # Raises ValueError if an id is listed twice
+            users = RotationOrder(MemberRecord.from_member(member, role) for member in resolved.members)
+            # Raises ValueError for an unknown strategy
+            strategy_conf = self.read_strategy_conf(conf_json)
+            strategy = self.build_strategy(*strategy_conf)
+            # Raises ValueError for settings that make no sense
+            notify = self.read_notify_conf(conf_json)
 
             # --- SUCCESS ---
             # All data is loaded and validated. Assign to self.
@@ -158,49 +360,196 @@ class RoleRotation:
             self.schedule_hour = conf_json[ConfKeys.SCHEDULE_HOUR.value]
             self.schedule_minute = conf_json[ConfKeys.SCHEDULE_MINUTE.value]
             self.schedule_day = conf_json[ConfKeys.SCHEDULE_DAY.value]
+            self.strategy_name, self.weights, self.unavailable = strategy_conf
+            self.strategy = strategy
+            self.notify = notify
+            self.loaded = True
 
-            if self.members is empty:
-                print("There is no one in the list. Leaving config invalid to prevent index error.")
+            if len(self.members) == 0:
+                self.log.warning("There is no one in the list. Leaving config invalid to prevent index error.")
             else:
                 try:
                     self.members[self.index]
                 except IndexError as e:
-                    print("The index in conf was somehow out of range. What was the last command you ran?")
-                    print("Are there any people in the list?")
+                    self.log.error("The index in conf was somehow out of range. What was the last command you ran? "
+                                   "Are there any people in the list?")
                     return e
 
                 self.config_good = True
-                print("RoleRotation config loaded successfully.")
+                self.log.info("RoleRotation config loaded successfully.")
                 self.retrigger_scheduler()
+                self.settle_conflicts()
             return None
 
         except json.JSONDecodeError as e:
             e.add_note("Error in the config file syntax")
-            print(e)
+            self.log.error("%s", e)
             return e
         except (discord.NotFound, discord.Forbidden) as e:
-            print(f"Discord API Error: Could not fetch required objects."
-                  f"Check the member ids are valid, and that they are in the server."
-                  f"Also check bot permissions. It might not have intents or the ability to see a member {e}")
+            self.log.error("Discord API Error: Could not fetch required objects. "
+                           "Check the member ids are valid, and that they are in the server. "
+                           "Also check bot permissions. It might not have intents or the ability to see a member %s", e)
             self.config_good = False
             return e
         except KeyError as e:
-            print(f"Config file validation error: {e}")
+            self.log.error("Config file validation error: %s", e)
             self.config_good = False
             return e
         except discord.HTTPException as e:
             e.add_note("There was an unexpected http error")
+            self.log.error("Unexpected http error during config load: %s", e)
             self.config_good = False
             return e
         except Exception as e:
-            print(f"An unexpected error occurred during config load: {e}")
+            self.log.exception("An unexpected error occurred during config load: %s", e)
             self.config_good = False
             return e
 
-    def create_default_conf(force=False):
+    async def fetch_role(self, role_id: int) -> Union[discord.Role, Exception]:
+        """Looks up the role (cache first) and checks the bot is allowed to hand it out. Returns the error otherwise."""
+        async def lookup_role():
+            role = self.cache.get_role(role_id)
+            if role is None:
+                role = self.guild.get_role(role_id) or await self.guild.fetch_role(role_id)  # Fetch if not in cache
+                self.cache.put_role(role)
+            return role
+
+        async def lookup_me():
+            me = self.cache.get_member(self.guild_id, self.client.user.id)
+            if not me:
+                me = self.guild.get_member(self.client.user.id) or await self.guild.fetch_member(self.client.user.id)
+                self.cache.put_member(me)
+            return me
+
+        # Before the gateway is up both are REST calls, and they dont depend on each other
+        role, me = await asyncio.gather(lookup_role(), lookup_me())
+        if me.top_role <= role:
+            self.log.error("Bot's top role is not high enough to manage '%s'", role.name)
+            return Exception(
+                f"Error: Bot's top role is not high enough to manage '{role.name}'")  # todo custom errors?
+        return role
+
+    async def member(self, member_id: int) -> discord.Member:
+        """The full Member behind a MemberRecord, for API calls. Comes from a cache whenever it can."""
+        member = self.cache.get_member(self.guild_id, member_id)
+        if member is None:
+            member = self.guild.get_member(member_id) or await self.operations.fetch_member(self.guild, member_id)
+            self.cache.put_member(member)
+        return member
+
+    @timed()
+    async def reload_config(self) -> Union[ReloadReport, Exception]:
+        """
+        Re-reads the config and only redoes what changed compared to what is loaded:
+        the role is only re-validated if role_id changed, only member ids that are new get fetched,
+        and the scheduler is only touched if the schedule changed.
+        Falls back to a full load_config when nothing valid is loaded yet.
+        Nothing is changed if the new config has an error, the old one stays in use.
+        """
+        start = time.perf_counter()
+        if not self.config_good:
+            error = await self.load_config()
+            return error if error is not None else ReloadReport(["everything"], time.perf_counter() - start)
+
+        try:
+            await self.store.flush()
+            conf_json = self.read_config()
+        except json.JSONDecodeError as e:
+            e.add_note("Error in the config file syntax")
+            self.log.error("%s", e)
+            return e
+        except (ValueError, KeyError, TypeError) as e:
+            # Replaying the journal failed, e.g. a record removes a member that was already taken out by hand
+            e.add_note("The config and its journal dont fit together, check the member ids in both")
+            self.log.error("%s", e)
+            return e
+        missing_keys = set(ConfKeys) - set(conf_json.keys()) - set(OPTIONAL_CONF_KEYS)
+        if missing_keys:
+            return KeyError(f"Config file is missing keys: {missing_keys}")
+        conflicts = list(self.store.conflicts)
+        parts = []
+
+        role_id = conf_json[ConfKeys.ROLE_ID.value]
+        role = self.managed_role
+        if role_id != self.role_id:
+            role = await self.fetch_role(role_id)
+            if isinstance(role, Exception):
+                return role
+            parts.append("role")
+
+        ids = conf_json[ConfKeys.MEMBER_IDS.value]
+        members = self.members
+        if ids != self.members.ids():
+            new_ids = [member_id for member_id in ids if member_id not in self.members]
+            resolved = await self.resolver.resolve(self.guild, new_ids)
+            if resolved.failures:
+                self.member_failures = resolved.failures
+                error = resolved.error()
+                error.add_note("Check the member ids are valid, and that they are still in the server.")
+                return error
+            found = {member.id: MemberRecord.from_member(member, role) for member in resolved.members}
+            try:
+                members = RotationOrder(self.members.get(member_id) or found[member_id] for member_id in ids)
+            except ValueError as e:
+                return e
+            if len(members) == 0:
+                return IndexError("There is no one in the list")
+            removed = len(self.members) - (len(members) - len(new_ids))
+            parts.append(f"members (+{len(new_ids)} fetched, -{removed})" if new_ids or removed else "member order")
+
+        index = conf_json[ConfKeys.INDEX.value]
+        if not 0 <= index < len(members):
+            return IndexError(f"Index {index} is out of range for {len(members)} members")
+        if index != self.index:
+            parts.append("index")
+
+        try:
+            strategy_conf = self.read_strategy_conf(conf_json)
+            changed_strategy = strategy_conf != (self.strategy_name, self.weights, self.unavailable)
+            strategy = self.build_strategy(*strategy_conf) if changed_strategy else self.strategy
+        except (ValueError, TypeError) as e:
+            e.add_note("Check strategy, weights and unavailable in the config")
+            return e
+        if changed_strategy:
+            parts.append("strategy")
+        try:
+            notify = self.read_notify_conf(conf_json)
+        except (ValueError, TypeError) as e:
+            e.add_note("Check notify in the config")
+            return e
+        if notify != self.notify:
+            parts.append("notifications")
+
+        # --- Everything checked out, apply it ---
+        self.managed_role = role
+        self.role_id = role_id
+        if members is not self.members:
+            strategy.invalidate()
+        self.members = members
+        self.index = index
+        self.strategy_name, self.weights, self.unavailable = strategy_conf
+        self.strategy = strategy
+        replan = notify != self.notify
+        self.notify = notify
+        schedule = (conf_json[ConfKeys.SCHEDULE_DAY.value], conf_json[ConfKeys.SCHEDULE_HOUR.value],
+                    conf_json[ConfKeys.SCHEDULE_MINUTE.value])
+        if schedule != (self.schedule_day, self.schedule_hour, self.schedule_minute):
+            self.schedule_day, self.schedule_hour, self.schedule_minute = schedule
+            self.retrigger_scheduler()  # Plans the reminders for the new fire time too
+            parts.append("schedule")
+        elif replan:
+            self.plan_reminders()
+        self.settle_conflicts()
+
+        report = ReloadReport(parts, time.perf_counter() - start, conflicts)
+        self.log.log(logging.WARNING if conflicts else logging.INFO, "%s", report)
+        return report
+
+    @staticmethod
+    def create_default_conf(force=False, path: Path = CONFIG_FILE_NAME):
         """Creates a default config file"""
-        if not force and CONFIG_FILE_NAME.is_file():
-            print("Config file already exists. Use force=True to overwrite.")  # todo find a better way
+        if not force and path.is_file():
+            logger.warning("Config file already exists. Use force=True to overwrite.")  # todo find a better way
             return
 
         config = {
@@ -213,62 +562,193 @@ class RoleRotation:
                 123456789012345567,
                 123456789012345567,
                 123456789012345567
-            ]
+            ],
+            **OPTIONAL_CONF_KEYS
         }
 
         try:
-            with open(CONFIG_FILE_NAME, "w") as file:
-                json.dump(config, file, indent=4)
-            print(f"Created default config at {CONFIG_FILE_NAME}")
+            write_atomic(path, config)
+            logger.info("Created default config at %s", path)
         except PermissionError:
-            print(f"I dont have the permission to write to {CONFIG_FILE_NAME}")
+            logger.error("I dont have the permission to write to %s", path)
 
-    @staticmethod
-    def read_config() -> dict:
+    def settle_conflicts(self):
+        """
+        Once a config that kept hand edits over the journal is loaded, snapshots it. Until then the file and the journal
+        still disagree, and after a restart the journal would win (see ConfigStore).
+        """
+        if self.store.conflicts:
+            self.write_config()
+
+    def read_config(self) -> dict:
         """Reads the JSON config file and just returns the object."""
-        if not CONFIG_FILE_NAME.is_file():
-            print("Config file not found, creating a default one...")
-            RoleRotation.create_default_conf()
+        if not self.store.exists():
+            self.log.warning("Config file not found, creating a default one...")
+            RoleRotation.create_default_conf(path=self.store.path)
             raise FileNotFoundError("There was no config, created a default one instead")  # Return None to indicate it needs to be filled out
 
-        with open(CONFIG_FILE_NAME, "r") as confFP:
-            return json.load(confFP)
+        return self.store.read()
 
+    @staticmethod
+    def read_strategy_conf(conf_json: dict) -> (str, dict, dict):
+        """(strategy name, weights, unavailable windows) from a config read from disk, with defaults for what is missing"""
+        return (conf_json.get(ConfKeys.STRATEGY.value, ROUND_ROBIN),
+                weights_from_conf(conf_json.get(ConfKeys.WEIGHTS.value, {})),
+                windows_from_conf(conf_json.get(ConfKeys.UNAVAILABLE.value, {})))
 
-    async def clear_role(self):
+    @staticmethod
+    def read_notify_conf(conf_json: dict) -> dict:
+        """The notification settings from a config read from disk, with defaults. Raises ValueError if they make no sense."""
+        notify = conf_json.get(ConfKeys.NOTIFY.value) or {}
+        remind_hours = sorted({float(hours) for hours in notify.get("remind_hours", [])}, reverse=True)
+        if any(hours <= 0 for hours in remind_hours):
+            raise ValueError("remind_hours have to be more than 0")
+        channel_id = notify.get("channel_id")
+        return {"dm": bool(notify.get("dm", False)), "channel_id": int(channel_id) if channel_id else None,
+                "remind_hours": remind_hours}
+
+    def build_strategy(self, name: Optional[str] = None, weights: Optional[dict] = None,
+                       unavailable: Optional[dict] = None) -> RotationStrategy:
+        """
+        A fresh strategy for the loaded config, or for the given parts of it. Raises ValueError for an unknown name.
+        The strategies that care about past shifts get them from the history store.
+        """
+        name = self.strategy_name if name is None else name
+        shifts = self.history.shift_stats(self.name) if name != ROUND_ROBIN else []
+        return make_strategy(name, Availability(self.unavailable if unavailable is None else unavailable),
+                             self.weights if weights is None else weights,
+                             {shift.member_id: shift.shifts for shift in shifts},
+                             {shift.member_id: shift.last_shift.timestamp() for shift in shifts})
+
+    @timed()
+    async def clear_role(self) -> List[MemberRecord]:
         """
         Removes the role from all MANAGED members. A member not listed in configuration is unaffected.
+        This re-fetches every member, so it is the slow "repair" path. rotate_role uses sync_role_holders instead.
+        Returns the members the role was removed from.
         """
 
-        print(f"Clearing role '{self.managed_role.name}' from {len(self.members)} members.")
+        self.log.info("Clearing role '%s' from %d members.", self.managed_role.name, len(self.members))
         await self.fetch_members()
-        for member in self.members:
-            if self.managed_role in member.roles:
+        removed = []
+        for record in self.members:
+            if record.has_role:
                 # http status 204 mean it was successful and has nothing else to say
-                await member.remove_roles(self.managed_role)
+                await self.operations.remove_role(await self.member(record.id), self.managed_role)
+                record.has_role = False
+                removed.append(record)
+        return removed
+
+    def current_holders(self) -> dict:
+        """
+        The managed members who currently hold the role, by id. Comes from the gateway cache, so it costs no API calls.
+        A member not listed in configuration is never included.
+        """
 
+        return {member.id: member for member in self.managed_role.members if member.id in self.members}
+
+    async def sync_role_holders(self, desired: MemberRecord, outgoing: Optional[MemberRecord] = None):
+        """
+        Makes `desired` the only managed member with the role, touching only members whose state is wrong.
+        `outgoing` is whoever was expected to hold it, and is checked even if the gateway cache hasnt seen them yet,
+        as is anyone whose record says they have the role.
+        The removals are queued together, the OperationQueue batches them under its rate limit.
+        Returns (added, removed) lists of members.
+        """
+
+        holders = self.current_holders()
+        suspects = [record for record in self.members if record.has_role]
+        if outgoing is not None:
+            suspects.append(outgoing)
+        for record in suspects:
+            if record.id not in holders and record.id != desired.id and record.has_role:
+                holders[record.id] = await self.member(record.id)
+
+        async def remove(member_id, member):
+            changed = await self.operations.remove_role(member, self.managed_role)
+            record = self.members.get(member_id)
+            if record is not None:
+                record.has_role = False
+            return member if changed else None
+
+        results = await asyncio.gather(*(remove(member_id, member) for member_id, member in holders.items()
+                                         if member_id != desired.id))
+        removed = [member for member in results if member is not None]
+
+        added = []
+        if desired.id not in holders:
+            member = await self.member(desired.id)
+            if await self.operations.add_role(member, self.managed_role):
+                added.append(member)
+        desired.has_role = True
+        return added, removed
+
+    @timed()
+    async def reconcile(self):
+        """
+        The cheap drift check: compares who has the role in the gateway cache (and the records) with who is on duty,
+        and fixes only the differences. Costs no API calls when nothing drifted.
+        Returns (added, removed) lists of members, both empty if everything was already right.
+        """
+        if not self.config_good or len(self.members) == 0:
+            return [], []
+        desired = self.members[self.index]
+        stale = any(record.has_role for record in self.members if record.id != desired.id)
+        if self.current_holders().keys() == {desired.id} and not stale:
+            return [], []
+        # If the gateway cache just doesnt have them (trimmed cache, or not connected yet), the role is added again.
+        # The Member from a fetch may be stale, so its roles cant say it isnt needed
+
+        added, removed = await self.sync_role_holders(desired)
+        for member in added:
+            self.log.warning("Reconciled: %s is on duty but didnt have the role, gave it to them", member.name)
+        for member in removed:
+            self.log.warning("Reconciled: %s had the role but isnt on duty, removed it", member.name)
+        return added, removed
+
+
+    def config_dict(self) -> dict:
+        """The full config as it would be written to disk"""
+        return {
+            ConfKeys.SCHEDULE_DAY: self.schedule_day,
+            ConfKeys.SCHEDULE_HOUR: self.schedule_hour,
+            ConfKeys.SCHEDULE_MINUTE: self.schedule_minute,
+            ConfKeys.INDEX: self.index,
+            ConfKeys.ROLE_ID: self.role_id,
+            ConfKeys.MEMBER_IDS: self.members.ids(),
+            ConfKeys.STRATEGY: self.strategy_name,
+            ConfKeys.WEIGHTS: weights_to_conf(self.weights),
+            ConfKeys.UNAVAILABLE: windows_to_conf(self.unavailable),
+            ConfKeys.NOTIFY: self.notify,
+        }
 
     # @config_required
     def write_config(self, force=False):
+        """
+        Queues a full snapshot of the config. Prefer journal(), which only writes what changed.
+        The write happens off the event loop a moment later. Await self.store.flush() when it has to be on disk.
+        """
         if self.config_good or force:
             #todo forcing this could never cause a fatal error right?
+            self.store.save()
 
-            print("writing config")
-            config = {
-                ConfKeys.SCHEDULE_DAY: self.schedule_day,
-                ConfKeys.SCHEDULE_HOUR: self.schedule_hour,
-                ConfKeys.SCHEDULE_MINUTE: self.schedule_minute,
-                ConfKeys.INDEX: self.index,
-                ConfKeys.ROLE_ID: self.role_id,
-                ConfKeys.MEMBER_IDS: list(member.id for member in self.members)
-
-            }
-
-            with open(CONFIG_FILE_NAME, "w") as fp:
-                json.dump(config, fp, indent=4)
-            print("wrote config")
-
+    def journal(self, op: str, force=False, **fields):
+        """
+        Queues one state change to the journal. Costs the same however long the member list is.
+        See apply_journal_record for the ops and their fields.
+        """
+        if self.config_good or force:
+            self.store.append(op, **fields)
 
+    def record_history(self, op: str, member: Optional[MemberRecord], previous: Optional[MemberRecord] = None,
+                       position: Optional[int] = None):
+        """
+        Appends the change to the history store, for /history and /stats. Call it next to journal().
+        It is written in the background, and a failure is only logged: the change itself already happened,
+        and losing its history shouldnt undo it.
+        """
+        self.history.record(self.name, op, member.id if member else None, member.name if member else None,
+                            self.index, previous.id if previous else None, position)
 
 
     async def add_user(self, member_id: int, position: int=-1):
@@ -277,16 +757,23 @@ class RoleRotation:
         Returns the user if they were successfully added and moved (if applicable)
         """
         #todo why does remove user have no error handling, but this function does?. Should they match?
-        print("Appending user")
+        self.log.info("Adding member %d", member_id)
+        if member_id in self.members:
+            raise Exception(f"This person is already in the rotation {self.members.get(member_id).name}")
         try:
-            new_member = await self.guild.fetch_member(member_id)
-            if new_member in self.members:
-                raise Exception(f"This person is already in the rotation {new_member.name}")
-            self.members.append(new_member)
+            resolved = await self.resolver.resolve(self.guild, [member_id])
+            if resolved.failures:
+                raise resolved.failures[member_id]
+            new_member = MemberRecord.from_member(resolved.members[0], self.managed_role)
+            position_added = self.members.append(new_member)
+            self.strategy.member_added(self.members, member_id)
             try:
-                self.write_config()
+                self.journal("add", member_id=member_id, position=position_added)
+                self.record_history("add", new_member, position=position_added)
+            except StaleConfig:
+                raise  # The executor reloads and tries again
             except Exception as e:
-                print("Failed")
+                self.log.error("Failed to journal the new member, reloading the config")
                 await self.load_config()
                 e.add_note("Failed to write to config after adding a user. Who ever you just tried to add didnt get saved")
                 raise e
@@ -306,133 +793,476 @@ class RoleRotation:
                 raise e
         return new_member
 
+    async def import_members(self, rows: List[ImportRow]) -> ImportReport:
+        """
+        Adds every new member named by `rows` to the bottom of the rotation, in order, and fills in each row's status.
+        Duplicates are checked against the member ids first, then the new members are resolved together (see
+        MemberResolver) instead of one fetch each. A member that cant be resolved is reported and skipped.
+        The rest are added as one journal record and one history transaction, and are on disk before this returns.
+        Works on a rotation that loaded fine but is empty, which then becomes configured. One that failed to load
+        (or lost its role) is refused, what is in memory isnt the whole config.
+        """
+        empty = self.loaded and len(self.members) == 0
+        if not self.config_good and not empty:
+            raise Exception("The config isnt loaded, fix it and /reload before importing")
+        start = time.perf_counter()
+        new_ids = check_duplicates(rows, self.members)
+        resolved = await self.resolver.resolve(self.guild, new_ids)
+        self.log.info("Importing %d new member(s): %s", len(new_ids), resolved)
+        for row in rows:
+            if row.status is None and row.member_id in resolved.failures:
+                row.status = NOT_FOUND
+                row.detail = type(resolved.failures[row.member_id]).__name__
+
+        # Nothing below awaits until the flush, so nothing else can see a half done import
+        added = []
+        for member in resolved.members:
+            record = MemberRecord.from_member(member, self.managed_role)
+            added.append((record, self.members.append(record)))
+            self.strategy.member_added(self.members, record.id)
+        positions = {record.id: position for record, position in added}
+        for row in rows:
+            if row.status is None and row.member_id in positions:
+                row.status = ADDED
+                row.detail = f"{self.members.get(row.member_id).name}, position {positions[row.member_id]}"
+        if not added:
+            return ImportReport(rows, time.perf_counter() - start)
+
+        # Forced, a rotation with nobody in it isnt configured yet but this is how it gets its members
+        self.journal("add_many", force=True, member_ids=[record.id for record, position in added])
+        self.history.record_many(self.name, "add", ((record.id, record.name, position) for record, position in added),
+                                 self.index)
+        if empty and 0 <= self.index < len(self.members):
+            self.config_good = True
+            self.log.info("The rotation has members now, it is configured")
+            self.retrigger_scheduler()
+        try:
+            await self.store.flush()
+        except Exception as e:
+            e.add_note("The imported members are added, but couldn't be written to disk yet. "
+                       "The write is retried with the next change.")
+            raise e
+        return ImportReport(rows, time.perf_counter() - start)
+
     def remove_user(self, member_id):
 
-        deleted = None
         # If we delete the user who is on duty we need to notify the user
         if self.members[self.index].id == member_id:
             raise Exception("Cannot delete the user who is currently on duty")
-        for i, m in enumerate(self.members):
-            if member_id == m.id:
-                if i <= self.index:
-                    self.index = self.index-1
-                deleted = self.members.pop(i)
-                self.write_config()
-                print("wrote config")
-                break
-
-        if self.members is empty:
+        if member_id not in self.members:
+            return None
+
+        position, deleted = self.members.remove(member_id)
+        self.index = cursor_after_remove(self.index, position)
+        self.strategy.member_removed(self.members, member_id)
+        self.weights.pop(member_id, None)
+        self.unavailable.pop(member_id, None)
+        self.journal("remove", member_id=member_id)
+        self.record_history("remove", deleted, position=position)
+
+        if len(self.members) == 0:
             self.config_good = False
             raise Exception("Successfully deleted, but now there is no one left in the list. Add someone and reload.")
 
         return deleted
 
-    async def rotate_role(self):
-        """Rotates the duty role to the next member in the list."""
-        print("Attempting to clear the roles")
-        await self.clear_role()
+    @timed()
+    async def rotate_role(self, repair=False) -> RotationReport:
+        """
+        Rotates the duty role to the next member in the list.
+        Normally only the outgoing and incoming holders are touched, which is two API calls.
+        repair=True does the full clear_role sweep first, for when the role has drifted.
+        """
+        previous_index = self.index
+        outgoing = self.members[previous_index] if previous_index < len(self.members) else None
+
+        removed = []
+        if repair:
+            self.log.info("Attempting to clear the roles")
+            removed = await self.clear_role()
 
-        self.index += 1
-        if self.index >= len(self.members):
-            self.index = 0
+        now = time.time()
+        self.index = self.strategy.choose(self.members, previous_index, now)
+        # Journaled before the role moves. With replicas this is where a conflict shows up (StaleConfig), and then
+        # nothing has changed in Discord yet. If a role call fails after it, the index is right and reconcile fixes the role
+        self.journal("rotate", index=self.index)
 
         next_user = self.members[self.index]
-        print(f"Rotating role to member: {next_user.name}")
-        await next_user.add_roles(self.managed_role)
+        self.log.info("Rotating role to member: %s", next_user.name)
+        if repair:
+            added = [next_user] if await self.operations.add_role(await self.member(next_user.id), self.managed_role) else []
+            next_user.has_role = True
+        else:
+            added, removed = await self.sync_role_holders(next_user, outgoing)
 
         try:
-            self.write_config()
+            await self.store.flush()  # The rotation isnt done until the new index is on disk
         except Exception as e:
             e.add_note("Failed to write config to disk while rotating. The index is probably wrong right now.")
             raise e
+        self.strategy.on_duty(next_user.id, now)
+        self.record_history("rotate", next_user, outgoing)
+        self.notify_on_duty(next_user)
+
+        report = RotationReport(previous_index, self.index, added, removed, repair)
+        self.log.info("%s", report)
+        return report
 
-    def set_index(self, i: int, force=False):
+    async def set_index(self, i: int, force=False):
         if self.config_good:
-            print("changing the index to " + i.__str__())
+            self.log.info("Changing the index to %d", i)
             old_member = self.members[self.index]
             new_member = self.members[i]
-            if old_member == new_member: return
+            if old_member.id == new_member.id: return
 
-            self.clear_role()
             self.index = i
-            new_member.add_roles(self.managed_role)
-            self.write_config()
+            self.journal("set_index", index=self.index)  # First, like in rotate_role
+            await self.sync_role_holders(new_member, old_member)
+            self.strategy.on_duty(new_member.id, time.time())
+            self.record_history("set_index", new_member, old_member)
+            self.notify_on_duty(new_member)
         elif force:
             self.index = i
-            self.write_config(force=True)
-            print("Forcibly changed the index, will need a reload")
+            self.journal("set_index", force=True, index=self.index)
+            self.record_history("set_index", self.members[i] if 0 <= i < len(self.members) else None)
+            self.log.warning("Forcibly changed the index, will need a reload")
 
         else: raise Exception("Tried to run this command without forcing it, but with unconfigured config")
 
-    async def fetch_members(self) -> List[discord.Member]:
-        # todo use this in the loader function
-        """Re-fetches all managed members from Discord."""
+    @timed()
+    async def fetch_members(self) -> List[MemberRecord]:
+        """
+        Re-fetches all managed members from Discord and refreshes their records.
+        A member that fails to resolve keeps their previous (possibly stale) record, and is reported in self.member_failures
+        """
 
-        members = []
-        for member in self.members:
-            mem_id = member.id
-            try:
-                members.append(await self.guild.fetch_member(mem_id))
-            except Exception as e:
-                e.add_note("Failed to fetch members for some reason")
-                self.config_good = False
-                raise e
+        resolved = await self.resolver.resolve(self.guild, (member.id for member in self.members))
+        self.member_failures = resolved.failures
+        if resolved.failures:
+            self.log.warning("%s", resolved.error())
 
-        self.members = members
-        return members
+        for member in resolved.members:
+            self.members.replace(MemberRecord.from_member(member, self.managed_role))
+        return list(self.members)
 
-    def move_member(self, member: discord.Member, position: int):
+    def move_member(self, member: Union[MemberRecord, discord.Member], position: int):
+        """Moves a member so they end up at `position`. Whoever is on duty stays on duty."""
         if position < 0 or position > len(self.members)-1:
             raise Exception(f"Tried to move to an out-of-range index. Max is {len(self.members) - 1}")
-
-        cur_pos = self.members.index(member)
-        if cur_pos == -1:
+        if member.id not in self.members:
             raise Exception("Tried to move a member who is not listed in config")
-        if cur_pos == position:
-            return # They arent moving it anywhere lol
-
-        # Deleting, then inserting into the correct position
-        _ = self.members.pop(cur_pos) # The function argument is likely a more recent fetch
-        if position == len(self.members)-1: # They specified the last index, so just append it
-            self.members.append(member)
-        elif position < cur_pos: # Indexes to the left are unaffected when we remove an item
-            self.members.insert(position, member)
-        else: # indexes to the right are left shifted when we remove
-            self.members.insert(position-1, member)
 
+        old = self.members.move(member.id, position)
+        self.strategy.member_moved(self.members, member.id)
+        if not isinstance(member, MemberRecord):
+            # The function argument is likely a more recent fetch
+            self.members.replace(MemberRecord.from_member(member, self.managed_role))
+        self.index = cursor_after_move(self.index, old, position)
+        self.journal("move", member_id=member.id, position=position)
+        self.record_history("move", self.members.get(member.id), position=position)
+
+
+    def set_strategy(self, name: str):
+        """Switches how the next member is picked. Raises ValueError for an unknown strategy."""
+        self.strategy = self.build_strategy(name)
+        self.strategy_name = name
+        self.journal("set_strategy", strategy=name)
+
+    def set_weight(self, member_id: int, weight: Optional[float]):
+        """How many shifts a member gets relative to others, with the weighted strategy. None goes back to 1."""
+        if member_id not in self.members:
+            raise Exception("Tried to weight a member who is not listed in config")
+        if weight is not None and weight <= 0:
+            raise ValueError("The weight has to be more than 0")
+        if weight is None:
+            self.weights.pop(member_id, None)
+        else:
+            self.weights[member_id] = weight
+        self.strategy = self.build_strategy()
+        self.journal("set_weight", member_id=member_id, weight=weight)
+
+    def set_unavailable(self, member_id: int, windows: List[Window]):
+        """Replaces when a member cant be put on duty. Windows that are already over are dropped."""
+        if member_id not in self.members:
+            raise Exception("Tried to mark a member who is not listed in config")
+        now = time.time()
+        # Whole seconds, like they are written to the config, so a reload sees no change
+        windows = sorted((float(int(start)), float(int(end))) for start, end in windows if end > now and start < end)
+        if windows:
+            self.unavailable[member_id] = windows
+        else:
+            self.unavailable.pop(member_id, None)
+        self.strategy.availability = Availability(self.unavailable)
+        self.strategy.invalidate()
+        spans = windows_to_conf({member_id: windows}).get(str(member_id), [])
+        self.journal("set_unavailable", member_id=member_id, windows=spans)
+
+    def set_notifications(self, dm: Optional[bool] = None, channel_id: Optional[int] = None,
+                          remind_hours: Optional[List[float]] = None, off: bool = False):
+        """Changes who hears about rotations. None leaves that setting as it is, off turns everything off first."""
+        notify = self.read_notify_conf({}) if off else dict(self.notify)
+        if dm is not None:
+            notify["dm"] = dm
+        if channel_id is not None:
+            notify["channel_id"] = channel_id
+        if remind_hours is not None:
+            notify["remind_hours"] = remind_hours
+        # Validated the same way as the config on disk
+        self.notify = self.read_notify_conf({ConfKeys.NOTIFY.value: notify})
+        self.journal("set_notify", notify=self.notify)
+        self.plan_reminders()
+
+    def notify_destinations(self, member_id: int) -> List[tuple]:
+        """(kind, target id) for each place a notification about this member goes"""
+        destinations = []
+        if self.notify["dm"]:
+            destinations.append((DM, member_id))
+        if self.notify["channel_id"]:
+            destinations.append((CHANNEL, self.notify["channel_id"]))
+        return destinations
+
+    def notify_on_duty(self, member: MemberRecord):
+        """
+        Queues the "you are on duty" messages. Only queued, the outbox sends them in the background,
+        so a slow or failing send never holds up the rotation. A failure to queue is only logged (by the outbox),
+        for the same reason.
+        """
+        now = int(time.time())
+        role = self.managed_role.name if self.managed_role is not None else "the role"
+        for kind, target_id in self.notify_destinations(member.id):
+            content = (f"You are now on duty for {self.name} ({role})." if kind == DM
+                       else f"<@{member.id}> is now on duty for {self.name} ({role}).")
+            self.outbox.enqueue(f"duty:{self.name}:{member.id}:{now}:{kind}", self.name, kind, target_id, content)
+
+    def plan_reminders(self):
+        """
+        Replaces the reminder jobs with one per remind_hours before the next fire time.
+        One whose time already passed (the bot was down, or the hours were just set) runs right away.
+        The outbox key is per fire time, so planning the same reminder again never sends it twice.
+        """
+        for job_id in self._reminder_jobs:
+            if self.scheduler.get_job(job_id) is not None:
+                self.scheduler.remove_job(job_id)
+        self._reminder_jobs = []
+        if self.next_fire is None or not (self.notify["dm"] or self.notify["channel_id"]):
+            return
+        now = datetime.now(timezone.utc)
+        for hours in self.notify["remind_hours"]:
+            job_id = f"{self.job_id}:remind:{hours:g}"
+            self.scheduler.add_job(self.send_reminder, "date", run_date=max(self.next_fire - timedelta(hours=hours), now),
+                                   args=[self.next_fire, hours], id=job_id, replace_existing=True,
+                                   misfire_grace_time=None)
+            self._reminder_jobs.append(job_id)
+
+    async def send_reminder(self, fire_time: datetime, hours: float):
+        """
+        What a reminder job runs: tells whoever will be put on duty at fire_time. Async so it runs on the event loop.
+        Skipped if the schedule changed since it was planned. The member is picked like the rotation will, on a fresh
+        copy of the strategy (see RotationPreview), so members added or moved in the meantime are accounted for.
+        """
+        if not self.config_good or fire_time != self.next_fire or len(self.members) == 0 or not self.is_leader():
+            return
+        member = self.members[self.build_strategy().choose(self.members, self.index, fire_time.timestamp())]
+        stamp = int(fire_time.timestamp())
+        for kind, target_id in self.notify_destinations(member.id):
+            content = (f"Reminder: you are on duty for {self.name} <t:{stamp}:R> (<t:{stamp}:f>)." if kind == DM
+                       else f"Reminder: <@{member.id}> is on duty for {self.name} <t:{stamp}:R>.")
+            self.outbox.enqueue(f"remind:{self.name}:{stamp}:{hours:g}:{kind}", self.name, kind, target_id, content)
 
     @override
     def __str__(self):
         # todo this will definetly throw errors when the config isnt configured... but it needs to not
-        return (f"<RoleRotation (Configured)>\n"
+        return (f"<RoleRotation '{self.name}' (Configured)>\n"
                 f"Guild id: {self.guild_id} \n"
                 f"Guild: {self.guild} \n"                
                 f"Role: {self.role_id} ({self.managed_role})\n"
                 f"Schedule Days: {self.schedule_day}\n"
                 f"Schedule Time: {self.schedule_hour:02d}:{self.schedule_minute:02d}\n"
+                f"Next Rotation: {self.next_fire}\n"
                 f"Current Index: {self.index}\n"
-                f"Members: {list(m.name for m in self.members)}"
+                f"Strategy: {self.strategy_name} (weights: {len(self.weights)}, unavailable: {len(self.unavailable)})\n"
+                f"Notify: {self.notify}\n"
+                f"Members: {list(m.name for m in self.members)}\n"
+                f"Cache: {self.cache.stats()}\n"
+                f"Operations: {self.operations.stats()}"
                 )
                 # f"On Duty: {self.members[self.index].name if self.members else 'None'}\n"
                 # f"Users: {[user.name for user in self.members]}")
 
+    # --- Gateway events, forwarded by the client in main.py ---
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        if after.guild.id != self.guild_id:
+            return
+        self.cache.on_member_update(before, after)
+        if after.id in self.members:
+            self.members.replace(MemberRecord.from_member(after, self.managed_role))
+
+    def on_member_remove(self, member: discord.Member):
+        if member.guild.id != self.guild_id:
+            return
+        self.cache.on_member_remove(member)
+        if member.id in self.members:
+            self.log.warning("%s left the server but is still in the rotation. Remove them with /remove_member",
+                             member.name)
+
+    def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if after.guild.id != self.guild_id:
+            return
+        self.cache.on_guild_role_update(before, after)
+        if self.managed_role is not None and after.id == self.managed_role.id:
+            self.managed_role = after
+
+    def on_guild_role_delete(self, role: discord.Role):
+        if role.guild.id != self.guild_id:
+            return
+        self.cache.on_guild_role_delete(role)
+        if self.managed_role is not None and role.id == self.managed_role.id:
+            self.config_good = False
+            self.loaded = False
+            self.log.error("The managed role '%s' was deleted. Set a new role_id in the config and /reload.", role.name)
+
+    @property
+    def job_id(self) -> str:
+        return f"rotate:{self.name}"
+
+    def cron_trigger(self) -> CronTrigger:
+        return CronTrigger(day_of_week=self.schedule_day, hour=self.schedule_hour, minute=self.schedule_minute,
+                           timezone=self.scheduler.timezone)
+
+    async def scheduled_rotation(self, fire_time: Optional[datetime] = None):
+        """
+        What the cron job runs, and what catch_up runs for a missed fire_time.
+        Waits its turn behind any command that is changing the rotation.
+        Only the leader rotates. The others leave fire_time unrecorded in schedule.db, so whoever takes over
+        catches up on it if the leader never did it (see take_over).
+        """
+        fire_time = fire_time or datetime.now(timezone.utc)
+        if not self.is_leader():
+            self.log.debug("Not the leader, leaving the rotation due at %s to it", fire_time)
+            # Still kept current, for /debug and for the reminders if this replica takes over
+            self.next_fire = self.cron_trigger().get_next_fire_time(None, datetime.now(timezone.utc))
+            return
+        try:
+            await self.executor.submit("rotate_role", self.rotate_as_leader)
+        except Exception as e:
+            # Whatever part of the rotation did happen, make the role match the index again
+            self.log.error("Rotation failed, reconciling the role: %s", e)
+            await self.executor.submit("reconcile", self.reconcile, merge=True)
+            raise e
+        self.next_fire = self.cron_trigger().get_next_fire_time(fire_time, datetime.now(timezone.utc))
+        self.schedules.fired(self.job_id, fire_time, self.next_fire)
+        self.plan_reminders()
+
+    async def rotate_as_leader(self) -> RotationReport:
+        """
+        rotate_role for the scheduler. Checked again on every try, so a replica that lost the lease while waiting in
+        line, or while losing a conflict (see RotationExecutor), leaves the rotation to the new leader.
+        """
+        if not self.is_leader():
+            raise Exception("Not the leader anymore, the new leader does this rotation")
+        return await self.rotate_role()
+
+    def is_leader(self) -> bool:
+        return self.leader is None or self.leader()
+
+    def take_over(self):
+        """
+        Called when this replica becomes the leader. Rotations the last leader missed (it crashed right before one,
+        or the failover straddled it) are caught up like after a restart, and the reminders are planned again
+        for the next fire time from now, whatever this replica last saw.
+        A reminder the last leader already queued isnt sent twice, the outbox key is the same.
+        """
+        if not self.config_good:
+            return
+        trigger = self.cron_trigger()
+        self.catch_up(trigger)
+        self.next_fire = trigger.get_next_fire_time(None, datetime.now(timezone.utc))
+        self.plan_reminders()
+
+    async def refresh(self):
+        """
+        With a SharedState, reloads first if another replica changed the rotation since it was read here, so a change
+        starts from the newest state instead of losing the race (StaleConfig). One indexed read when nothing changed.
+        The executor calls it before each mutation.
+        """
+        if not isinstance(self.store, SharedConfigStore) or not self.config_good or not self.store.changed_on_disk():
+            return
+        report = await self.reload_config()
+        if isinstance(report, Exception):
+            self.log.error("Couldn't catch up with the other replicas, still using the old config: %s", report)
+
+    async def recover_from_conflict(self):
+        """
+        After a StaleConfig the loaded state has a change that was never written. Reloading throws it away and catches
+        up with the other replicas, then the role is made to match the index in case the change had already moved it.
+        """
+        report = await self.reload_config()
+        if isinstance(report, Exception):
+            raise report
+        await self.reconcile()
+
     def retrigger_scheduler(self):
-        """Must be called after reloading config from disk. Updates the scheduler to match is stored in the class"""
+        """
+        Must be called after reloading config from disk. Updates the scheduler to match is stored in the class.
+        The first time, rotations missed while the bot was down are caught up. After that the job is only
+        rescheduled in place when the schedule actually changed, so a /reload leaves it alone.
+        """
+        schedule = (self.schedule_day, self.schedule_hour, self.schedule_minute)
+        trigger = self.cron_trigger()
+        caught_up = []
+        # The scheduler may be shared with other rotations, so only touch this rotation's own job
+        if self.scheduler.get_job(self.job_id) is None:
+            caught_up = self.catch_up(trigger)
+            self.scheduler.add_job(self.scheduled_rotation, trigger, id=self.job_id,
+                                   misfire_grace_time=self.misfire_grace_time, coalesce=self.coalesce)
+        elif schedule != self._scheduled:
+            self.scheduler.reschedule_job(self.job_id, trigger=trigger)
+        else:
+            return
+
+        self._scheduled = schedule
+        self.next_fire = trigger.get_next_fire_time(None, datetime.now(timezone.utc))
+        self.plan_reminders()
+        if not caught_up:  # Otherwise the missed fire stays on disk until its catch up has actually run
+            self.schedules.scheduled(self.job_id, schedule, self.next_fire)
 
-        self.scheduler.remove_all_jobs()
-        self.scheduler.add_job(
-            self.rotate_role,
-            trigger='cron',
-            day_of_week=self.schedule_day,
-            hour=self.schedule_hour,
-            minute=self.schedule_minute,
-        )
+    def catch_up(self, trigger: CronTrigger) -> List[datetime]:
+        """
+        Finds the fire times that passed since the next fire time schedule.db last recorded, and queues a rotation for them.
+        Ones later than misfire_grace_time are skipped. With coalesce, several missed fires become a single rotation.
+        Returns the fire times that will be rotated for.
+        """
+        state = self.schedules.get(self.job_id)
+        if state is None or state.next_fire is None:
+            return []
+        now = datetime.now(timezone.utc)
+        missed = []
+        fire = state.next_fire
+        while fire is not None and fire <= now and len(missed) < MAX_MISSED_FIRES:
+            missed.append(fire)
+            fire = trigger.get_next_fire_time(fire, fire + timedelta(microseconds=1))
+        if not missed:
+            return []
+
+        late = [fire for fire in missed
+                if self.misfire_grace_time is None or (now - fire).total_seconds() <= self.misfire_grace_time]
+        if len(late) < len(missed):
+            self.log.warning("Skipping %d rotation(s) that were due more than %s seconds ago",
+                             len(missed) - len(late), self.misfire_grace_time)
+        runs = late[-1:] if self.coalesce else late
+        if runs:
+            self.log.warning("Missed %d rotation(s) while the bot was down, catching up with %d", len(late), len(runs))
+        for fire in runs:
+            # No trigger means run as soon as the scheduler starts, however late that is
+            self.scheduler.add_job(self.scheduled_rotation, args=[fire], id=f"{self.job_id}:catch_up:{fire.timestamp()}",
+                                   replace_existing=True, misfire_grace_time=None)
+        return runs
 
     def set_new_schedule(self, day=-1, hour=-1, minute=-1):
         self.schedule_day = self.schedule_day if day == -1 else day
         self.schedule_hour = self.schedule_hour if hour == -1 else hour
         self.schedule_minute = self.schedule_minute if minute == -1 else minute
 
-        self.write_config()
+        self.journal("set_schedule", day=self.schedule_day, hour=self.schedule_hour, minute=self.schedule_minute)
         self.retrigger_scheduler()
 
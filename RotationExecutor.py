@@ -0,0 +1,114 @@
+import asyncio
+import inspect
+from typing import Callable, Dict, Optional, Union
+
+from SharedState import StaleConfig
+
+# A mutation that lost a race with another replica is retried on the fresh state this many times before giving up
+MAX_CONFLICT_RETRIES = 3
+# These read the whole config anyway, so they dont need a refresh first
+_READS_CONFIG = ("load_config", "reload_config")
+
+
+class Job:
+    def __init__(self, name: str, fn: Callable, args: tuple, key: Optional[tuple]):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class RotationExecutor:
+    """
+    Runs the mutations of one RoleRotation one at a time, in the order they were submitted.
+
+    Without this a scheduled rotate_role could be halfway through an await when /add_member or /set_index
+    changes `index` or `members` underneath it. Everything that changes the rotation goes through submit().
+
+    Reads dont wait in line: `snapshot` is the state as of the last finished mutation, for /debug and the like.
+    A mutation submitted with merge=True is merged into an identical one (same name and args) that hasnt started yet,
+    and both callers get the same result.
+
+    With replicas (a SharedState), other processes change the rotation too. Each mutation first catches up with them
+    (RoleRotation.refresh), and if another replica still commits first the write fails with StaleConfig. The rotation
+    then reloads and the mutation runs again from the new state, optimistic concurrency instead of a lock across processes.
+    """
+
+    def __init__(self, rotation):
+        self.rotation = rotation
+        self.snapshot: Union[str, Exception] = "<RoleRotation (Not loaded yet)>"
+        self.executed: int = 0
+        self.merged: int = 0
+        self.conflicts: int = 0  # StaleConfig retries, only with replicas
+        self.current: Optional[str] = None  # Name of the mutation running right now
+        self._queue: Optional[asyncio.Queue] = None
+        self._waiting: Dict[tuple, Job] = {}
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, name: str, fn: Callable, *args, merge=False):
+        """Queues fn(*args) (sync or async) and returns its result once it has run. Exceptions are raised here."""
+        key = (name, *args) if merge else None
+        if key is not None and key in self._waiting:
+            self.merged += 1
+            return await asyncio.shield(self._waiting[key].future)
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._work(), name="RotationExecutor")
+
+        job = Job(name, fn, args, key)
+        if key is not None:
+            self._waiting[key] = job
+        self._queue.put_nowait(job)
+        # Shielded so a caller giving up (e.g. a cancelled command) doesnt stop a mutation halfway
+        return await asyncio.shield(job.future)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def refresh_snapshot(self):
+        try:
+            self.snapshot = self.rotation.__str__()
+        except IndexError as e:
+            # __str__ can fail while the config is broken, /debug knows how to deal with it
+            self.snapshot = e
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            if job.key is not None:
+                del self._waiting[job.key]  # From here on, an identical submit has to run again
+            self.current = job.name
+            try:
+                job.future.set_result(await self._run(job))
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                self.current = None
+                self.executed += 1
+                self.refresh_snapshot()
+
+    async def _run(self, job: Job):
+        if job.name not in _READS_CONFIG:
+            await self.rotation.refresh()
+        for attempt in range(MAX_CONFLICT_RETRIES + 1):
+            try:
+                result = job.fn(*job.args)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            except StaleConfig as e:
+                self.conflicts += 1
+                await self.rotation.recover_from_conflict()
+                if attempt == MAX_CONFLICT_RETRIES:
+                    e.add_note(f"Gave up after {attempt + 1} tries, the rotation is being changed from elsewhere a lot. "
+                               f"Try again in a moment.")
+                    raise e
+                self.rotation.log.info("Lost a race with another replica on %s, retrying on the new state", job.name)
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import discord
+from apscheduler.events import EVENT_JOB_SUBMITTED, JobSubmissionEvent
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from ConfigWatcher import ConfigWatcher
+from HistoryStore import HistoryStore, HISTORY_DB_NAME
+from LeaderLease import LeaderLease, DEFAULT_LEASE_SECONDS
+from MemberCache import MemberCache
+from Metrics import ENABLED as METRICS_ENABLED, record_scheduler_lag
+from NotificationOutbox import NotificationOutbox, OUTBOX_DB_NAME, DM
+from OperationQueue import OperationQueue
+from Reconciler import Reconciler
+from RoleRotation import RoleRotation, CONFIG_FILE_NAME, DEFAULT_MISFIRE_GRACE
+from ScheduleStore import ScheduleStore, SCHEDULE_DB_NAME
+from SharedState import SharedState
+
+ROTATIONS_FILE_NAME = Path("./rotations.json")
+DEFAULT_ROTATION = "default"
+# Seconds between the leader's checks for notifications queued by the other replicas
+OUTBOX_POLL = 5.0
+
+
+class RotationManager:
+    """
+    Holds every named rotation the process manages, across one guild or several.
+
+    They all share one scheduler, one member cache, one operation queue, schedule.db, history.db and the
+    notification outbox (and the client's single gateway connection), so another rotation costs a config file and a cron job instead of another bot process.
+
+    rotations.json says where each rotation lives:
+        {"oncall": {"guild_id": 123, "config": "conf.oncall.json"}, "cleanup": {"config": "conf.cleanup.json"}}
+    guild_id defaults to the GUILD_ID the bot was started with. An entry can also set "misfire_grace_time" and "coalesce",
+    see RoleRotation.catch_up.
+    Without the file there is one rotation called "default" using conf.json, same as before.
+
+    With `shared` (a path to state.db) this process is one of several replicas. The configs live in the SharedState,
+    schedule.db, history.db and outbox.db are next to it so every replica uses the same ones, and a LeaderLease picks
+    the replica that runs the scheduled rotations, the reminders, the outbox and the reconciler. Every replica serves
+    commands and keeps up with the others through the ConfigWatcher. The config files are only read to fill in
+    a rotation the shared state doesnt have yet.
+    """
+
+    def __init__(self, client: discord.Client, default_guild_id: int, path: Path = ROTATIONS_FILE_NAME,
+                 shared: Optional[Path] = None, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 holder: Optional[str] = None):
+        """holder names this replica in the lease, hostname:pid by default"""
+        self.client = client
+        self.default_guild_id = default_guild_id
+        self.scheduler = AsyncIOScheduler()
+        self.cache = MemberCache()
+        self.operations = OperationQueue()
+        data = shared if shared is not None else path
+        self.state = SharedState(shared) if shared is not None else None
+        self.lease = (LeaderLease(self.state, holder, ttl=lease_seconds, on_elected=self._elected,
+                                  on_demoted=self._demoted) if shared is not None else None)
+        self.schedules = ScheduleStore(data.with_name(SCHEDULE_DB_NAME))
+        self.history = HistoryStore(data.with_name(HISTORY_DB_NAME))
+        # Only the leader sends, so it has to look for rows the other replicas queued
+        self.outbox = NotificationOutbox(data.with_name(OUTBOX_DB_NAME), send=self.deliver,
+                                         poll=OUTBOX_POLL if shared is not None else None)
+        self.rotations: Dict[str, RoleRotation] = {}
+        self.watcher = ConfigWatcher(self.rotations.values)  # Reloads a rotation when its config is edited by hand
+        self.reconciler = Reconciler(self.rotations.values)  # Fixes the role when it drifts between rotations
+
+        for name, entry in self.read_registry(path).items():
+            self.add(name, entry.get("guild_id", default_guild_id), Path(entry.get("config", CONFIG_FILE_NAME)),
+                     misfire_grace_time=entry.get("misfire_grace_time", DEFAULT_MISFIRE_GRACE),
+                     coalesce=entry.get("coalesce", True))
+
+    @staticmethod
+    def read_registry(path: Path) -> dict:
+        if not path.is_file():
+            return {DEFAULT_ROTATION: {"config": str(CONFIG_FILE_NAME)}}
+        with open(path, "r") as fp:
+            registry = json.load(fp)
+        if not registry:
+            raise ValueError(f"{path} doesnt list any rotations")
+        return registry
+
+    def add(self, name: str, guild_id: int, config_path: Path, misfire_grace_time=DEFAULT_MISFIRE_GRACE,
+            coalesce=True) -> RoleRotation:
+        if name in self.rotations:
+            raise ValueError(f"There is already a rotation called {name}")
+        rotation = RoleRotation(self.client, guild_id, config_path=config_path, name=name,
+                                scheduler=self.scheduler, cache=self.cache, operations=self.operations,
+                                schedules=self.schedules, history=self.history, misfire_grace_time=misfire_grace_time, coalesce=coalesce,
+                                outbox=self.outbox, state=self.state, leader=self.lease and self.lease.held,
+                                holder=self.lease and self.lease.holder)
+        self.rotations[name] = rotation
+        return rotation
+
+    def get(self, name: str) -> RoleRotation:
+        try:
+            return self.rotations[name]
+        except KeyError:
+            raise KeyError(f"There is no rotation called '{name}'. Try one of: {', '.join(self.names())}") from None
+
+    def names(self) -> List[str]:
+        return list(self.rotations)
+
+    def guild_ids(self) -> set:
+        return {rotation.guild_id for rotation in self.rotations.values()}
+
+    async def load_all(self) -> Dict[str, Exception]:
+        """Loads every rotation at once. Returns the errors by rotation name, like load_config does."""
+        # Before the gateway is up every rotation would fetch its guild, so fetch each guild once for all of them.
+        # One that fails is left alone, and its rotations try again (and report it) in load_config
+        missing = {rotation.guild_id for rotation in self.rotations.values()
+                   if rotation.guild is None and self.client.get_guild(rotation.guild_id) is None}
+        fetched = await asyncio.gather(*(self.client.fetch_guild(guild_id) for guild_id in missing), return_exceptions=True)
+        guilds = {guild_id: guild for guild_id, guild in zip(missing, fetched) if not isinstance(guild, Exception)}
+        for rotation in self.rotations.values():
+            if rotation.guild is None and rotation.guild_id in guilds:
+                rotation.guild = guilds[rotation.guild_id]
+
+        names = self.names()
+        results = await asyncio.gather(*(
+            self.rotations[name].executor.submit("load_config", self.rotations[name].load_config, merge=True)
+            for name in names
+        ))
+        return {name: error for name, error in zip(names, results) if error is not None}
+
+    def start(self):
+        if METRICS_ENABLED:
+            self.scheduler.add_listener(self._job_submitted, EVENT_JOB_SUBMITTED)
+        self.scheduler.start()
+        self.watcher.start()
+        if self.lease is not None:
+            self.lease.start()  # Starts the rest once this replica is the leader
+        else:
+            self.reconciler.start()
+            self.outbox.start()
+
+    def is_leader(self) -> bool:
+        return self.lease is None or self.lease.held()
+
+    def _elected(self):
+        self.reconciler.start()
+        self.outbox.start()
+        for rotation in self.rotations.values():
+            rotation.take_over()
+
+    def _demoted(self):
+        # The scheduled jobs stay, they check is_leader when they fire
+        self.reconciler.stop()
+        self.outbox.stop()
+
+    async def close(self):
+        self.watcher.stop()
+        if self.lease is not None:
+            self.lease.stop()  # Hands the lease over right away instead of letting it expire
+        self.reconciler.stop()
+        # Make sure the last changes reach the disk before the process goes away.
+        # Compacting also leaves each config complete, so it is safe to hand edit while the bot is down.
+        # A rotation that didnt load isnt compacted (see RoleRotation.loaded), its files stay as the operator left them
+        await asyncio.gather(*(rotation.store.flush(compact=True) for rotation in self.rotations.values()))
+        for rotation in self.rotations.values():
+            rotation.executor.stop()
+        self.operations.stop()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        self.schedules.close()
+        self.history.close()
+        self.outbox.close()
+        if self.state is not None:
+            self.state.close()
+
+    async def deliver(self, kind: str, target_id: int, content: str):
+        """How the outbox sends: a DM to a member, or a post in a channel. Raises what discord.py raises."""
+        if kind == DM:
+            user = self.client.get_user(target_id) or await self.client.fetch_user(target_id)
+            await user.send(content)
+        else:
+            channel = self.client.get_channel(target_id) or await self.client.fetch_channel(target_id)
+            await channel.send(content)
+
+    @staticmethod
+    def _job_submitted(event: JobSubmissionEvent):
+        # Runs on the event loop right as the job is handed to it, so now minus the scheduled time is the lag.
+        # Reminders are planned hours ahead on purpose, only the rotations themselves count
+        if ":remind:" not in event.job_id:
+            record_scheduler_lag(event.job_id, event.scheduled_run_times, time.time())
+
+    # --- Gateway events, each rotation ignores the ones for other guilds ---
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        for rotation in self.rotations.values():
+            rotation.on_member_update(before, after)
+
+    def on_member_remove(self, member: discord.Member):
+        for rotation in self.rotations.values():
+            rotation.on_member_remove(member)
+
+    def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        for rotation in self.rotations.values():
+            rotation.on_guild_role_update(before, after)
+
+    def on_guild_role_delete(self, role: discord.Role):
+        for rotation in self.rotations.values():
+            rotation.on_guild_role_delete(role)
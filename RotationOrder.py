@@ -0,0 +1,206 @@
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import discord
+
+from PrefixIndex import PrefixIndex
+
+
+class MemberRecord:
+    """
+    What a rotation keeps for each member instead of a whole discord.Member: id, display name and whether they hold the role.
+    A Member drags its User, roles and guild along. RoleRotation.member() gets one only when an API call needs it.
+    """
+    __slots__ = ("id", "name", "has_role")
+
+    def __init__(self, member_id: int, name: str, has_role: bool = False):
+        self.id = member_id
+        self.name = name
+        self.has_role = has_role
+
+    @classmethod
+    def from_member(cls, member: discord.Member, role: Optional[discord.Role]) -> "MemberRecord":
+        return cls(member.id, member.display_name, role is not None and role in member.roles)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"<MemberRecord id={self.id} name={self.name!r} has_role={self.has_role}>"
+
+
+class RotationOrder:
+    """
+    The ordered list of members in a rotation, as MemberRecords.
+
+    Member ids are kept in a compact array, with an id -> position index next to it,
+    so membership checks and lookups by id are O(1) and never compare whole records.
+    Inserting, removing and moving only shift the array with a memmove, and remember where the first shifted entry is.
+    position() checks a member's stored position against the array. When a change shifted it, it finds that member
+    again with a scan in C. After REFRESH_AFTER misses since the last change it rewrites every position from the first
+    shifted one on instead. So a change costs about what it does on a list, and N lookups after it cost O(N) together.
+
+    Positions follow list semantics. Use cursor_after_remove / cursor_after_move to keep RoleRotation.index
+    pointing at the same member after a change.
+
+    search() looks members up by name or id through a PrefixIndex. It is only built by the first search, then kept up
+    to date by insert, remove and replace. Moves dont touch it, positions come from the id index.
+    """
+
+    REFRESH_AFTER = 16  # About what one pass over 10k positions costs in scans
+
+    def __init__(self, members: Iterable[MemberRecord] = ()):
+        self._ids = array("Q")  # Discord snowflakes are unsigned 64 bit
+        self._positions: Dict[int, int] = {}
+        self._stale_from = 0  # Positions before this are right, the ones after may be stale
+        self._misses = 0
+        self._members: Dict[int, MemberRecord] = {}
+        self._names: Optional[PrefixIndex] = None
+        for member in members:
+            self.append(member)
+        self._stale_from = len(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[MemberRecord]:
+        members = self._members
+        return (members[member_id] for member_id in self._ids)
+
+    def __getitem__(self, position: int) -> MemberRecord:
+        return self._members[self._ids[position]]
+
+    def __contains__(self, member_id: int) -> bool:
+        return member_id in self._positions
+
+    def ids(self) -> List[int]:
+        return self._ids.tolist()
+
+    def get(self, member_id: int) -> Optional[MemberRecord]:
+        return self._members.get(member_id)
+
+    def position(self, member_id: int) -> Optional[int]:
+        """The position of a member id, or None if they arent in the rotation"""
+        position = self._positions.get(member_id)
+        if position is None:
+            return None
+        # Ids are unique, so finding it there means the position is right
+        if position >= len(self._ids) or self._ids[position] != member_id:
+            self._misses += 1
+            if self._misses < self.REFRESH_AFTER:
+                position = self._find(member_id)
+                self._positions[member_id] = position
+            else:
+                self._refresh_positions()
+                position = self._positions[member_id]
+        return position
+
+    def append(self, member: MemberRecord) -> int:
+        return self.insert(len(self._ids), member)
+
+    def insert(self, position: int, member: MemberRecord) -> int:
+        """
+        Inserts a member before `position`, like list.insert: negative positions count from the end, and out of range
+        ones are clamped. Returns the position they ended up at.
+        """
+        if member.id in self._positions:
+            raise ValueError(f"{member.id} is already in the rotation")
+        if position < 0:
+            position += len(self._ids)
+        position = max(0, min(position, len(self._ids)))
+        self._shifted(position)
+        self._ids.insert(position, member.id)
+        self._members[member.id] = member
+        self._positions[member.id] = position
+        if self._names is not None:
+            self._names.add(member.id, member.name)
+        return position
+
+    def remove(self, member_id: int) -> (int, MemberRecord):
+        """Removes a member id. Returns (old position, member). Raises KeyError if they arent in the rotation."""
+        position = self.position(member_id)
+        if position is None:
+            raise KeyError(member_id)
+        self._shifted(position)
+        del self._ids[position]
+        del self._positions[member_id]
+        member = self._members.pop(member_id)
+        if self._names is not None:
+            self._names.discard(member_id, member.name)
+        return position, member
+
+    def move(self, member_id: int, position: int) -> int:
+        """Moves a member so they end up at `position`. Returns their old position."""
+        if position < 0 or position >= len(self._ids):
+            raise IndexError(f"Tried to move to an out-of-range index. Max is {len(self._ids) - 1}")
+        old = self.position(member_id)
+        if old is None:
+            raise KeyError(member_id)
+        if old == position:
+            return old
+        self._shifted(min(old, position))
+        del self._ids[old]
+        self._ids.insert(position, member_id)
+        self._positions[member_id] = position
+        return old
+
+    def replace(self, member: MemberRecord):
+        """Swaps in a newer record for a member who is already in the rotation, without changing the order."""
+        if member.id not in self._positions:
+            raise KeyError(member.id)
+        old = self._members[member.id]
+        self._members[member.id] = member
+        if self._names is not None and old.name != member.name:
+            self._names.discard(old.id, old.name)
+            self._names.add(member.id, member.name)
+
+    def _find(self, member_id: int) -> int:
+        # array.index makes an int object of every entry it compares, searching the raw bytes is several times faster.
+        # A match that isnt on an 8 byte boundary straddles two ids, so it is skipped
+        data = self._ids.tobytes()
+        needle = member_id.to_bytes(self._ids.itemsize, sys.byteorder)
+        at = data.find(needle)
+        while at != -1 and at % self._ids.itemsize:
+            at = data.find(needle, at + 1)
+        if at < 0:
+            raise ValueError(f"{member_id} is not in the rotation")
+        return at // self._ids.itemsize
+
+    def _shifted(self, start: int):
+        if start < len(self._ids):
+            self._stale_from = min(self._stale_from, start)
+            self._misses = 0
+
+    def _refresh_positions(self):
+        start = self._stale_from
+        self._positions.update(zip(self._ids[start:], range(start, len(self._ids))))
+        self._stale_from = len(self._ids)
+        self._misses = 0
+
+    def search(self, prefix: str, limit: int) -> List[MemberRecord]:
+        """
+        Up to `limit` members whose name, a word of their name or id starts with `prefix` (ignoring case).
+        An empty prefix gives the first `limit` members in rotation order.
+        """
+        if not prefix.strip():
+            return [self._members[member_id] for member_id in self._ids[:limit]]
+        if self._names is None:
+            self._names = PrefixIndex((member.id, member.name) for member in self._members.values())
+        return [self._members[member_id] for member_id in self._names.search(prefix, limit)]
+
+
+def cursor_after_remove(cursor: int, removed: int) -> int:
+    """Where the cursor ends up after the entry at `removed` is deleted, so it keeps pointing at the same member."""
+    return cursor - 1 if removed < cursor else cursor
+
+
+def cursor_after_move(cursor: int, old: int, new: int) -> int:
+    """Where the cursor ends up after an entry moves from `old` to `new`, so it keeps pointing at the same member."""
+    if cursor == old:
+        return new
+    if old < cursor <= new:
+        return cursor - 1
+    if new <= cursor < old:
+        return cursor + 1
+    return cursor
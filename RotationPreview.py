@@ -0,0 +1,163 @@
+"""
+Previews who will be on duty for the next few weeks, from the config alone. No token needed.
+
+    python RotationPreview.py --weeks 12
+    python RotationPreview.py --rotation oncall --weeks 52 --day 2 --hour 9
+    python RotationPreview.py --strategy least_recent --move 123456789012345567 0
+
+Names come from history.db, members it has never seen are shown by id.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from apscheduler.triggers.cron import CronTrigger
+
+from RoleRotation import RoleRotation, ConfKeys, CONFIG_FILE_NAME
+from RotationManager import RotationManager, ROTATIONS_FILE_NAME, DEFAULT_ROTATION
+from RotationOrder import MemberRecord, RotationOrder, cursor_after_move
+from RotationStrategy import STRATEGIES
+from SharedState import SharedState
+
+DEFAULT_WEEKS = 8
+
+
+class Assignment:
+    __slots__ = ("time", "index", "member_id", "name")
+
+    def __init__(self, fire_time: datetime, index: int, member_id: int, name: str):
+        self.time = fire_time
+        self.index = index
+        self.member_id = member_id
+        self.name = name
+
+    def __str__(self):
+        return f"{self.time.astimezone():%a %Y-%m-%d %H:%M}  {self.name}"
+
+
+class RotationPreview:
+    """
+    Fast-forwards a rotation on a simulated clock: the real members, index, schedule and strategy, but no Discord calls
+    and nothing written. The cron trigger gives the fire times, and a fresh copy of the strategy picks who is on duty
+    at each one, with availability as of that time.
+
+    Any of the schedule, the strategy and the member order can be swapped out first, to see what a
+    /set_schedule, /set_strategy or /move_member would do before running it.
+    """
+
+    def __init__(self, rotation: RoleRotation, schedule: Optional[Tuple[int, int, int]] = None,
+                 strategy: Optional[str] = None, moves: List[Tuple[int, int]] = ()):
+        """
+        rotation is a loaded RoleRotation. schedule is (day, hour, minute), where -1 keeps that part like
+        set_new_schedule does. moves are (member id, position) pairs applied in order, like move_member.
+        Raises ValueError for an unknown strategy, a member who isnt in the rotation or a position out of range.
+        """
+        self.rotation = rotation
+        day, hour, minute = schedule or (-1, -1, -1)
+        self.schedule = (rotation.schedule_day if day == -1 else day,
+                         rotation.schedule_hour if hour == -1 else hour,
+                         rotation.schedule_minute if minute == -1 else minute)
+        self.strategy_name = strategy or rotation.strategy_name
+
+        # Only the order is copied, the records are shared but never changed here
+        self.members = RotationOrder(rotation.members)
+        self.index = rotation.index
+        for member_id, position in moves:
+            if member_id not in self.members:
+                raise ValueError(f"{member_id} is not in the rotation")
+            if not 0 <= position < len(self.members):
+                raise ValueError(f"Position {position} is out of range. Max is {len(self.members) - 1}")
+            old = self.members.move(member_id, position)
+            self.index = cursor_after_move(self.index, old, position)
+
+    def trigger(self) -> CronTrigger:
+        day, hour, minute = self.schedule
+        return CronTrigger(day_of_week=day, hour=hour, minute=minute, timezone=self.rotation.scheduler.timezone)
+
+    def run(self, count: Optional[int] = None, until: Optional[datetime] = None,
+            start: Optional[datetime] = None) -> List[Assignment]:
+        """
+        The next `count` rotations, or every rotation up to `until` (or both, whichever comes first), after `start`.
+        start defaults to now.
+        """
+        if count is None and until is None:
+            raise ValueError("Give a count or an until, or the preview never ends")
+        if not len(self.members):
+            return []
+        strategy = self.rotation.build_strategy(self.strategy_name)
+        trigger = self.trigger()
+        index = self.index
+        assignments = []
+        fire = trigger.get_next_fire_time(None, start or datetime.now(timezone.utc))
+        while fire is not None and (count is None or len(assignments) < count) and (until is None or fire <= until):
+            now = fire.timestamp()
+            index = strategy.choose(self.members, index, now)
+            member = self.members[index]
+            strategy.on_duty(member.id, now)
+            assignments.append(Assignment(fire, index, member.id, member.name))
+            fire = trigger.get_next_fire_time(fire, fire + timedelta(microseconds=1))
+        return assignments
+
+
+def rotation_from_config(config_path: Path, name: str, state: Optional[SharedState] = None) -> RoleRotation:
+    """
+    A RoleRotation filled in from its config alone, with no client, so it can only be previewed.
+    Members are named from history.db when it knows them. With a SharedState the config is read from there.
+    """
+    rotation = RoleRotation(None, 0, config_path=config_path, name=name, state=state)
+    conf_json = rotation.read_config()
+    names = rotation.history.names(name)
+    rotation.members = RotationOrder(MemberRecord(member_id, names.get(member_id, str(member_id)))
+                                     for member_id in conf_json[ConfKeys.MEMBER_IDS.value])
+    rotation.index = conf_json[ConfKeys.INDEX.value]
+    rotation.schedule_day = conf_json[ConfKeys.SCHEDULE_DAY.value]
+    rotation.schedule_hour = conf_json[ConfKeys.SCHEDULE_HOUR.value]
+    rotation.schedule_minute = conf_json[ConfKeys.SCHEDULE_MINUTE.value]
+    rotation.strategy_name, rotation.weights, rotation.unavailable = rotation.read_strategy_conf(conf_json)
+    return rotation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rotation", default=DEFAULT_ROTATION, help="a name from rotations.json")
+    parser.add_argument("--rotations", type=Path, default=ROTATIONS_FILE_NAME, help="where rotations.json is")
+    parser.add_argument("--shared", type=Path, default=os.getenv("SHARED_STATE") or None,
+                        help="the replicas' state.db, SHARED_STATE by default")
+    parser.add_argument("--weeks", type=int, default=DEFAULT_WEEKS, help="how far ahead to look")
+    parser.add_argument("--day", type=int, default=-1, help="preview with this schedule day instead (monday is 0)")
+    parser.add_argument("--hour", type=int, default=-1, help="preview with this schedule hour instead")
+    parser.add_argument("--minute", type=int, default=-1, help="preview with this schedule minute instead")
+    parser.add_argument("--strategy", choices=STRATEGIES, help="preview with this strategy instead")
+    parser.add_argument("--move", type=int, nargs=2, action="append", default=[], metavar=("MEMBER_ID", "POSITION"),
+                        help="preview as if the member was moved to this position first. Can be repeated")
+    args = parser.parse_args()
+
+    registry = RotationManager.read_registry(args.rotations)
+    if args.rotation not in registry:
+        parser.error(f"There is no rotation called '{args.rotation}'. Try one of: {', '.join(registry)}")
+    state = SharedState(args.shared) if args.shared is not None else None
+    rotation = rotation_from_config(Path(registry[args.rotation].get("config", CONFIG_FILE_NAME)), args.rotation, state)
+
+    start = time.perf_counter()
+    try:
+        preview = RotationPreview(rotation, (args.day, args.hour, args.minute), args.strategy,
+                                  [tuple(move) for move in args.move])
+        assignments = preview.run(until=datetime.now(timezone.utc) + timedelta(weeks=args.weeks))
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+    for assignment in assignments:
+        print(assignment)
+    print(f"{len(assignments)} rotation(s) with {preview.strategy_name} in {elapsed * 1000:.1f} ms")
+    rotation.schedules.close()
+    rotation.history.close()
+    rotation.outbox.close()
+    if state is not None:
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
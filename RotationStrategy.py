@@ -0,0 +1,353 @@
+import heapq
+import itertools
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from RotationOrder import RotationOrder
+
+ROUND_ROBIN = "round_robin"
+WEIGHTED = "weighted"
+LEAST_RECENT = "least_recent"
+
+# (start, end) time.time() timestamps. The member is unavailable from start up to, but not including, end
+Window = Tuple[float, float]
+
+
+class Availability:
+    """
+    When each member is unavailable (vacations), as windows.
+
+    Window edges sit in a heap by time. advance(now) pops the edges the clock passed and counts the open windows
+    per member, so checking a member is O(1) and moving the clock costs O(log W) per edge crossed, never a scan
+    of every window. The clock only moves forward, going back (a simulation starting over) replays the edges.
+    """
+
+    def __init__(self, windows: Optional[Dict[int, List[Window]]] = None):
+        self.windows: Dict[int, List[Window]] = {member_id: sorted(spans)
+                                                 for member_id, spans in (windows or {}).items() if spans}
+        self.now = float("-inf")
+        self._open: Dict[int, int] = {}
+        self._edges: List[tuple] = []
+        self._replay()
+
+    def _replay(self):
+        self.now = float("-inf")
+        self._open = {}
+        # An end sorts before a start at the same time, so back to back windows dont overlap
+        self._edges = [(at, delta, member_id) for member_id, spans in self.windows.items()
+                       for start, end in spans for at, delta in ((start, 1), (end, -1))]
+        heapq.heapify(self._edges)
+
+    def advance(self, now: float) -> Optional[List[int]]:
+        """Moves the clock to now. Returns the members whose availability may have changed, or None after a replay."""
+        if now < self.now:
+            self._replay()
+            self.advance(now)
+            return None
+        changed = []
+        edges = self._edges
+        while edges and edges[0][0] <= now:
+            at, delta, member_id = heapq.heappop(edges)
+            count = self._open.get(member_id, 0) + delta
+            if count > 0:
+                self._open[member_id] = count
+            else:
+                self._open.pop(member_id, None)
+            changed.append(member_id)
+        self.now = now
+        return changed
+
+    def available(self, member_id: int) -> bool:
+        """As of the last advance()"""
+        return member_id not in self._open
+
+    def __bool__(self):
+        return bool(self.windows)
+
+
+class Fenwick:
+    """Prefix sums over 0/1 flags with O(log N) updates, and finding the k-th set flag in O(log N)"""
+
+    def __init__(self, flags: Iterable[int]):
+        self.flags = list(flags)
+        size = len(self.flags)
+        self._tree = [0] * (size + 1)
+        for i, flag in enumerate(self.flags, 1):
+            self._tree[i] += flag
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+        self.total = sum(self.flags)
+
+    def set(self, position: int, flag: int):
+        delta = flag - self.flags[position]
+        if not delta:
+            return
+        self.flags[position] = flag
+        self.total += delta
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, stop: int) -> int:
+        """How many flags are set before `stop`"""
+        total = 0
+        while stop > 0:
+            total += self._tree[stop]
+            stop -= stop & -stop
+        return total
+
+    def find(self, k: int) -> int:
+        """The position of the k-th set flag, counting from 1. k must be at most total."""
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(self._tree) and self._tree[following] < k:
+                position = following
+                k -= self._tree[following]
+            step >>= 1
+        return position
+
+
+class RotationStrategy:
+    """
+    Decides who goes on duty next. RoleRotation.rotate_role calls choose(), then on_duty() once the role has moved.
+
+    A strategy builds its structures from the rotation once, and keeps them up to date from the hooks below,
+    so a choice is O(log N) instead of a scan. Anything it cant update in place (a move, new availability)
+    marks it dirty and it rebuilds on the next choice, which is rare next to rotations.
+    Members who are unavailable right now are skipped. If nobody is available, the plain next member is picked.
+    """
+    name = ""
+
+    def __init__(self, availability: Optional[Availability] = None, weights: Optional[Dict[int, float]] = None,
+                 shifts: Optional[Dict[int, int]] = None, last_duty: Optional[Dict[int, float]] = None):
+        """shifts and last_duty are how many shifts each member did and when their last one started, from the history"""
+        self.availability = availability or Availability()
+        self.weights = weights or {}
+        self.shifts = dict(shifts or {})
+        self.last_duty = dict(last_duty or {})
+        self._dirty = True
+
+    def choose(self, members: RotationOrder, index: int, now: float) -> int:
+        """The position of whoever should be on duty after the member at `index`"""
+        changed = self.availability.advance(now)
+        if self._dirty or changed is None:
+            self.rebuild(members)
+            self._dirty = False
+        else:
+            for member_id in changed:
+                self.availability_changed(members, member_id)
+        position = self.pick(members, index)
+        return position if position is not None else (index + 1) % len(members)
+
+    def on_duty(self, member_id: int, now: float):
+        self.shifts[member_id] = self.shifts.get(member_id, 0) + 1
+        self.last_duty[member_id] = now
+
+    def invalidate(self):
+        self._dirty = True
+
+    # --- Overridden by the strategies ---
+    def rebuild(self, members: RotationOrder):
+        raise NotImplementedError
+
+    def pick(self, members: RotationOrder, index: int) -> Optional[int]:
+        """The chosen position, or None if nobody is available"""
+        raise NotImplementedError
+
+    def availability_changed(self, members: RotationOrder, member_id: int):
+        pass
+
+    def member_added(self, members: RotationOrder, member_id: int):
+        self.invalidate()
+
+    def member_removed(self, members: RotationOrder, member_id: int):
+        self.invalidate()
+
+    def member_moved(self, members: RotationOrder, member_id: int):
+        self.invalidate()
+
+
+class RoundRobin(RotationStrategy):
+    """The next member in the list, wrapping around. A Fenwick tree over who is available finds the next one to skip to."""
+    name = ROUND_ROBIN
+
+    def rebuild(self, members: RotationOrder):
+        self._available = Fenwick(int(self.availability.available(member_id)) for member_id in members.ids())
+
+    def pick(self, members: RotationOrder, index: int) -> Optional[int]:
+        available = self._available
+        if available.total == 0:
+            return None
+        up_to = available.prefix(index + 1)
+        return available.find(up_to + 1 if up_to < available.total else 1)
+
+    def availability_changed(self, members: RotationOrder, member_id: int):
+        position = members.position(member_id)
+        if position is not None:
+            self._available.set(position, int(self.availability.available(member_id)))
+
+
+class _LowestKey(RotationStrategy):
+    """
+    Picks the member with the lowest key from a heap, earliest pushed first on a tie.
+    Only available members are in it: one who becomes unavailable is dropped, and pushed back when they return.
+    Entries are replaced lazily. A new key pushes a new entry, and an entry that is out of date (or for someone who left
+    or is away) is dropped when it reaches the top.
+    """
+
+    def key(self, member_id: int) -> float:
+        raise NotImplementedError
+
+    def returning_key(self, member_id: int) -> float:
+        """The key of a member who joins, or is available again"""
+        return self.key(member_id)
+
+    def rebuild(self, members: RotationOrder):
+        self._order = itertools.count()
+        self._keys = {member_id: self.key(member_id) for member_id in members.ids()
+                      if self.availability.available(member_id)}
+        self._heap = [(key, next(self._order), member_id) for member_id, key in self._keys.items()]
+        heapq.heapify(self._heap)
+
+    def pick(self, members: RotationOrder, index: int) -> Optional[int]:
+        on_duty = members[index].id
+        best = self._top(members)
+        if best is not None and best[2] == on_duty:
+            # Whoever is on duty now only goes again if nobody else can
+            heapq.heappop(self._heap)
+            runner_up = self._top(members)
+            heapq.heappush(self._heap, best)
+            best = runner_up or best
+        # Stays in the heap until on_duty gives it a new key
+        return members.position(best[2]) if best is not None else None
+
+    def _top(self, members: RotationOrder) -> Optional[tuple]:
+        """The lowest entry that is still current, dropping the stale ones above it"""
+        heap = self._heap
+        while heap:
+            key, order, member_id = heap[0]
+            if self._keys.get(member_id) == key and member_id in members:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def _lowest_key(self, default: float) -> float:
+        """The lowest current key, read off the top of the heap once the stale entries above it are dropped"""
+        heap = self._heap
+        while heap:
+            key, order, member_id = heap[0]
+            if self._keys.get(member_id) == key:
+                return key
+            heapq.heappop(heap)
+        return default
+
+    def availability_changed(self, members: RotationOrder, member_id: int):
+        if member_id not in members:
+            return
+        if not self.availability.available(member_id):
+            self._keys.pop(member_id, None)
+        elif member_id not in self._keys:
+            self._push(member_id, self.returning_key(member_id))
+
+    def on_duty(self, member_id: int, now: float):
+        super().on_duty(member_id, now)
+        if not self._dirty and member_id in self._keys:
+            self._push(member_id, self.key(member_id))
+
+    def member_added(self, members: RotationOrder, member_id: int):
+        if not self._dirty and self.availability.available(member_id):
+            self._push(member_id, self.returning_key(member_id))
+
+    def member_removed(self, members: RotationOrder, member_id: int):
+        if not self._dirty:
+            self._keys.pop(member_id, None)
+
+    def member_moved(self, members: RotationOrder, member_id: int):
+        pass  # The order in the list doesnt matter here
+
+    def _push(self, member_id: int, key: float):
+        self._keys[member_id] = key
+        heapq.heappush(self._heap, (key, next(self._order), member_id))
+
+
+class LeastRecent(_LowestKey):
+    """Whoever has gone longest without a shift, members who never had one first"""
+    name = LEAST_RECENT
+
+    def key(self, member_id: int) -> float:
+        return self.last_duty.get(member_id, 0.0)
+
+
+class Weighted(_LowestKey):
+    """
+    Stride scheduling: a member with weight 2 gets twice the shifts of one with weight 1 (the default).
+    Each member has a pass, which starts at shifts / weight and goes up by 1 / weight every shift.
+    Whoever has the lowest pass is next. A member who joins or comes back from being away starts level with
+    the lowest pass, so they take their turn without catching up on every shift they missed.
+    """
+    name = WEIGHTED
+
+    def rebuild(self, members: RotationOrder):
+        ids = members.ids()
+        self._pass = {member_id: self.shifts[member_id] / self.weight(member_id) for member_id in ids
+                      if member_id in self.shifts}
+        floor = min(self._pass.values(), default=0.0)
+        for member_id in ids:
+            self._pass.setdefault(member_id, floor)
+        super().rebuild(members)
+
+    def weight(self, member_id: int) -> float:
+        return self.weights.get(member_id, 1.0)
+
+    def key(self, member_id: int) -> float:
+        return self._pass[member_id]
+
+    def returning_key(self, member_id: int) -> float:
+        floor = self._lowest_key(default=0.0)
+        self._pass[member_id] = max(self._pass.get(member_id, floor), floor)
+        return self._pass[member_id]
+
+    def on_duty(self, member_id: int, now: float):
+        if not self._dirty and member_id in self._pass:
+            self._pass[member_id] += 1 / self.weight(member_id)
+        super().on_duty(member_id, now)
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (RoundRobin, LeastRecent, Weighted)}
+
+
+def make_strategy(name: str, availability: Optional[Availability] = None, weights: Optional[Dict[int, float]] = None,
+                  shifts: Optional[Dict[int, int]] = None, last_duty: Optional[Dict[int, float]] = None) -> RotationStrategy:
+    try:
+        strategy = STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"Unknown rotation strategy '{name}'. Try one of: {', '.join(STRATEGIES)}") from None
+    return strategy(availability, weights, shifts, last_duty)
+
+
+# --- Config format: ids are strings (JSON keys) and windows are ISO times, so conf.json stays easy to edit by hand ---
+def weights_from_conf(weights: dict) -> Dict[int, float]:
+    return {int(member_id): float(weight) for member_id, weight in weights.items()}
+
+
+def weights_to_conf(weights: Dict[int, float]) -> dict:
+    return {str(member_id): weight for member_id, weight in weights.items()}
+
+
+def windows_from_conf(unavailable: dict) -> Dict[int, List[Window]]:
+    return {int(member_id): [(datetime.fromisoformat(start).timestamp(), datetime.fromisoformat(end).timestamp())
+                             for start, end in spans]
+            for member_id, spans in unavailable.items()}
+
+
+def windows_to_conf(windows: Dict[int, List[Window]]) -> dict:
+    return {str(member_id): [[_iso(start), _iso(end)] for start, end in spans]
+            for member_id, spans in windows.items() if spans}
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat(timespec="seconds")
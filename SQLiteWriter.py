@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a write waits for another process's transaction, like sqlite3's own default. It is waited out off the loop
+DEFAULT_BUSY_TIMEOUT = 5.0
+
+
+def connect(path: Path, timeout: float = DEFAULT_BUSY_TIMEOUT) -> sqlite3.Connection:
+    """
+    Opens one of the bot's SQLite files the way all of them are used.
+    WAL mode, so reading never waits on a writer, which needs every process on the same machine (containers sharing
+    a volume are fine), not a network filesystem. synchronous=NORMAL, so a commit doesnt fsync, only a checkpoint does.
+    A power cut can lose the last few commits then, but never corrupts the file.
+    """
+    db = sqlite3.connect(path, timeout=timeout)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class SQLiteWriter:
+    """
+    Runs a store's writes on one background thread, in the order they were submitted, so the event loop never waits
+    on SQLite. A commit isnt always quick: every so often it runs a WAL checkpoint, which fsyncs, and when replicas
+    share the file it can wait up to busy_timeout behind another process's write.
+
+    The thread has its own connection. The store keeps reading through its own one on the loop, which WAL never makes
+    wait on a writer, and sees a write once it is committed, normally well within a millisecond of submit().
+    A failed write is logged here, and `failed` counts them. The returned future has the exception too.
+    """
+
+    def __init__(self, path: Path, name: str, timeout: float = DEFAULT_BUSY_TIMEOUT):
+        """path is opened with connect() on the thread, name is the thread's"""
+        self.path = path
+        self.name = name
+        self.timeout = timeout
+        self.failed: int = 0
+        self._closed: bool = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._db: Optional[sqlite3.Connection] = None  # Only ever used on the thread
+
+    def submit(self, write: Callable[..., object], *args) -> Future:
+        """Queues write(connection, *args), run in one transaction. The future has what it returned."""
+        future = self._executor.submit(self._run, write, *args)
+        future.add_done_callback(self._report)
+        return future
+
+    async def wait(self):
+        """Returns once everything submitted so far is written (or failed)"""
+        # The thread runs them in order, so a no-op queued now finishes after all of them
+        await asyncio.wrap_future(self._executor.submit(lambda: None))
+
+    def close(self):
+        """
+        Finishes the queued writes and closes the connection. Blocks until then, it is meant for shutdown.
+        Closing again does nothing, like sqlite3's close, since rotations sharing a store each close it.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _run(self, write: Callable[..., object], *args):
+        if self._db is None:
+            self._db = connect(self.path, self.timeout)
+        with self._db:
+            return write(self._db, *args)
+
+    def _report(self, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.failed += 1
+            logger.error("Background write to %s failed: %s", self.path, future.exception())
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, Tuple
+
+from SQLiteWriter import connect
+
+SCHEDULE_DB_NAME = "schedule.db"
+
+
+class ScheduleState:
+    def __init__(self, job_id: str, schedule: Tuple[int, int, int], next_fire: Optional[datetime],
+                 last_fire: Optional[datetime]):
+        self.job_id = job_id
+        self.schedule = schedule  # (day, hour, minute)
+        self.next_fire = next_fire
+        self.last_fire = last_fire
+
+
+class ScheduleStore:
+    """
+    Remembers each rotation's schedule and next fire time in a small SQLite file (schedule.db).
+
+    APScheduler only keeps its jobs in memory, so a rotation that was due while the bot was down would be skipped
+    without anyone noticing. With the next fire time on disk, the next start can tell it was missed and catch up.
+    Times are stored as UTC timestamps. One store can be shared by every rotation, rows are keyed by job id.
+
+    Unlike history.db and outbox.db the writes stay on the event loop: catch_up has to read back what scheduled() and
+    fired() last wrote (a take_over can come right after a fire), and each is one row per fire or schedule change.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = connect(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS schedules (
+                job_id TEXT PRIMARY KEY,
+                day INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                minute INTEGER NOT NULL,
+                next_fire REAL,
+                last_fire REAL
+            )""")
+        self._db.commit()
+
+    def get(self, job_id: str) -> Optional[ScheduleState]:
+        row = self._db.execute("SELECT day, hour, minute, next_fire, last_fire FROM schedules WHERE job_id = ?",
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        return ScheduleState(job_id, (row[0], row[1], row[2]), _from_timestamp(row[3]), _from_timestamp(row[4]))
+
+    def scheduled(self, job_id: str, schedule: Tuple[int, int, int], next_fire: Optional[datetime]):
+        """Records a new or changed schedule and when it fires next"""
+        with self._db:
+            self._db.execute("""
+                INSERT INTO schedules (job_id, day, hour, minute, next_fire) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (job_id) DO UPDATE SET
+                    day = excluded.day, hour = excluded.hour, minute = excluded.minute, next_fire = excluded.next_fire
+                """, (job_id, *schedule, _to_timestamp(next_fire)))
+
+    def fired(self, job_id: str, fire_time: datetime, next_fire: Optional[datetime]):
+        """Records that the rotation due at fire_time has been handled"""
+        with self._db:
+            self._db.execute("UPDATE schedules SET last_fire = ?, next_fire = ? WHERE job_id = ?",
+                             (_to_timestamp(fire_time), _to_timestamp(next_fire), job_id))
+
+    def close(self):
+        self._db.close()
+
+
+def _to_timestamp(time: Optional[datetime]) -> Optional[float]:
+    return time.timestamp() if time is not None else None
+
+
+def _from_timestamp(timestamp: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, FrozenSet, Iterable, List, Optional, Tuple
+
+from ConfigStore import ConfigStore, JOURNAL_SEQ_KEY
+from SQLiteWriter import SQLiteWriter, connect
+
+logger = logging.getLogger(__name__)
+
+SHARED_STATE_NAME = "state.db"
+# Seconds a write waits for another replica's transaction. They are all a few rows, so this is only hit when stuck
+BUSY_TIMEOUT = 2.0
+# Once a rotation has this many journal rows, the next change also writes a snapshot and deletes them
+DEFAULT_COMPACT_RECORDS = 500
+
+
+class StaleConfig(Exception):
+    """Another replica changed the rotation since it was read here, so the change wasnt written. Reload and retry."""
+
+
+class SharedState:
+    """
+    The rotation configs and the leader lease, in one SQLite file (state.db) that several bot processes use at once.
+
+    Each rotation is a row with a JSON snapshot and a version (seq), plus the journal records written since the snapshot,
+    like conf.json and conf.journal. A write only goes through if seq is still the one the writer last read
+    (an UPDATE ... WHERE seq = ?), and bumps it in the same transaction as the records. If another replica got there
+    first nothing is written and StaleConfig is raised. No lock is held between transactions, a slow replica only
+    ever makes its own writes fail.
+
+    commit() runs on the event loop, since the change that called it cant go ahead until it knows whether it went
+    through. BUSY_TIMEOUT caps how long that waits on another replica. Renewing the lease and compacting run on a
+    SQLiteWriter, so a replica stuck behind another one's write still renews and answers Discord.
+    """
+
+    def __init__(self, path: Path, timeout: float = BUSY_TIMEOUT):
+        self.path = path
+        self._db = connect(path, timeout)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS rotations (
+                    name TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    snapshot_seq INTEGER NOT NULL,
+                    config TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    updated_by TEXT
+                )""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS journal (
+                    rotation TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (rotation, seq)
+                )""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    term INTEGER NOT NULL
+                )""")
+        self.writer = SQLiteWriter(path, "SharedState", timeout)
+
+    def version(self, name: str) -> Optional[int]:
+        """seq of the newest change to the rotation, None if it isnt in the shared state yet. One indexed read."""
+        row = self._db.execute("SELECT seq FROM rotations WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def read(self, name: str) -> Optional[Tuple[dict, List[dict], int]]:
+        """(snapshot, journal records after it, seq), read in one transaction so a compaction cant tear them apart"""
+        self._db.execute("BEGIN")
+        try:
+            row = self._db.execute("SELECT config, snapshot_seq, seq FROM rotations WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            records = self._db.execute("SELECT record FROM journal WHERE rotation = ? AND seq > ? ORDER BY seq",
+                                       (name, row[1])).fetchall()
+        finally:
+            self._db.commit()
+        return json.loads(row[0]), [json.loads(record) for record, in records], row[2]
+
+    def create(self, name: str, config: dict, holder: Optional[str] = None) -> bool:
+        """Adds a rotation from its config file. Returns False if another replica already added it."""
+        seq = config.get(JOURNAL_SEQ_KEY, 0)
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO rotations (name, seq, snapshot_seq, config, updated, updated_by) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (name, seq, seq, json.dumps(config), time.time(), holder))
+        return bool(cursor.rowcount)
+
+    def commit(self, name: str, expected: int, records: List[dict], snapshot: Optional[dict] = None,
+               holder: Optional[str] = None) -> int:
+        """
+        Writes `records` (and `snapshot`, which then replaces the journal) if the rotation is still at seq `expected`.
+        Returns the new seq. Raises StaleConfig, and writes nothing, if another replica changed it first.
+        """
+        seq = records[-1]["seq"] if records else expected + 1
+        with self._db:
+            cursor = self._db.execute("UPDATE rotations SET seq = ?, updated = ?, updated_by = ? WHERE name = ? AND seq = ?",
+                                      (seq, time.time(), holder, name, expected))
+            if not cursor.rowcount:
+                raise StaleConfig(f"{name} was changed by another replica, nothing was saved")
+            self._db.executemany("INSERT INTO journal (rotation, seq, record) VALUES (?, ?, ?)",
+                                 ((name, record["seq"], json.dumps(record)) for record in records))
+            if snapshot is not None:
+                _write_snapshot(self._db, name, seq, snapshot)
+        return seq
+
+    async def compact(self, name: str, seq: int, snapshot: dict) -> bool:
+        """
+        Replaces the journal with `snapshot`, without changing seq, so the other replicas have nothing to reload.
+        Skipped (returns False) if the rotation has moved past `seq`, the snapshot wouldnt have the newer changes.
+        Runs on the writer thread.
+        """
+        return await asyncio.wrap_future(self.writer.submit(_write_snapshot, name, seq, snapshot))
+
+    def claim_lease(self, name: str, holder: str, ttl: float) -> Tuple[str, float, int]:
+        """
+        Takes the lease if it is free or expired, or renews it if `holder` already has it, in one statement.
+        A new holder bumps term. Returns (holder, expires, term) of whoever has it afterwards.
+        """
+        with self._db:
+            return _claim_lease(self._db, name, holder, ttl)
+
+    async def renew_lease(self, name: str, holder: str, ttl: float) -> Tuple[str, float, int]:
+        """claim_lease on the writer thread, for renewing it every few seconds"""
+        return await asyncio.wrap_future(self.writer.submit(_claim_lease, name, holder, ttl))
+
+    def release_lease(self, name: str, holder: str):
+        """
+        Lets the lease expire now, so another replica can take it over without waiting out the ttl.
+        Queued behind any renewal still on the writer thread, so that cant take the lease back afterwards.
+        Waits for the write.
+        """
+        self.writer.submit(_release_lease, name, holder).result()
+
+    def lease(self, name: str) -> Optional[Tuple[str, float, int]]:
+        return _lease(self._db, name)
+
+    def close(self):
+        self.writer.close()
+        self._db.close()
+
+
+def _write_snapshot(db: sqlite3.Connection, name: str, seq: int, snapshot: dict) -> bool:
+    # The seq check is part of the UPDATE, so a commit from another replica cant slip in between
+    cursor = db.execute("UPDATE rotations SET config = ?, snapshot_seq = ? WHERE name = ? AND seq = ?",
+                        (json.dumps({**snapshot, JOURNAL_SEQ_KEY: seq}), seq, name, seq))
+    if cursor.rowcount:
+        db.execute("DELETE FROM journal WHERE rotation = ? AND seq <= ?", (name, seq))
+    return bool(cursor.rowcount)
+
+
+def _claim_lease(db: sqlite3.Connection, name: str, holder: str, ttl: float) -> Tuple[str, float, int]:
+    now = time.time()
+    db.execute("""
+        INSERT INTO leases (name, holder, expires, term) VALUES (?, ?, ?, 1)
+        ON CONFLICT (name) DO UPDATE SET
+            term = CASE WHEN holder = excluded.holder THEN term ELSE term + 1 END,
+            holder = excluded.holder, expires = excluded.expires
+        WHERE leases.holder = excluded.holder OR leases.expires <= ?
+        """, (name, holder, now + ttl, now))
+    return _lease(db, name)
+
+
+def _release_lease(db: sqlite3.Connection, name: str, holder: str):
+    db.execute("UPDATE leases SET expires = 0 WHERE name = ? AND holder = ?", (name, holder))
+
+
+def _lease(db: sqlite3.Connection, name: str) -> Optional[Tuple[str, float, int]]:
+    return db.execute("SELECT holder, expires, term FROM leases WHERE name = ?", (name,)).fetchone()
+
+
+class SharedConfigStore(ConfigStore):
+    """
+    A ConfigStore kept in a SharedState instead of files, for running several replicas of the bot.
+
+    append() and save() write right away instead of a moment later: the write is where a conflict with another replica
+    shows up, and the change that caused it has to fail with it (StaleConfig), not a background task. Each is one small
+    transaction. flush() has nothing left to do, except that compact=True writes a snapshot.
+    changed_on_disk() is true once another replica has moved the rotation to a newer seq, so the ConfigWatcher reloads it.
+    The first replica to read a rotation that isnt in the shared state yet copies `path` (conf.json and its journal) in.
+    After that the file is no longer read.
+    """
+
+    def __init__(self, state: SharedState, name: str, path: Path, snapshot: Callable[[], dict],
+                 apply: Callable[[dict, dict, FrozenSet[str]], Iterable[str]], holder: Optional[str] = None,
+                 compact_records: int = DEFAULT_COMPACT_RECORDS, ready: Callable[[], bool] = lambda: True):
+        """holder names this replica in the rotations table, for whoever is looking at state.db"""
+        super().__init__(path, snapshot, apply, ready=ready)
+        self.state = state
+        self.name = name
+        self.holder = holder
+        self.compact_records = compact_records
+        self._journal_records: int = 0
+        self._loaded: bool = False
+
+    def exists(self) -> bool:
+        return self.state.version(self.name) is not None or super().exists()
+
+    def read(self) -> dict:
+        stored = self.state.read(self.name)
+        if stored is None:
+            config = super().read()
+            if self.state.create(self.name, {**config, JOURNAL_SEQ_KEY: self._seq}, self.holder):
+                logger.info("Copied %s into %s as rotation '%s'", self.path, self.state.path, self.name)
+            stored = self.state.read(self.name)  # Whichever replica added it first, everyone starts from the same
+        config, records, self._seq = stored
+        for record in records:
+            self.apply(config, record)
+        self._journal_records = len(records)
+        self._loaded = True
+        return config
+
+    def append(self, op: str, **fields):
+        """Writes one state change now. Raises StaleConfig if another replica changed the rotation first."""
+        record = {"seq": self._seq + 1, "op": op, **fields}
+        snapshot = self.snapshot() if self._journal_records + 1 >= self.compact_records and self.ready() else None
+        self._commit([record], snapshot)
+
+    def save(self):
+        """Writes a full snapshot now, as a change of its own. Raises StaleConfig like append()."""
+        if not self.ready():
+            logger.warning("Not writing a snapshot of rotation '%s', the config isnt loaded", self.name)
+            return
+        self._commit([], self.snapshot())
+
+    async def flush(self, compact=False):
+        if not (compact and self._journal_records and self.ready()):
+            return
+        compacted = self._journal_records
+        if await self.state.compact(self.name, self._seq, self.snapshot()):
+            # Not just 0, a change committed while the writer thread was at it is still in the journal
+            self._journal_records -= compacted
+
+    def changed_on_disk(self) -> bool:
+        return self._loaded and self.state.version(self.name) != self._seq
+
+    def _commit(self, records: List[dict], snapshot: Optional[dict]):
+        try:
+            self._seq = self.state.commit(self.name, self._seq, records, snapshot, self.holder)
+        except (StaleConfig, sqlite3.Error) as e:
+            self.last_error = e
+            raise e
+        self._journal_records = 0 if snapshot is not None else self._journal_records + len(records)
+        self.writes += 1
+        self.last_error = None
@@ -0,0 +1,31 @@
+import time
+from typing import Awaitable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class StartupTimer:
+    """
+    Times the steps of setup_hook for the startup breakdown. Steps can run at the same time,
+    so they can add up to more than the total.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps: Dict[str, float] = {}  # name -> ms
+        self.total_ms: float = 0.0
+
+    async def step(self, name: str, awaitable: Awaitable[T]) -> T:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.steps[name] = (time.perf_counter() - start) * 1000
+            self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def breakdown(self) -> dict:
+        return {"total_ms": self.total_ms, **{f"{name}_ms": ms for name, ms in self.steps.items()}}
+
+    def __str__(self):
+        steps = ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.steps.items())
+        return f"Started in {self.total_ms:.0f} ms ({steps})"
@@ -0,0 +1,1066 @@
+"""
+Benchmarks RoleRotation against the fake backend in FakeDiscord.py. No token needed.
+
+    python bench.py
+    python bench.py --sizes 10 100 --latency 0.02 --out bench.json
+    python bench.py --scenarios rotate_role fetch_members
+
+Prints one JSON object per result line, and writes them all to --out as a JSON list, so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import aiohttp
+import discord
+from apscheduler.triggers.interval import IntervalTrigger
+from discord import app_commands
+from discord.state import ConnectionState
+
+from CommandSync import CommandSync
+from ConfigStore import write_atomic
+from ConfigWatcher import ConfigWatcher
+from FakeDiscord import FakeAPI, FakeClient, FakeCommandTree, FakeResponse, build_guild, member_ids
+from HistoryStore import HistoryStore
+from LoggingSetup import LogPipeline, StructuredFormatter
+from MemberImport import parse_member_rows
+from MemberResolver import DEFAULT_FETCH_CONCURRENCY
+from NotificationOutbox import NotificationOutbox, OUTBOX_DB_NAME
+from Metrics import ENABLED as METRICS_ENABLED, METRICS, MetricsServer, timed as metered
+from RoleRotation import RoleRotation, ConfKeys, apply_journal_record
+from RotationManager import RotationManager
+from RotationOrder import MemberRecord, RotationOrder
+from RotationPreview import RotationPreview
+from RotationStrategy import STRATEGIES
+from SharedState import SharedState, SHARED_STATE_NAME
+from StartupTimer import StartupTimer
+
+DEFAULT_SIZES = [10, 100, 1000]
+ROTATION_COUNTS = [1, 10, 100]
+GUILD_MEMBERS = 50_000
+ROLE_ID = 500
+LOOKUPS_AFTER_MOVE = 20  # rotation_order
+
+_rotations = []  # Everything make_rotation built for the current scenario, so its background tasks can be stopped
+
+
+def write_conf(path: Path, ids, index=0):
+    write_atomic(path, {
+        ConfKeys.SCHEDULE_DAY.value: 0,
+        ConfKeys.SCHEDULE_HOUR.value: 12,
+        ConfKeys.SCHEDULE_MINUTE.value: 0,
+        ConfKeys.INDEX.value: index,
+        ConfKeys.ROLE_ID.value: ROLE_ID,
+        ConfKeys.MEMBER_IDS.value: ids,
+    })
+
+
+async def make_rotation(tmp: Path, size: int, api: FakeAPI, gateway_cache=True, chunking=True,
+                        extra_members=0, load=True, fetch_concurrency=DEFAULT_FETCH_CONCURRENCY) -> RoleRotation:
+    """A RoleRotation over `size` fake members. `extra_members` more exist in the guild but arent in the rotation."""
+    client = FakeClient(api)
+    build_guild(client, size + extra_members, role_id=ROLE_ID, gateway_cache=gateway_cache, chunking=chunking)
+    path = tmp / f"conf_{size}_{time.perf_counter_ns()}.json"
+    write_conf(path, member_ids(size))
+    rotation = RoleRotation(client, 1, config_path=path, fetch_concurrency=fetch_concurrency)
+    rotation.store.delay = 0
+    _rotations.append(rotation)
+    if load:
+        error = await rotation.load_config()
+        if error is not None:
+            raise error
+    return rotation
+
+
+async def timed(api: FakeAPI, fn, repeat=1) -> dict:
+    api.reset()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    elapsed = time.perf_counter() - start
+    return {"wall_ms": elapsed * 1000 / repeat, "repeat": repeat, "api": api.stats()}
+
+
+# --- Scenarios. Each returns a dict of measurements ---
+async def bench_load_config_sequential(tmp, size, make_api):
+    """
+    How members were loaded before MemberResolver: no cache, no gateway, and one fetch_member at a time.
+    The baseline for the three below.
+    """
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False, load=False, fetch_concurrency=1)
+    return await timed(api, rotation.load_config)
+
+
+async def bench_load_config_rest(tmp, size, make_api):
+    """Nothing cached and no gateway, so every member is a REST call"""
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False, load=False)
+    return await timed(api, rotation.load_config)
+
+
+async def bench_load_config_chunked(tmp, size, make_api):
+    """No gateway cache yet, but query_members works"""
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=True, load=False)
+    return await timed(api, rotation.load_config)
+
+
+async def bench_load_config_cached(tmp, size, make_api):
+    """A /reload once the gateway cache is populated"""
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api)
+    return await timed(api, rotation.load_config)
+
+
+async def bench_reload_config(tmp, size, make_api):
+    """
+    Hand edits picked up by the ConfigWatcher, against a full load_config with nothing cached.
+    Only the parts of the config that changed should be redone.
+    """
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False, extra_members=1)
+    rotation.cache.ttl = 0
+    full = await timed(api, rotation.load_config)
+    rotation.cache.ttl = 60
+    watcher = ConfigWatcher(lambda: [rotation])
+
+    async def edit(**changes):
+        conf = json.loads(rotation.store.path.read_text())
+        conf.update(changes)
+        write_atomic(rotation.store.path, conf)
+        measured = await timed(api, watcher.check)
+        measured["parts"] = watcher.reports[rotation.name].parts
+        return measured
+
+    schedule = await edit(**{ConfKeys.SCHEDULE_MINUTE.value: 30})
+    new_member = await edit(**{ConfKeys.MEMBER_IDS.value: member_ids(size + 1)})
+    unchanged = await timed(api, watcher.check)  # Our own files, nothing to do
+    return {"full": full, "schedule_only": schedule, "one_new_member": new_member, "idle_check": unchanged}
+
+
+async def bench_fetch_members(tmp, size, make_api):
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False)
+    rotation.cache.ttl = 0  # Measure the REST path, not the MemberCache
+    return await timed(api, rotation.fetch_members)
+
+
+async def bench_rotate_role(tmp, size, make_api):
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api)
+    return await timed(api, rotation.rotate_role, repeat=5)
+
+
+async def bench_rotate_role_repair(tmp, size, make_api):
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False)
+    rotation.cache.ttl = 0
+    return await timed(api, lambda: rotation.rotate_role(repair=True))
+
+
+async def bench_reconcile(tmp, size, make_api):
+    """
+    The role drifts (the member on duty loses it, three others get it by hand), then one reconcile pass fixes it.
+    Compare its API calls with rotate_role_repair, which re-fetches everyone. test_Reconciler.py checks the result.
+    """
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api)
+    idle = await timed(api, rotation.reconcile)
+
+    guild = rotation.client.guilds[1]
+    role = guild.roles[ROLE_ID]
+    on_duty = guild.members[rotation.members[rotation.index].id]
+    on_duty.roles.remove(role)
+    drifted = random.Random(0).sample([member_id for member_id in rotation.members.ids() if member_id != on_duty.id],
+                                      min(3, size - 1))
+    for member_id in drifted:
+        guild.members[member_id].roles.append(role)
+    rotation.cache.forget_member(1, on_duty.id)  # As the member update event would have
+    repair = await timed(api, rotation.reconcile)
+    return {"idle": idle, "drifted": len(drifted) + 1, "repair": repair}
+
+
+async def bench_add_remove_user(tmp, size, make_api):
+    """Adds a member in the middle of the rotation, then removes them again"""
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api, extra_members=1)
+    new_id = member_ids(size + 1)[-1]
+
+    async def add_remove():
+        await rotation.add_user(new_id, size // 2)
+        rotation.remove_user(new_id)
+
+    result = await timed(api, add_remove, repeat=20)
+    await rotation.store.flush()
+    return result
+
+
+async def bench_move_member(tmp, size, make_api):
+    """Moves the last member to the front and back again"""
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api)
+
+    async def move():
+        member = rotation.members[size - 1]
+        rotation.move_member(member, 0)
+        rotation.move_member(member, size - 1)
+
+    result = await timed(api, move, repeat=20)
+    await rotation.store.flush()
+    return result
+
+
+async def bench_many_rotations(tmp, size, make_api, counts=ROTATION_COUNTS):
+    """
+    1, 10 and 100 rotations of `size` members each, loaded two ways:
+    shared, in one RotationManager on one client (one gateway connection, scheduler, cache and queue),
+    and separate, one client and RoleRotation each, like running a bot process per rotation.
+    Memory is what tracemalloc sees in this process, so separate processes would also pay an interpreter each on top.
+    """
+    results = {}
+    for count in counts:
+        api = make_api()
+        tracemalloc.start()
+        start = time.perf_counter()
+        client = FakeClient(api)
+        build_guild(client, size, role_id=ROLE_ID)
+        registry = {}
+        for n in range(count):
+            write_conf(tmp / f"conf.shared{n}.json", member_ids(size))
+            registry[f"rotation{n}"] = {"guild_id": 1, "config": str(tmp / f"conf.shared{n}.json")}
+        write_atomic(tmp / "rotations.json", registry)
+        manager = RotationManager(client, 1, path=tmp / "rotations.json")
+        _rotations.extend(manager.rotations.values())
+        errors = await manager.load_all()
+        shared = {"wall_ms": (time.perf_counter() - start) * 1000, "memory_kb": tracemalloc.get_traced_memory()[1] / 1024,
+                  "connections": 1, "schedulers": 1, "errors": len(errors), "api": api.stats()}
+        tracemalloc.stop()
+        await stop_rotations()
+
+        api = make_api()
+        tracemalloc.start()
+        start = time.perf_counter()
+        rotations = []
+        for n in range(count):
+            client = FakeClient(api)
+            build_guild(client, size, role_id=ROLE_ID)
+            write_conf(tmp / f"conf.separate{n}.json", member_ids(size))
+            rotations.append(RoleRotation(client, 1, config_path=tmp / f"conf.separate{n}.json", name=f"rotation{n}"))
+        _rotations.extend(rotations)
+        loaded = await asyncio.gather(*(rotation.load_config() for rotation in rotations))
+        separate = {"wall_ms": (time.perf_counter() - start) * 1000, "memory_kb": tracemalloc.get_traced_memory()[1] / 1024,
+                    "connections": count, "schedulers": count,
+                    "errors": sum(1 for error in loaded if error is not None), "api": api.stats()}
+        tracemalloc.stop()
+        await stop_rotations()
+        results[count] = {"shared": shared, "separate": separate}
+    return {"rotations": results}
+
+
+def discord_guild() -> discord.Guild:
+    """A real discord.py Guild with no connection behind it, to measure what its member cache costs"""
+    state = ConnectionState(dispatch=lambda *args: None, handlers={}, hooks={}, http=None,
+                            intents=discord.Intents.default())
+    return discord.Guild(data={"id": "1", "name": "bench", "roles": [], "emojis": [], "stickers": []}, state=state)
+
+
+def discord_member(guild: discord.Guild, member_id: int) -> discord.Member:
+    user = {"id": str(member_id), "username": f"member{member_id}", "discriminator": "0", "avatar": None,
+            "global_name": None}
+    return discord.Member(data={"user": user, "roles": [], "joined_at": None, "deaf": False, "mute": False, "flags": 0},
+                          guild=guild, state=guild._state)
+
+
+def traced_kb(build) -> (float, object):
+    """Memory held by whatever build() returns"""
+    tracemalloc.start()
+    built = build()
+    held = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+    return held, built
+
+
+async def bench_rotation_order(tmp, size, make_api, entries=10_000, ops=2000, seed=0):
+    """
+    RotationOrder against the plain list of ids it replaced, at `entries` members whatever `size` is. Microseconds per
+    membership check, position lookup, remove (put straight back), move, and a move followed by LOOKUPS_AFTER_MOVE
+    lookups of members it shifted. No API calls.
+    equivalent is whether both ended up in the same order, test_RotationOrder.py checks that more thoroughly.
+    """
+    rng = random.Random(seed)
+    ids = member_ids(entries)
+    order = RotationOrder(MemberRecord(member_id, str(member_id)) for member_id in ids)
+    listed = list(ids)
+    probes = [rng.choice(ids) if rng.random() < 0.5 else rng.randrange(1, 2 ** 63) for _ in range(ops)]
+    picks = [rng.choice(ids) for _ in range(ops)]
+    positions = [rng.randrange(entries) for _ in range(ops)]
+
+    def per_op(fn) -> float:
+        start = time.perf_counter()
+        fn()
+        return (time.perf_counter() - start) * 1_000_000 / ops
+
+    def order_remove():
+        for member_id in picks:
+            position, member = order.remove(member_id)
+            order.insert(position, member)
+
+    def list_remove():
+        for member_id in picks:
+            position = listed.index(member_id)
+            del listed[position]
+            listed.insert(position, member_id)
+
+    def order_move():
+        for member_id, position in zip(picks, positions):
+            order.move(member_id, position)
+
+    def list_move():
+        for member_id, position in zip(picks, positions):
+            listed.remove(member_id)
+            listed.insert(position, member_id)
+
+    # Moving to the front shifts everyone before the member, so every lookup after it is of a shifted position
+    lookups = [rng.sample(ids, LOOKUPS_AFTER_MOVE) for _ in range(ops)]
+
+    def order_move_lookup():
+        for member_id, looked_up in zip(picks, lookups):
+            order.move(member_id, 0)
+            for other in looked_up:
+                order.position(other)
+
+    def list_move_lookup():
+        for member_id, looked_up in zip(picks, lookups):
+            listed.remove(member_id)
+            listed.insert(0, member_id)
+            for other in looked_up:
+                listed.index(other)
+
+    results = {"entries": entries, "ops": ops}
+    for label, order_fn, list_fn in (
+            ("contains_us", lambda: [member_id in order for member_id in probes],
+             lambda: [member_id in listed for member_id in probes]),
+            ("position_us", lambda: [order.position(member_id) for member_id in picks],
+             lambda: [listed.index(member_id) for member_id in picks]),
+            ("remove_us", order_remove, list_remove),
+            ("move_us", order_move, list_move),
+            ("move_lookup_us", order_move_lookup, list_move_lookup)):
+        results[label] = {"order": per_op(order_fn), "list": per_op(list_fn)}
+    results["equivalent"] = order.ids() == listed
+    return results
+
+
+async def bench_member_memory(tmp, size, make_api, guild_members=GUILD_MEMBERS):
+    """
+    What the bot keeps in memory for a rotation of `size` members in a guild of 50k. Uses real discord.Member objects,
+    FakeMember is much smaller than the real thing.
+    default: chunking at startup caches every member of the guild, and the rotation holds full Members
+    trimmed: only the rotation's own members are cached (TRIM_MEMBER_CACHE), and the rotation holds MemberRecords
+    Then runs a real load and rotation against a trimmed fake guild of the same size.
+    """
+    ids = member_ids(size)
+
+    def default():
+        guild = discord_guild()
+        for member_id in member_ids(guild_members):
+            guild._add_member(discord_member(guild, member_id))
+        return guild, [guild.get_member(member_id) for member_id in ids]
+
+    def trimmed():
+        guild = discord_guild()
+        for member_id in ids:
+            guild._add_member(discord_member(guild, member_id))
+        return guild, [MemberRecord.from_member(guild.get_member(member_id), None) for member_id in ids]
+
+    default_kb, built = traced_kb(default)
+    del built
+    trimmed_kb, built = traced_kb(trimmed)
+    del built
+    guild = discord_guild()
+    members_kb, members = traced_kb(lambda: [discord_member(guild, member_id) for member_id in ids])
+    records_kb, records = traced_kb(lambda: [MemberRecord(member.id, member.display_name) for member in members])
+    del members, records
+
+    api = make_api()
+    client = FakeClient(api)
+    fake_guild = build_guild(client, guild_members, role_id=ROLE_ID, trimmed=True)
+    path = tmp / f"conf_trimmed_{size}.json"
+    write_conf(path, ids)
+    rotation = RoleRotation(client, 1, config_path=path)
+    _rotations.append(rotation)
+    load = await timed(api, rotation.load_config)
+    rotate = await timed(api, rotation.rotate_role)
+    return {"guild_members": guild_members, "default_kb": default_kb, "trimmed_kb": trimmed_kb,
+            "saved_kb": default_kb - trimmed_kb, "rotation_as_members_kb": members_kb,
+            "rotation_as_records_kb": records_kb, "trimmed_gateway_cache": len(fake_guild.cached),
+            "trimmed_load": load, "trimmed_rotate": rotate}
+
+
+async def bench_strategies(tmp, size, make_api, picks=1000):
+    """
+    rotate_role with each strategy while a third of the rotation is away,
+    and the cost of a single choice, which should barely grow with `size`. test_RotationStrategy.py checks the picks.
+    """
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api)
+    now = time.time()
+    for member_id in rotation.members.ids()[1::3]:
+        rotation.set_unavailable(member_id, [(now - 60, now + 24 * 60 * 60)])
+    results = {}
+    for name in STRATEGIES:
+        rotation.set_strategy(name)
+        measured = await timed(api, rotation.rotate_role, repeat=5)
+        strategy = rotation.build_strategy()
+        index = rotation.index
+        start = time.perf_counter()
+        for pick in range(picks):
+            index = strategy.choose(rotation.members, index, now + pick)
+            strategy.on_duty(rotation.members[index].id, now + pick)
+        measured["choose_us"] = (time.perf_counter() - start) * 1_000_000 / picks
+        results[name] = measured
+    await rotation.store.flush()
+    return results
+
+
+async def bench_preview(tmp, size, make_api, years=(1, 10)):
+    """A preview of a year (and ten) of weekly rotations with each strategy. Makes no API calls."""
+    api = make_api()
+    rotation = await make_rotation(tmp, size, api)
+    results = {}
+    for name in STRATEGIES:
+        for span in years:
+            start = time.perf_counter()
+            assignments = RotationPreview(rotation, strategy=name).run(
+                until=datetime.now(timezone.utc) + timedelta(days=365 * span))
+            results[f"{name}_{span}y"] = {"wall_ms": (time.perf_counter() - start) * 1000,
+                                          "rotations": len(assignments), "api_calls": api.total}
+    return results
+
+
+class SlowSink(io.StringIO):
+    """A console that takes `delay` seconds per flush, like a terminal or a pipe whose reader is behind"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def flush(self):
+        time.sleep(self.delay)
+
+
+async def bench_logging(tmp, size, make_api, per_member=100, slow_records=1000, slow_delay=0.0005):
+    """
+    What one log call costs the event loop: written out right there by a StreamHandler, against queued for the
+    LogPipeline's thread, and for a sampled logger that mostly gets dropped. drain_ms is how long the thread needs after.
+    Once to a file, and once to a console that takes slow_delay seconds per line.
+    """
+    def timed(logger: logging.Logger, level: int, count: int) -> float:
+        start = time.perf_counter()
+        for i in range(count):
+            logger.log(level, "Rotating role to member: %s", i, extra={"rotation": "default"})
+        return (time.perf_counter() - start) / count * 1e6
+
+    def measure(sink, count: int) -> dict:
+        direct = logging.getLogger("bench.direct")
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(StructuredFormatter())
+        direct.addHandler(handler)
+        direct.setLevel(logging.DEBUG)
+        direct.propagate = False
+        result = {"records": count, "direct_us": timed(direct, logging.INFO, count)}
+        direct.removeHandler(handler)
+
+        # Not pipeline.start(), that would take over the root logger of the whole bench
+        pipeline = LogPipeline(sampling={"bench.queued.http": 10}, stream=sink)
+        queued = logging.getLogger("bench.queued")
+        queued.addHandler(pipeline.queue_handler)
+        queued.setLevel(logging.DEBUG)
+        queued.propagate = False
+        pipeline.listener.start()
+        result["queued_us"] = timed(queued, logging.INFO, count)
+        result["sampled_us"] = timed(logging.getLogger("bench.queued.http"), logging.DEBUG, count)
+        start = time.perf_counter()
+        pipeline.listener.stop()
+        result["drain_ms"] = (time.perf_counter() - start) * 1000
+        queued.removeHandler(pipeline.queue_handler)
+        return {**result, **pipeline.stats()}
+
+    with open(tmp / f"bench_{size}.log", "w") as sink:
+        results = {"file": measure(sink, size * per_member)}
+    results["slow_console"] = measure(SlowSink(slow_delay), slow_records)
+    return results
+
+
+async def bench_metrics(tmp, size, make_api, calls=100_000, rotations=50):
+    """
+    What the instrumentation costs: the timing wrapper around a coroutine that does nothing, and rotate_role with it
+    against the bare method (which is all METRICS=0 runs). Then the API calls it counted against a load_config with
+    nothing cached, and a scrape of the Prometheus endpoint.
+    """
+    if not METRICS_ENABLED:
+        return {"enabled": False}
+
+    async def nothing():
+        pass
+
+    wrapped = metered("bench")(nothing)
+    results = {}
+    for label, fn in (("bare_us", nothing), ("wrapped_us", wrapped)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            await fn()
+        results[label] = (time.perf_counter() - start) / calls * 1e6
+    results["overhead_us"] = results["wrapped_us"] - results["bare_us"]
+
+    api = make_api()
+    before = METRICS.counter("api_calls_total", op="load_config")
+    rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False)
+    results["load_config_api_calls"] = METRICS.counter("api_calls_total", op="load_config") - before
+    results["load_config_fake_api_calls"] = api.total
+    rotation.operations.buckets = {}  # Time the rotations, not the rate limits
+    bare_rotate = RoleRotation.rotate_role.__wrapped__
+    results["rotate_role_bare"] = await timed(api, lambda: bare_rotate(rotation), repeat=rotations)
+    results["rotate_role_metered"] = await timed(api, rotation.rotate_role, repeat=rotations)
+
+    server = MetricsServer(port=0)
+    await server.start()
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        async with session.get(f"http://127.0.0.1:{server.port}/metrics") as response:
+            body = await response.text()
+        results["scrape_ms"] = (time.perf_counter() - start) * 1000
+    await server.stop()
+    results["scrape_bytes"] = len(body)
+    results["series"] = sum(1 for line in body.splitlines() if line and not line.startswith("#"))
+    return results
+
+
+def command_tree(api: FakeAPI, commands: int) -> FakeCommandTree:
+    """A tree shaped like main.py's: `commands` commands that each take a member, a number and a rotation name"""
+    tree = FakeCommandTree(api)
+
+    async def callback(interaction: discord.Interaction, member: discord.Member, i: int = -1, rotation: str = "default"):
+        pass
+
+    for n in range(commands):
+        tree.add_command(app_commands.Command(name=f"command{n}", description=f"Command number {n}", callback=callback))
+    return tree
+
+
+async def bench_startup(tmp, size, make_api, rotations=2, commands=25, sync_seconds=1.0):
+    """
+    setup_hook against the fake backend, before the gateway is up, so the guild, role and every member are REST calls.
+    `rotations` rotations of `size` members share one guild, and a sync takes sync_seconds.
+    sequential is how it used to start: load, then always sync. first_start loads and syncs at the same time,
+    and restart is the next start with the same commands, which skips the sync.
+    """
+    registry = {}
+    for n in range(rotations):
+        write_conf(tmp / f"conf.startup{size}_{n}.json", member_ids(size))
+        registry[f"rotation{n}"] = {"guild_id": 1, "config": str(tmp / f"conf.startup{size}_{n}.json")}
+    write_atomic(tmp / "rotations.json", registry)
+    results = {}
+    for label, concurrent in (("sequential", False), ("first_start", True), ("restart", True)):
+        api = make_api()
+        api.route_latency["sync_commands"] = sync_seconds
+        client = FakeClient(api)
+        build_guild(client, size, role_id=ROLE_ID, gateway_cache=False, chunking=False)
+        manager = RotationManager(client, 1, path=tmp / "rotations.json")
+        _rotations.extend(manager.rotations.values())
+        # first_start and restart share a fingerprint file, sequential has its own
+        sync = CommandSync(command_tree(api, commands), tmp / f"command_sync_{size}_{concurrent}.json")
+        timer = StartupTimer()
+        if concurrent:
+            await asyncio.gather(timer.step("load_rotations", manager.load_all()),
+                                 timer.step("command_sync", sync.sync_all(manager.guild_ids())))
+        else:
+            await timer.step("load_rotations", manager.load_all())
+            await timer.step("command_sync", sync.sync_all(manager.guild_ids()))
+        results[label] = {**timer.breakdown(), "commands": sync.results[1], "api": api.stats(),
+                          "loaded": sum(rotation.config_good for rotation in manager.rotations.values())}
+        await stop_rotations()
+    return results
+
+
+async def bench_import_members(tmp, size, make_api, cohort=200):
+    """
+    Onboards `cohort` new members into a rotation of `size`: one /add_member each against one /import_members.
+    Nothing is cached, so every new member is a REST call. The route buckets are cleared, both would otherwise just
+    wait on the fetch_member rate limit. test_MemberImport.py checks what the import writes.
+    """
+    new_ids = member_ids(size + cohort)[size:]
+    results = {}
+    for label in ("one_by_one", "import"):
+        api = make_api()
+        rotation = await make_rotation(tmp, size, api, gateway_cache=False, chunking=False, extra_members=cohort)
+        rotation.operations.buckets = {}
+        rotation.store.delay = 0.5  # What the bot uses, so writes batch like they would there
+        writes, events = rotation.store.writes, rotation.history.count("default")
+
+        async def one_by_one():
+            for member_id in new_ids:
+                await rotation.executor.submit("add_user", rotation.add_user, member_id)
+            await rotation.store.flush()
+
+        async def import_all():
+            # Mentions, plus a duplicate and a typo, like a pasted list would have
+            text = " ".join(f"<@{member_id}>" for member_id in new_ids) + f" {new_ids[0]} 12x34"
+            report = await rotation.executor.submit("import_members", rotation.import_members, parse_member_rows(text))
+            results["report"] = report.counts()
+
+        timing = await timed(api, one_by_one if label == "one_by_one" else import_all)
+        await rotation.history.wait()
+        results[label] = {**timing,
+                          "store_writes": rotation.store.writes - writes,
+                          "history_events": rotation.history.count("default") - events,
+                          "on_disk": len(rotation.read_config()[ConfKeys.MEMBER_IDS.value])}
+    return results
+
+
+async def bench_autocomplete(tmp, size, make_api, queries=2000, changes=200, seed=0):
+    """
+    Member autocomplete: a prefix search per keystroke against scanning every member, and keeping the index up to date
+    through adds, removes and renames against rebuilding it. All of it is in memory, no API calls.
+    """
+    rng = random.Random(seed)
+    syllables = ["ka", "ri", "mo", "ta", "len", "sa", "jo", "el", "an", "vi", "ro", "ne"]
+
+    def name():
+        return " ".join("".join(rng.choices(syllables, k=rng.randint(2, 3))).title() for _ in range(rng.randint(1, 2)))
+
+    ids = member_ids(size + changes)
+    order = RotationOrder(MemberRecord(member_id, name()) for member_id in ids[:size])
+    prefixes = [rng.choice(syllables)[:rng.randint(1, 2)] + rng.choice(["", "a", "r"]) for _ in range(queries)]
+
+    start = time.perf_counter()
+    order.search("a", 25)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    def per_query_us(search):
+        start = time.perf_counter()
+        for prefix in prefixes:
+            search(prefix)
+        return (time.perf_counter() - start) / queries * 1e6
+
+    def scan(prefix):
+        # What it would take without the index: every name and id of every member, every keystroke
+        prefix = prefix.casefold()
+        return [record for record in order if record.name.casefold().startswith(prefix)
+                or str(record.id).startswith(prefix)][:25]
+
+    indexed = per_query_us(lambda prefix: order.search(prefix, 25))
+    scanned = per_query_us(scan)
+
+    start = time.perf_counter()
+    for member_id in ids[size:]:
+        order.append(MemberRecord(member_id, name()))
+    for member_id in ids[:changes // 2]:
+        order.replace(MemberRecord(member_id, name()))
+    for member_id in ids[size:]:
+        order.remove(member_id)
+    incremental_us = (time.perf_counter() - start) / (changes * 2.5) * 1e6
+
+    start = time.perf_counter()
+    rebuilt = RotationOrder(order)
+    rebuilt.search("a", 25)
+    rebuild_ms = (time.perf_counter() - start) * 1000
+    consistent = all(order.search(prefix, 1000) == rebuilt.search(prefix, 1000) for prefix in set(prefixes))
+    return {"index_build_ms": build_ms, "search_us": indexed, "scan_us": scanned,
+            "change_us": incremental_us, "rebuild_ms": rebuild_ms, "consistent_after_changes": consistent}
+
+
+async def bench_notifications(tmp, size, make_api, rotations=10, send_seconds=0.2, fail_every=3):
+    """
+    rotate_role with DM and channel notifications on, against off, while every send takes send_seconds and every
+    fail_every-th one fails. The rotation should not get any slower, the outbox retries in the background.
+    Then the outbox is stopped with messages still queued and reopened, like a restart, and sends the rest.
+    test_NotificationOutbox.py checks that each message is sent once.
+    """
+    api = make_api()
+    api.route_latency["send_message"] = send_seconds
+    rotation = await make_rotation(tmp, size, api)
+    rotation.operations.buckets = {}
+    sends = {"calls": 0}
+
+    async def send(kind, target_id, content):
+        sends["calls"] += 1
+        await api.request("send_message")
+        if sends["calls"] % fail_every == 0:
+            raise discord.HTTPException(FakeResponse(500, "Internal Server Error"), "Injected failure")
+
+    path = tmp / f"{size}_{OUTBOX_DB_NAME}"
+    rotation.outbox = NotificationOutbox(path, send=send, rate=(50, 1.0), retry_delay=0.05)
+    off = await timed(api, rotation.rotate_role, repeat=rotations)
+    rotation.set_notifications(dm=True, channel_id=777, remind_hours=[24, 1])
+    rotation.outbox.start()
+    on = await timed(api, rotation.rotate_role, repeat=rotations)
+    # The same reminders planned again (a /reload, a restart) are deduplicated by their key
+    for _ in range(2):
+        for hours in rotation.notify["remind_hours"]:
+            await rotation.send_reminder(rotation.next_fire, hours)
+
+    await rotation.outbox.wait()
+    duplicates = rotation.outbox.duplicates
+    rotation.outbox.close()  # A "restart" with whatever wasnt sent yet still queued
+    queued_at_restart = NotificationOutbox(path).stats()["pending"]
+    rotation.outbox = NotificationOutbox(path, send=send, rate=(50, 1.0), retry_delay=0.05)
+    start = time.perf_counter()
+    rotation.outbox.start()
+    while rotation.outbox.pending():
+        await asyncio.sleep(0.01)
+    drain_ms = (time.perf_counter() - start) * 1000
+    stats = rotation.outbox.stats()
+    return {"rotate_off": off, "rotate_on": on, "queued_at_restart": queued_at_restart, "drain_after_restart_ms": drain_ms,
+            "outbox": stats, "duplicates": duplicates, "send_calls": sends["calls"]}
+
+
+async def bench_history(tmp, size, make_api, years=20, changes_per_day=10):
+    """
+    history.db after `years` of daily rotations plus `changes_per_day` member changes a day, among `size` members.
+    Times the queries behind /history and /stats. None of them should grow with the number of rows, except the full stats.
+    """
+    history = HistoryStore(tmp / f"history_{size}_{time.perf_counter_ns()}.db")
+    rng = random.Random(0)
+    ids = member_ids(size)
+    start = time.time() - years * 365 * 24 * 60 * 60
+    rows = []
+    for day in range(years * 365):
+        at = start + day * 24 * 60 * 60
+        rows.append(("default", at, "rotate", ids[day % size], f"member{ids[day % size]}", None, day % size, None))
+        for change in range(changes_per_day):
+            member_id = rng.choice(ids)
+            rows.append(("default", at + change + 1, rng.choice(("add", "remove", "move")), member_id,
+                         f"member{member_id}", None, day % size, rng.randrange(size)))
+    fill_start = time.perf_counter()
+    with history._db:
+        history._db.executemany("INSERT INTO history (rotation, time, op, member_id, name, previous_id, idx, position) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    fill_ms = (time.perf_counter() - fill_start) * 1000
+
+    def timed_query(fn, repeat=20) -> float:
+        began = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - began) * 1000 / repeat
+
+    middle = datetime.fromtimestamp(start + years * 365 * 24 * 60 * 60 / 2, timezone.utc)
+    first_page = history.page("default")
+    # Only the time on the event loop, the insert itself runs on the writer thread
+    record_ms = timed_query(lambda: history.record("default", "rotate", ids[0], "member", 0))
+    await history.wait()
+    result = {"rows": history.count("default"), "fill_ms": fill_ms, "record_ms": record_ms,
+              "first_page_ms": timed_query(lambda: history.page("default")),
+              "next_page_ms": timed_query(lambda: history.page("default", before=first_page[-1].id)),
+              "member_page_ms": timed_query(lambda: history.page("default", member_id=ids[0])),
+              "on_duty_at_ms": timed_query(lambda: history.on_duty_at("default", middle)),
+              "page_at_date_ms": timed_query(lambda: history.page("default", until=middle)),
+              "stats_all_ms": timed_query(lambda: history.shift_stats("default"), repeat=3),
+              "stats_last_30_days_ms": timed_query(
+                  lambda: history.shift_stats("default", datetime.now(timezone.utc) - timedelta(days=30)))}
+    history.close()
+    return result
+
+
+async def bench_failover(tmp, size, make_api, replicas=3, lease_seconds=1.0, phase_seconds=2.0, rotate_every=0.2,
+                         command_every=0.02, pool=500):
+    """
+    `replicas` bot processes sharing one state.db, each with its own fake Discord holding the same members. They all
+    run commands the whole time (adds, and weight changes of their own members), and the leader rotates every
+    rotate_every seconds instead of weekly. The leader is killed (SIGKILL, so its lease has to expire), then the next
+    leader is stopped cleanly (it releases the lease), then the rest.
+    failover_ms is the kill to the next election, at most lease_seconds * 4 / 3. handover_ms is the clean stop to the next.
+    Reports whether only the leader of the time rotated, whether every acknowledged command is in the shared state, and
+    whether a new leader planned from the next fire time rather than the one it saw when it loaded (stale_next_fire).
+    """
+    state = tmp / f"failover_{size}" / SHARED_STATE_NAME
+    state.parent.mkdir()
+    write_conf(state.with_name("conf.json"), member_ids(size))
+    write_atomic(state.with_name("rotations.json"), {"default": {"guild_id": 1, "config": str(state.with_name("conf.json"))}})
+    events = []
+    processes = {}
+
+    async def spawn(number: int):
+        name = f"replica{number}"
+        options = {"state": str(state), "name": name, "number": number, "replicas": replicas, "size": size,
+                   "latency": make_api().latency, "lease_seconds": lease_seconds, "rotate_every": rotate_every,
+                   "command_every": command_every, "pool": pool}
+        process = await asyncio.create_subprocess_exec(sys.executable, str(Path(__file__).resolve()),
+                                                       "--replica", json.dumps(options), stdout=asyncio.subprocess.PIPE)
+        processes[name] = process
+        async for line in process.stdout:
+            events.append(json.loads(line))
+
+    async def wait_for(event: str, after: float, timeout: float = 30.0) -> dict:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            found = [e for e in events if e["event"] == event and e["time"] >= after]
+            if found:
+                return found[0]
+            await asyncio.sleep(0.01)
+        raise TimeoutError(f"No {event} after {after}")
+
+    readers = [asyncio.ensure_future(spawn(number)) for number in range(replicas)]
+    started = time.time()
+    first = await wait_for("elected", started)
+    while sum(e["event"] == "ready" for e in events) < replicas:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(phase_seconds)
+
+    killed = first["replica"]
+    processes[killed].kill()
+    killed_at = time.time()
+    second = await wait_for("elected", killed_at)
+    await asyncio.sleep(phase_seconds)
+
+    processes[second["replica"]].send_signal(signal.SIGTERM)
+    stopped_at = time.time()
+    third = await wait_for("elected", stopped_at)
+    await asyncio.sleep(phase_seconds)
+    for name, process in processes.items():
+        if process.returncode is None and name != killed:
+            process.send_signal(signal.SIGTERM)
+    await asyncio.gather(*readers)
+    await asyncio.gather(*(process.wait() for process in processes.values()))
+
+    shared = SharedState(state)
+    config, records, seq = shared.read("default")
+    shared.close()
+    for record in records:
+        apply_journal_record(config, record)
+    final_ids = config[ConfKeys.MEMBER_IDS.value]
+    final_weights = config.get(ConfKeys.WEIGHTS.value, {})
+
+    elections = [e for e in events if e["event"] == "elected"]
+    terms = {(e["replica"], e["term"]) for e in elections}
+    rotations = [e for e in events if e["event"] == "rotated"]
+    stale_next_fire = sum(1 for e in events if e["event"] == "took_over" and (e["next_fire"] or 0) <= e["time"])
+    # Rotated by a replica that wasnt the leader of that term, or a term rotating again after a newer term did
+    by_non_leader = [e for e in rotations if (e["replica"], e["term"]) not in terms]
+    out_of_order = sum(1 for a, b in zip(rotations, rotations[1:]) if b["term"] < a["term"])
+    acks = [e for e in events if e["event"] == "ack"]
+    lost = [e for e in acks if e["op"] == "add" and e["member_id"] not in final_ids]
+    last_weight = {}
+    for e in acks:
+        if e["op"] == "weight":
+            last_weight[e["member_id"]] = (e["value"], e["replica"])
+    for member_id, (value, replica) in last_weight.items():
+        stored = final_weights.get(str(member_id))
+        # The killed replica may have written one more than it got to acknowledge
+        if stored is None or stored < value or (replica != killed and stored != value):
+            lost.append({"op": "weight", "member_id": member_id, "value": value, "stored": stored})
+    finals = {e["replica"]: e for e in events if e["event"] == "final"}
+    last = finals[third["replica"]]
+    history = HistoryStore(state.with_name("history.db"))
+    recorded = sum(shift.shifts for shift in history.shift_stats("default"))
+    history.close()
+    return {"replicas": replicas, "lease_seconds": lease_seconds,
+            "failover_ms": (second["time"] - killed_at) * 1000, "failover_bound_ms": lease_seconds * 4 / 3 * 1000,
+            "handover_ms": (third["time"] - stopped_at) * 1000,
+            "leaders": [e["replica"] for e in elections], "terms": [e["term"] for e in elections],
+            "rotations": len(rotations), "rotations_recorded": recorded, "stale_next_fire": stale_next_fire,
+            "commands_acked": len(acks), "commands_failed": sum(e["event"] == "failed" for e in events),
+            "conflicts_retried": sum(e["conflicts"] for e in finals.values()), "seq": seq,
+            # test_SharedState.py checks these
+            "by_non_leader": by_non_leader, "out_of_order": out_of_order, "lost": lost,
+            "duplicate_ids": len(final_ids) - len(set(final_ids)),
+            "index_in_range": 0 <= config[ConfKeys.INDEX.value] < len(final_ids),
+            "last_leader_matches": (last["seq"], last["member_ids"], last["index"]) == (seq, final_ids,
+                                                                                       config[ConfKeys.INDEX.value])}
+
+
+async def run_replica(state: str, name: str, number: int, replicas: int, size: int, latency: float, lease_seconds: float,
+                      rotate_every: float, command_every: float, pool: int):
+    """One replica of bench_failover, in its own process. Reports what it does as JSON lines on stdout."""
+    def emit(event: str, **fields):
+        print(json.dumps({"event": event, "replica": name, "time": time.time(), **fields}), flush=True)
+
+    logging.getLogger().setLevel(logging.CRITICAL + 1)
+    client = FakeClient(FakeAPI(latency=latency))
+    build_guild(client, size + replicas * pool, role_id=ROLE_ID)
+    state = Path(state)
+    manager = RotationManager(client, 1, path=state.with_name("rotations.json"), shared=state,
+                              lease_seconds=lease_seconds, holder=name)
+    manager.watcher.interval = lease_seconds / 4
+    manager.operations.buckets = {}  # Otherwise rotating every rotate_every seconds just waits on the role rate limits
+    lease = manager.lease
+    elected, demoted = lease.on_elected, lease.on_demoted
+
+    def on_elected():
+        emit("elected", term=lease.term)
+        elected()
+        emit("took_over", next_fire=rotation.next_fire and rotation.next_fire.timestamp())
+
+    def on_demoted():
+        emit("demoted", term=lease.term)
+        demoted()
+
+    lease.on_elected, lease.on_demoted = on_elected, on_demoted
+    rotation = manager.get("default")
+    # Every rotate_every seconds instead of weekly, everywhere the rotation works out its fire times
+    trigger = IntervalTrigger(seconds=rotate_every)
+    rotation.cron_trigger = lambda: trigger
+    errors = await manager.load_all()
+    rotate_role = rotation.rotate_role
+
+    async def rotate_and_report(repair=False):
+        report = await rotate_role(repair)
+        emit("rotated", index=report.index, term=lease.term)
+        return report
+
+    rotation.rotate_role = rotate_and_report
+    manager.start()
+    emit("ready", errors=len(errors))
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    ids = member_ids(size + replicas * pool)
+    new_ids = iter(ids[size + number * pool:size + (number + 1) * pool])
+    owned = ids[number:size:replicas]  # Only this replica changes their weights, so the last one it acked has to stick
+    step = 0
+    while not stop.is_set():
+        step += 1
+        try:
+            member_id = next(new_ids, None) if step % 2 else None
+            if member_id is not None:
+                await rotation.executor.submit("add_user", rotation.add_user, member_id)
+                emit("ack", op="add", member_id=member_id)
+            else:
+                member_id = owned[step % len(owned)]
+                await rotation.executor.submit("set_weight", rotation.set_weight, member_id, float(step))
+                emit("ack", op="weight", member_id=member_id, value=step)
+        except Exception as e:
+            emit("failed", error=f"{type(e).__name__}: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), command_every)
+        except asyncio.TimeoutError:
+            pass
+    await rotation.refresh()
+    emit("final", seq=rotation.store.seq, index=rotation.index, member_ids=rotation.members.ids(),
+         conflicts=rotation.executor.conflicts)
+    await manager.close()
+
+
+def check_invariants(rotation: RoleRotation) -> list:
+    """What is wrong with a rotation on the fake backend, for the tests. Empty if only whoever is on duty has the role"""
+    violations = []
+    ids = rotation.members.ids()
+    if len(set(ids)) != len(ids):
+        violations.append("duplicate member ids")
+    if not 0 <= rotation.index < len(ids):
+        violations.append(f"index {rotation.index} out of range for {len(ids)} members")
+    else:
+        guild = rotation.client.guilds[1]
+        holders = {member.id for member in guild.members.values()
+                   if rotation.managed_role in member.roles and member.id in rotation.members}
+        if holders != {ids[rotation.index]}:
+            violations.append(f"role holders {holders} but {ids[rotation.index]} is on duty")
+    return violations
+
+
+SCENARIOS = {
+    "load_config_sequential": bench_load_config_sequential,
+    "load_config_rest": bench_load_config_rest,
+    "load_config_chunked": bench_load_config_chunked,
+    "load_config_cached": bench_load_config_cached,
+    "reload_config": bench_reload_config,
+    "fetch_members": bench_fetch_members,
+    "rotate_role": bench_rotate_role,
+    "rotate_role_repair": bench_rotate_role_repair,
+    "reconcile": bench_reconcile,
+    "add_remove_user": bench_add_remove_user,
+    "move_member": bench_move_member,
+    "many_rotations": bench_many_rotations,
+    "member_memory": bench_member_memory,
+    "rotation_order": bench_rotation_order,
+    "history": bench_history,
+    "strategies": bench_strategies,
+    "preview": bench_preview,
+    "logging": bench_logging,
+    "metrics": bench_metrics,
+    "startup": bench_startup,
+    "import_members": bench_import_members,
+    "autocomplete": bench_autocomplete,
+    "notifications": bench_notifications,
+    "failover": bench_failover,
+}
+
+
+async def stop_rotations():
+    for rotation in _rotations:
+        rotation.operations.stop()
+        rotation.executor.stop()
+        rotation.schedules.close()
+        rotation.history.close()
+        rotation.outbox.close()
+    _rotations.clear()
+    await asyncio.sleep(0)  # Let the cancellations go through
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run(scenarios, sizes, api_options: dict, quiet=True):
+    """api_options are passed to every FakeAPI, see FakeDiscord.FakeAPI"""
+    results = []
+    revision = git_revision()
+    logs = LogPipeline(level=logging.DEBUG)
+    if quiet:
+        # RoleRotation logs a lot, keep it out of the results. Scenarios that measure logging set their own levels
+        logging.getLogger().setLevel(logging.CRITICAL + 1)
+    else:
+        logs.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in scenarios:
+            for size in sizes:
+                measured = await SCENARIOS[name](Path(tmp), size, lambda: FakeAPI(**api_options))
+                await stop_rotations()
+                result = {"scenario": name, "members": size, **api_options, "revision": revision,
+                          "python": platform.python_version(), **measured}
+                print(json.dumps(result))
+                results.append(result)
+    logs.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="member counts to run at")
+    parser.add_argument("--latency", type=float, default=0.01, help="simulated seconds per API call")
+    parser.add_argument("--rate-limit", type=int, help="calls per route per second before a 429 is simulated")
+    parser.add_argument("--inject-429-every", type=int, default=0, help="give every Nth call a 429")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="chance that any call fails with a 500")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--out", type=Path, help="also write the results here as a JSON list")
+    parser.add_argument("--verbose", action="store_true", help="dont hide what RoleRotation logs")
+    parser.add_argument("--replica", help=argparse.SUPPRESS)  # Runs one replica for the failover scenario
+    args = parser.parse_args()
+    if args.replica:
+        asyncio.run(run_replica(**json.loads(args.replica)))
+        return
+
+    api_options = {"latency": args.latency, "rate_limit": args.rate_limit,
+                   "inject_429_every": args.inject_429_every, "failure_rate": args.failure_rate}
+    results = asyncio.run(run(args.scenarios, args.sizes, api_options, quiet=not args.verbose))
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
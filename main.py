@@ -1,51 +1,103 @@
+import asyncio
+import io
 import logging
 import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
 
 import discord
 from discord import app_commands
 
-from RoleRotation import RoleRotation
+from CommandSync import CommandSync
+from CommandTasks import CommandTasks
+from HistoryStore import DEFAULT_PAGE_SIZE as HISTORY_PAGE_SIZE
+from LeaderLease import DEFAULT_LEASE_SECONDS
+from LoggingSetup import LogPipeline, DEFAULT_RECENT_LINES
+from MemberImport import MAX_IMPORT_BYTES, export_csv, member_row, parse_member_rows
+from Metrics import ENABLED as METRICS_ENABLED, METRICS, MetricsServer, DEFAULT_METRICS_PORT, labels_of
+from RotationManager import RotationManager, DEFAULT_ROTATION
+from RotationPreview import RotationPreview, DEFAULT_WEEKS
+from RotationStrategy import STRATEGIES
+from StartupTimer import StartupTimer
+
+# /stats lists at most this many members, to stay under Discord's 2000 character limit
+STATS_LIMIT = 30
+# Same for /preview
+PREVIEW_LIMIT = 52
+# Discord shows at most 25 autocomplete choices, with names up to 100 characters
+CHOICES_LIMIT = 25
+CHOICE_NAME_LIMIT = 100
+MESSAGE_LIMIT = 2000
 
 def codeblock(s: str) -> str:
     return (f"```\n"
             f"{s}\n"
             f"```")
 
-# 1. Get the parent logger and set its level
-logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
+# Logging goes through a queue to a background thread, so writing a line never blocks the event loop.
+# discord stays at DEBUG like before, but discord.http and discord.gateway are sampled since they log every request.
+# The last lines are also kept in memory for /debug.
+LOG_LEVEL = logging.getLevelNamesMapping()[os.getenv('LOG_LEVEL', 'INFO').upper()]
+DISCORD_LOG_LEVEL = logging.getLevelNamesMapping()[os.getenv('DISCORD_LOG_LEVEL', 'DEBUG').upper()]
+LOG_JSON = os.getenv('LOG_FORMAT', '').lower() == 'json'
+logs = LogPipeline(level=LOG_LEVEL, as_json=LOG_JSON, levels={'discord': DISCORD_LOG_LEVEL})
+logs.start()
+logger = logging.getLogger('bot')
 
-# # 2. Get the http logger AND set its level too
-http_logger = logging.getLogger('discord.http')
-http_logger.setLevel(logging.DEBUG)
 
-# 3. Create, format, and add the handler ONLY to the PARENT
-handler = logging.StreamHandler()
-handler.setFormatter(
-    logging.Formatter('[%(asctime)s] [%(levelname)s] %(name)s: %(message)s')
-)
-logger.addHandler(handler)
+class MetricsTree(app_commands.CommandTree):
+    """Times every slash command handler and counts the ones that fail. Only used when metrics are on."""
+
+    async def interaction_check(self, interaction: discord.Interaction, /) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError, /):
+        name = interaction.command.name if interaction.command else "?"
+        METRICS.inc("command_errors_total", labels_of(command=name))
+        await super().on_error(interaction, error)
 
 
 class MyClient(discord.Client):
     # Suppress error on the User attribute being None since it fills up later
     user: discord.ClientUser
 
-    def __init__(self, *, intents: discord.Intents, guild_id=0):
-        super().__init__(intents=intents)
-        self.tree = app_commands.CommandTree(self)
-        self.d = RoleRotation(self, guild_id)
-        self.guild = discord.Object(id=guild_id)
+    def __init__(self, *, intents: discord.Intents, guild_id=0, trim_member_cache=False):
+        options = {}
+        if trim_member_cache:
+            # Dont download and keep the whole guild. The members the rotations ask for are cached by query_members,
+            # and only cached members get gateway updates
+            options = {"member_cache_flags": discord.MemberCacheFlags.none(), "chunk_guilds_at_startup": False}
+        super().__init__(intents=intents, **options)
+        self.tree = MetricsTree(self) if METRICS_ENABLED else app_commands.CommandTree(self)
+        self.rotations = RotationManager(self, guild_id, shared=SHARED_STATE, lease_seconds=LEASE_SECONDS,
+                                         holder=REPLICA_NAME)
+        self.tasks = CommandTasks(format_error=lambda e: codeblock(e.__str__()))
+        self.metrics_server = MetricsServer(port=METRICS_PORT) if METRICS_ENABLED and METRICS_PORT else None
+        self.command_sync = CommandSync(self.tree, force=FORCE_COMMAND_SYNC)
+        self.startup = StartupTimer()
 
     # This is run only once, unlike on_ready()
     async def setup_hook(self):
-        # This copies the global commands over to your guild.
-        self.tree.copy_global_to(guild=self.guild)
-        await self.d.load_config()
-        # self.d.write_config()
-        self.d.scheduler.start()
-        commands_synced = await self.tree.sync(guild=self.guild)
-        print(commands_synced)
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+            logger.info("Serving metrics at http://%s:%d/metrics", self.metrics_server.host, self.metrics_server.port)
+        # Loading the rotations and syncing the commands dont depend on each other, so they run at the same time.
+        # The sync copies the global commands over to every guild with a rotation, and is skipped when they havent changed
+        await asyncio.gather(self.startup.step("load_rotations", self.rotations.load_all()),
+                             self.startup.step("command_sync", self.command_sync.sync_all(self.rotations.guild_ids())))
+        self.rotations.start()
+        logger.info("%s, commands: %s", self.startup, self.command_sync.results)
+
+    async def close(self):
+        await self.tasks.shutdown()
+        await self.rotations.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await super().close()
+        logs.stop()
 
 # -------- Init some stuff --------- #
 description = "See the app_commands example from the discord.py github"
@@ -55,15 +107,57 @@ intents.members = True
 TOKEN = os.getenv('DISCORD_TOKEN')
 GUILD_ID = os.getenv('GUILD_ID')
 GUILD_ID = int(GUILD_ID)
-client = MyClient(intents=intents, guild_id=GUILD_ID)
+TRIM_MEMBER_CACHE = os.getenv('TRIM_MEMBER_CACHE', '').lower() in ('1', 'true', 'yes')
+# Sync the commands even if they havent changed since the last sync
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'yes')
+# Prometheus text format on localhost. 0 turns the endpoint off but keeps /metrics, METRICS=0 turns off everything
+METRICS_PORT = int(os.getenv('METRICS_PORT', DEFAULT_METRICS_PORT))
+# Run as one of several replicas sharing this state.db (see the readme). Only the leader runs the scheduled rotations
+SHARED_STATE = Path(os.getenv('SHARED_STATE')) if os.getenv('SHARED_STATE') else None
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+REPLICA_NAME = os.getenv('REPLICA_NAME') or None  # hostname:pid if not set
+client = MyClient(intents=intents, guild_id=GUILD_ID, trim_member_cache=TRIM_MEMBER_CACHE)
+
+if METRICS_ENABLED:
+    @client.event
+    async def on_app_command_completion(interaction: discord.Interaction, command):
+        started = interaction.extras.get("started")
+        if started is not None:
+            METRICS.observe("command_seconds", time.perf_counter() - started, labels_of(command=command.name))
+
 
 @client.event
 async def on_ready():
     assert client.user is not None
-    print(f'Logged in as {client.user} (ID: {client.user.id})')
+    logger.info("Logged in as %s (ID: %d)", client.user, client.user.id)
+    # The gateway cache is filled in now, and events may have been missed while disconnected.
+    # With replicas only the leader touches the roles on its own
+    if client.rotations.is_leader():
+        await client.rotations.reconciler.reconcile_all()
+
+
+# These keep the shared member and role cache fresh, so it rarely has to ask the API
+@client.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    client.rotations.on_member_update(before, after)
+
+@client.event
+async def on_member_remove(member: discord.Member):
+    client.rotations.on_member_remove(member)
+
+@client.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    client.rotations.on_guild_role_update(before, after)
+
+@client.event
+async def on_guild_role_delete(role: discord.Role):
+    client.rotations.on_guild_role_delete(role)
 
 
 # -------- Registering commands --------- #
+# Every command takes a rotation name (autocompleted, "default" if left out).
+# Anything that changes a rotation is submitted to its executor, so commands and the scheduled rotation
+# run one at a time instead of interleaving at their awaits. Reads like /debug use its snapshot and never wait.
 #todo figure out how to only allow server admins to use the command
 #todo im pretty sure it has to do with the @client.tree.check decorator but...
 async def add(interaction: discord.Interaction, left: int, right: int):
@@ -71,16 +165,99 @@ async def add(interaction: discord.Interaction, left: int, right: int):
     await interaction.response.send_message(f"Result: { left + right }")
 
 
+async def rotation_autocomplete(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=name, value=name)
+            for name in client.rotations.names() if name.startswith(current)][:CHOICES_LIMIT]
+
+
+# Autocomplete runs on every keystroke and Discord drops answers that take over 3 seconds.
+# These only read the loaded rotation (the rotation argument, if it was filled in before this one), never the API.
+def autocomplete_rotation(interaction: discord.Interaction):
+    try:
+        return client.rotations.get(getattr(interaction.namespace, "rotation", None) or DEFAULT_ROTATION)
+    except KeyError:
+        return None
+
+
+def position_label(d, position: int) -> str:
+    record = d.members[position]
+    return f"{position}: {record.name}{' (on duty)' if position == d.index else ''}"[:CHOICE_NAME_LIMIT]
+
+
+async def member_autocomplete(interaction: discord.Interaction, current: str):
+    """Members of the rotation whose name, a word of it or id starts with what was typed, through its PrefixIndex"""
+    d = autocomplete_rotation(interaction)
+    if d is None:
+        return []
+    return [app_commands.Choice(name=position_label(d, d.members.position(record.id)), value=str(record.id))
+            for record in d.members.search(current, CHOICES_LIMIT)]
+
+
+async def position_autocomplete(interaction: discord.Interaction, current: str):
+    """Positions starting with the digits typed so far, with who is there. Nothing typed starts at whoever is on duty."""
+    d = autocomplete_rotation(interaction)
+    if d is None or not len(d.members):
+        return []
+    count = len(d.members)
+    if not current.strip().isdigit():
+        positions = [(d.index + offset) % count for offset in range(min(count, CHOICES_LIMIT))]
+    else:
+        positions = positions_with_prefix(current.strip(), count, CHOICES_LIMIT)
+    return [app_commands.Choice(name=position_label(d, position), value=position) for position in positions]
+
+
+def positions_with_prefix(prefix: str, count: int, limit: int) -> list:
+    """0 <= position < count whose decimal form starts with prefix: the prefix itself, then p0-p9, p00-p99 and so on"""
+    positions = []
+    start, width = int(prefix), 1
+    while start < count and len(positions) < limit:
+        positions.extend(range(start, min(start + width, count, start + limit - len(positions))))
+        if start == 0:
+            break  # "0" is never the start of a longer number
+        start, width = start * 10, width * 10
+    return positions
+
+
+def find_member(d, text: str):
+    """The member of the rotation an autocompleted (id), pasted (id or mention) or typed (exact name) value names"""
+    row = member_row(0, text.strip())
+    if row.member_id is not None:
+        return d.members.get(row.member_id)
+    matches = [record for record in d.members.search(text, CHOICES_LIMIT) if record.name.casefold() == text.strip().casefold()]
+    return matches[0] if len(matches) == 1 else None
+
+
+def replica_line(executor) -> str:
+    lease = client.rotations.lease
+    if lease is None:
+        return ""
+    return f"Replica: {lease.stats()}, conflicts retried: {executor.conflicts}\n"
+
+
 @client.tree.command(name="debug", description="prints debugging info to console")
-async def debug(interaction: discord.Interaction):
+@app_commands.describe(lines="Also show up to this many of the most recent log lines")
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def debug(interaction: discord.Interaction, lines: app_commands.Range[int, 0, DEFAULT_RECENT_LINES]=0,
+                rotation: str=DEFAULT_ROTATION):
     rotation_state = None
     msg = ""
     try:
-        rotation_state = codeblock(client.d.__str__())
-
-    except IndexError as e:
+        d = client.rotations.get(rotation)
+    except KeyError as e:
+        await interaction.response.send_message(e.args[0])
+        return
+    executor = d.executor
+    snapshot = executor.snapshot
+    if isinstance(snapshot, IndexError):
         msg += 'The index was out of range. Setting it to zero.'
-        client.d.set_index(0, force=True)
+    else:
+        rotation_state = codeblock(f"{snapshot}\n"
+                                   f"Running: {executor.current} Queued: {executor.depth} Commands: {client.tasks.running}\n"
+                                   f"Reconciler: {client.rotations.reconciler.stats()}\n"
+                                   f"Outbox: {client.rotations.outbox.stats()}\n"
+                                   f"{replica_line(executor)}"
+                                   f"Logs: {logs.stats()}\n"
+                                   f"{client.startup}, commands: {client.command_sync.results}")
 
     if rotation_state is not None:
 
@@ -89,27 +266,143 @@ async def debug(interaction: discord.Interaction):
 
         msg +=  '(You should `/reload` now).'
 
-    print(msg)
+    logger.info("%s", msg)
+    if lines:
+        # Only as many of the newest lines as fit in the message, backticks would end the code block early
+        recent = logs.recent.recent(lines, max_chars=MESSAGE_LIMIT - len(msg) - len(codeblock("")))
+        msg += codeblock("\n".join(recent).replace("`", "'") or "Nothing logged yet")
     await interaction.response.send_message(msg)
+    if isinstance(snapshot, IndexError):
+        # After responding, since it has to wait its turn
+        await executor.submit("set_index", d.set_index, 0, True, merge=True)
+
+@client.tree.command(name="history", description="Shows past rotations and member changes, newest first")
+@app_commands.describe(
+    member="Only show changes about this member",
+    date="YYYY-MM-DD, shows who was on duty that day and what happened up to it",
+    before="Show the page after this event id (the last # of the previous page)"
+)
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def history(interaction: discord.Interaction, member: Optional[discord.Member] = None, date: Optional[str] = None,
+                  before: Optional[int] = None, rotation: str=DEFAULT_ROTATION):
+    try:
+        d = client.rotations.get(rotation)
+        until = None
+        if date is not None:
+            # The end of that day, so the whole day is included
+            until = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=1, microseconds=-1)
+    except (KeyError, ValueError) as e:
+        await interaction.response.send_message(e.args[0])
+        return
+
+    lines = []
+    if until is not None:
+        shift = d.history.on_duty_at(d.name, until)
+        lines.append(f"On duty on {date}: {shift.name if shift else 'nobody recorded'}")
+    events = d.history.page(d.name, before=before, member_id=member.id if member else None, until=until)
+    lines.extend(event.__str__() for event in events)
+    if not events:
+        lines.append("No history recorded.")
+    message = codeblock("\n".join(lines))
+    if len(events) == HISTORY_PAGE_SIZE:
+        message += f"More with `before:{events[-1].id}`"
+    await interaction.response.send_message(message)
+
+
+@client.tree.command(name="stats", description="Counts how many shifts each member has done")
+@app_commands.describe(days="Only count shifts from the last this many days. 0 counts all of them")
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def stats(interaction: discord.Interaction, days: int=0, rotation: str=DEFAULT_ROTATION):
+    try:
+        d = client.rotations.get(rotation)
+    except KeyError as e:
+        await interaction.response.send_message(e.args[0])
+        return
+    since = datetime.now(timezone.utc) - timedelta(days=days) if days > 0 else None
+    shifts = d.history.shift_stats(d.name, since)
+    lines = [shift.__str__() for shift in shifts[:STATS_LIMIT]] or ["No shifts recorded."]
+    if len(shifts) > STATS_LIMIT:
+        lines.append(f"...and {len(shifts) - STATS_LIMIT} more")
+    await interaction.response.send_message(codeblock("\n".join(lines)))
+
+
+@client.tree.command(name="metrics", description="Shows how long operations, API calls and commands took, and how late rotations started")
+async def metrics(interaction: discord.Interaction):
+    if not METRICS_ENABLED:
+        await interaction.response.send_message("Metrics are turned off (METRICS=0).")
+        return
+    lines = METRICS.summary().splitlines()
+    # Drop lines from the end until it fits in one message
+    while len(codeblock("\n".join(lines))) > MESSAGE_LIMIT:
+        lines.pop()
+    await interaction.response.send_message(codeblock("\n".join(lines)))
+
+
+@client.tree.command(name="preview", description="Shows who will be on duty for the next few weeks")
+@app_commands.describe(
+    weeks="How far ahead to look",
+    day="Preview with this schedule day instead (monday is 0)",
+    hour="Preview with this schedule hour instead",
+    minute="Preview with this schedule minute instead",
+    strategy="Preview with this strategy instead",
+    member="Preview as if this member was moved first",
+    position="Where to move them"
+)
+@app_commands.choices(strategy=[app_commands.Choice(name=name, value=name) for name in STRATEGIES])
+@app_commands.autocomplete(rotation=rotation_autocomplete, position=position_autocomplete)
+async def preview(interaction: discord.Interaction, weeks: int=DEFAULT_WEEKS, day: int=-1, hour: int=-1, minute: int=-1,
+                  strategy: Optional[str] = None, member: Optional[discord.Member] = None, position: Optional[int] = None,
+                  rotation: str=DEFAULT_ROTATION):
+    try:
+        d = client.rotations.get(rotation)
+        moves = [(member.id, position)] if member is not None and position is not None else []
+        # Nothing is awaited, so no mutation can change the rotation halfway through
+        result = RotationPreview(d, (day, hour, minute), strategy, moves).run(
+            count=PREVIEW_LIMIT, until=datetime.now(timezone.utc) + timedelta(weeks=weeks))
+    except (KeyError, ValueError) as e:
+        await interaction.response.send_message(e.args[0])
+        return
+    lines = [assignment.__str__() for assignment in result] or ["Nothing scheduled."]
+    await interaction.response.send_message(codeblock("\n".join(lines)))
+
 
 @client.tree.command(name="force_rotate", description="Force bot to rotate the managed_role.")
-async def force_rotate(interaction: discord.Interaction):
-    if not await client.d.rotate_role():
-        await interaction.response.send_message("Error trying to rotate the role.")
-    else:
-        await interaction.response.send_message("Done")
+@app_commands.describe(
+    repair="Re-fetch every member and clear the role from all of them first. Slow, only use it if the role drifted."
+)
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def force_rotate(interaction: discord.Interaction, repair: bool=False, rotation: str=DEFAULT_ROTATION):
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        if repair:
+            await progress(f"Repairing: re-fetching {len(d.members)} members and clearing the role first...")
+        try:
+            report = await d.executor.submit("rotate_role", d.rotate_role, repair)
+        except Exception as e:
+            await d.executor.submit("reconcile", d.reconcile, merge=True)
+            raise e
+        if not report:
+            return "Error trying to rotate the role."
+        return codeblock(report.__str__())
+
+    await client.tasks.run(interaction, ("force_rotate", rotation), work)
 
 @client.tree.command(description="Reload the config files")
-async def reload(interaction):
-    reloaded = await client.d.load_config() # Must pass in case
-    message = "Done"
-    if issubclass(type(reloaded), Exception):
-        message = (f" There was an error reloading:\n"
-                   f"```bash\n"
-                   f"{reloaded}\n"
-                   f"```")
-        print("errored while trying to reload")
-    await interaction.response.send_message(message)
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def reload(interaction, rotation: str=DEFAULT_ROTATION):
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        reloaded = await d.executor.submit("reload_config", d.reload_config, merge=True)
+        message = reloaded.__str__()
+        if issubclass(type(reloaded), Exception):
+            message = (f" There was an error reloading:\n"
+                       f"```bash\n"
+                       f"{reloaded}\n"
+                       f"```")
+            logger.warning("Errored while trying to reload '%s'", rotation)
+        return message
+
+    await client.tasks.run(interaction, ("reload", rotation), work)
 
 
 @client.tree.command()
@@ -117,41 +410,79 @@ async def reload(interaction):
     member="The name of the member to add to the rotation",
     i="The index where you want to insert them"
 )
-async def add_member(interaction: discord.Interaction, member: discord.Member, i: int=-1):
+@app_commands.autocomplete(rotation=rotation_autocomplete, i=position_autocomplete)
+async def add_member(interaction: discord.Interaction, member: discord.Member, i: int=-1, rotation: str=DEFAULT_ROTATION):
     """Adds a member to the rotation"""
-    result = None
-    try:
-        if i == -1:
-            result = await client.d.add_user(member.id)
-        else:
-            result = await client.d.add_user(member.id, i)
-    except Exception as e:
-        await interaction.response.send_message(codeblock(e.__str__()))
-        return
-    await interaction.response.send_message(f"Added {result} to the list.")
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        result = await d.executor.submit("add_user", d.add_user, member.id, i, merge=True)
+        return f"Added {result} to the list."
+
+    await client.tasks.run(interaction, ("add_member", rotation, member.id), work)
 
-#todo only allow one of the bot's commands to be active at a time
 @client.tree.command()
 @app_commands.describe(
-    member="The name of the member to add to the rotation"
+    members="Member ids or mentions, separated by spaces, commas or new lines",
+    file="A CSV with a member_id column (like /export_members gives), or a text file of ids"
 )
-async def remove_member(interaction: discord.Interaction, member: discord.Member):
-    """Removes a member from the rotation"""
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def import_members(interaction: discord.Interaction, members: Optional[str] = None,
+                         file: Optional[discord.Attachment] = None, rotation: str=DEFAULT_ROTATION):
+    """Adds many members to the end of the rotation at once, and reports what happened to each"""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        rows = parse_member_rows(members or "")
+        if file is not None:
+            if file.size > MAX_IMPORT_BYTES:
+                return f"{file.filename} is bigger than {MAX_IMPORT_BYTES // 1024} KiB."
+            rows += parse_member_rows((await file.read()).decode("utf-8-sig"), first_row=len(rows) + 1)
+        if not rows:
+            return "Give some member ids, mentions or a file."
+        await progress(f"Importing {len(rows)} row(s)...")
+        report = await d.executor.submit("import_members", d.import_members, rows)
+        return codeblock(report.render(max_chars=MESSAGE_LIMIT - len(codeblock(""))))
+
+    await client.tasks.run(interaction, ("import_members", rotation), work)
+
+@client.tree.command()
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def export_members(interaction: discord.Interaction, rotation: str=DEFAULT_ROTATION):
+    """Sends the members of the rotation as a CSV, in order, which /import_members can read back"""
     try:
-        deleted = client.d.remove_user(member.id)
-    except discord.DiscordException as e:
-        await interaction.response.send_message(codeblock(e.__str__()))
-        return
-    except Exception as e:
-        print("something went horribly wrong trying to delete a member")
-        await interaction.response.send_message(
-            "I probably messed something up in the code:\n " + codeblock(e.__str__()))
+        d = client.rotations.get(rotation)
+    except KeyError as e:
+        await interaction.response.send_message(e.args[0])
         return
+    # Nothing is awaited, so no mutation can change the rotation halfway through
+    exported = export_csv(d.members, d.index, d.weights)
+    await interaction.response.send_message(f"{len(d.members)} member(s) of {d.name}",
+                                            file=discord.File(io.BytesIO(exported.encode()), f"{d.name}_members.csv"))
 
-    if deleted is None:
-        await interaction.response.send_message(f"Didn't find {member.name} in the list.")
-    else:
-        await interaction.response.send_message(f"Removed {deleted.name}.")
+@client.tree.command()
+@app_commands.describe(
+    member="A member of the rotation, by name or id"
+)
+@app_commands.autocomplete(rotation=rotation_autocomplete, member=member_autocomplete)
+async def remove_member(interaction: discord.Interaction, member: str, rotation: str=DEFAULT_ROTATION):
+    """Removes a member from the rotation"""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        record = find_member(d, member)
+        if record is None:
+            return f"Didn't find {member} in the list."
+        try:
+            deleted = await d.executor.submit("remove_user", d.remove_user, record.id, merge=True)
+        except discord.DiscordException as e:
+            return codeblock(e.__str__())
+        except Exception as e:
+            logger.exception("Something went horribly wrong trying to delete a member")
+            return "I probably messed something up in the code:\n " + codeblock(e.__str__())
+
+        if deleted is None:
+            return f"Didn't find {record.name} in the list."
+        return f"Removed {deleted.name}."
+
+    await client.tasks.run(interaction, ("remove_member", rotation, member), work)
 
 
 @client.tree.command()
@@ -160,33 +491,119 @@ async def remove_member(interaction: discord.Interaction, member: discord.Member
     hour="The hour to rotate the role. Uses 24 time.",
     minute="The minute of the hour to rotate the role."
 )
-async def set_schedule(interaction: discord.Interaction, day: int=-1, hour: int=-1, minute: int=-1):
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def set_schedule(interaction: discord.Interaction, day: int=-1, hour: int=-1, minute: int=-1,
+                       rotation: str=DEFAULT_ROTATION):
     """Set at what time of the week to rotate the role."""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        await d.executor.submit("set_new_schedule", d.set_new_schedule, day, hour, minute, merge=True)
+        return "Done"
 
-    msg = "Done"
-    try:
-        client.d.set_new_schedule(day, hour, minute)
-    except Exception as e:
-        msg = codeblock(e.__str__())
+    await client.tasks.run(interaction, ("set_schedule", rotation, day, hour, minute), work)
 
-    await interaction.response.send_message(msg)
+
+@client.tree.command()
+@app_commands.describe(strategy="How the next member is picked")
+@app_commands.choices(strategy=[app_commands.Choice(name=name, value=name) for name in STRATEGIES])
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def set_strategy(interaction: discord.Interaction, strategy: str, rotation: str=DEFAULT_ROTATION):
+    """round_robin goes down the list, weighted follows /set_weight, least_recent picks who waited longest"""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        await d.executor.submit("set_strategy", d.set_strategy, strategy, merge=True)
+        return f"Now using {strategy}."
+
+    await client.tasks.run(interaction, ("set_strategy", rotation, strategy), work)
+
+
+@client.tree.command()
+@app_commands.describe(
+    member="A member of the rotation",
+    weight="How many shifts they get for every one of a member with weight 1"
+)
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def set_weight(interaction: discord.Interaction, member: discord.Member, weight: float=1.0,
+                     rotation: str=DEFAULT_ROTATION):
+    """Gives a member more or fewer shifts with the weighted strategy"""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        await d.executor.submit("set_weight", d.set_weight, member.id, None if weight == 1 else weight, merge=True)
+        return f"{member.name} now has weight {weight}."
+
+    await client.tasks.run(interaction, ("set_weight", rotation, member.id, weight), work)
+
+
+@client.tree.command()
+@app_commands.describe(
+    member="A member of the rotation",
+    start="First day they are away, YYYY-MM-DD",
+    end="Last day they are away, YYYY-MM-DD",
+    clear="Forget every time they were marked away instead"
+)
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def set_unavailable(interaction: discord.Interaction, member: discord.Member, start: Optional[str] = None,
+                          end: Optional[str] = None, clear: bool=False, rotation: str=DEFAULT_ROTATION):
+    """Skips a member while they are away (e.g. on vacation)"""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        if clear:
+            await d.executor.submit("set_unavailable", d.set_unavailable, member.id, [])
+            return f"{member.name} is available again."
+        if start is None or end is None:
+            return "Give a start and an end, or clear."
+        # Local days, from the start of the first to the end of the last
+        window = (datetime.fromisoformat(start).timestamp(),
+                  (datetime.fromisoformat(end) + timedelta(days=1)).timestamp())
+        # Read their windows in the executor too, so another change cant slip in between
+        await d.executor.submit("set_unavailable",
+                                lambda: d.set_unavailable(member.id, d.unavailable.get(member.id, []) + [window]))
+        return f"{member.name} will be skipped from {start} to {end}."
+
+    await client.tasks.run(interaction, ("set_unavailable", rotation, member.id), work)
+
+
+@client.tree.command()
+@app_commands.describe(
+    dm="DM whoever goes on duty",
+    channel="Also post in this channel",
+    remind_hours="Remind them this many hours before their shift, e.g. 24,1. none for no reminders",
+    off="Turn every notification off (before applying the rest)"
+)
+@app_commands.autocomplete(rotation=rotation_autocomplete)
+async def set_notifications(interaction: discord.Interaction, dm: Optional[bool] = None,
+                            channel: Optional[discord.TextChannel] = None, remind_hours: Optional[str] = None,
+                            off: bool=False, rotation: str=DEFAULT_ROTATION):
+    """Tells members when they go on duty, and reminds them before their shift"""
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        hours = None
+        if remind_hours is not None:
+            hours = [] if remind_hours.strip().lower() == "none" else \
+                [float(part) for part in remind_hours.replace(",", " ").split()]
+        await d.executor.submit("set_notifications", d.set_notifications, dm, channel.id if channel else None, hours, off)
+        return codeblock(f"Notify: {d.notify}\nNext rotation: {d.next_fire}")
+
+    await client.tasks.run(interaction, ("set_notifications", rotation), work)
 
 
 @client.tree.command()
 @app_commands.describe(
     i="An index for the rotation to be set to."
 )
-async def set_index(interaction: discord.Interaction, i: int, force: bool=False):
-    message = ""
-    try:
-        client.d.set_index(i, force)
-    except Exception as e:
-        await interaction.response.send_message(codeblock(e.__str__()))
-        return
-    if force:
-        message += "Dont forget to reload."
-    await interaction.response.send_message(f"Set the index to {i.__str__()} {message}")
+@app_commands.autocomplete(rotation=rotation_autocomplete, i=position_autocomplete)
+async def set_index(interaction: discord.Interaction, i: int, force: bool=False, rotation: str=DEFAULT_ROTATION):
+    async def work(progress):
+        d = client.rotations.get(rotation)
+        message = ""
+        await d.executor.submit("set_index", d.set_index, i, force, merge=True)
+        if force:
+            message += "Dont forget to reload."
+        return f"Set the index to {i.__str__()} {message}"
+
+    await client.tasks.run(interaction, ("set_index", rotation, i, force), work)
 
 
 # -------- Running the bot --------- #
-client.run(TOKEN)
\ No newline at end of file
+# log_handler=None, the pipeline above already handles discord's loggers
+client.run(TOKEN, log_handler=None)
\ No newline at end of file
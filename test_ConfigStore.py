@@ -0,0 +1,190 @@
+"""
+Checks ConfigStore's snapshot and journal, replayed through RoleRotation's apply_journal_record, and that a writer
+killed at any moment leaves the config either as it was or with the write it was doing.
+Runs with `python -m unittest` (or pytest).
+"""
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from ConfigStore import ConfigStore, JOURNAL_SEQ_KEY, STALE_TEMP_SECONDS, write_atomic
+from RoleRotation import ConfKeys, apply_journal_record
+
+INDEX = ConfKeys.INDEX.value
+MEMBER_IDS = ConfKeys.MEMBER_IDS.value
+SCHEDULE_HOUR = ConfKeys.SCHEDULE_HOUR.value
+
+
+def config(ids, index=0) -> dict:
+    return {
+        ConfKeys.ROLE_ID.value: 500,
+        ConfKeys.SCHEDULE_DAY.value: 0,
+        SCHEDULE_HOUR: 12,
+        ConfKeys.SCHEDULE_MINUTE.value: 0,
+        INDEX: index,
+        MEMBER_IDS: list(ids),
+    }
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name) / "conf.json"
+        self.current = config([1, 2, 3, 4, 5], index=1)
+        write_atomic(self.path, self.current)
+        # No event loop here, so every append and save is written straight away
+        self.store = ConfigStore(self.path, lambda: json.loads(json.dumps(self.current)), apply_journal_record)
+        self.store.read()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def edit_by_hand(self, **changes):
+        with open(self.path) as fp:
+            edited = json.load(fp)
+        edited.update(changes)
+        write_atomic(self.path, edited)
+
+    def test_replay_matches_the_changes(self):
+        self.store.append("add", member_id=6, position=5)
+        self.store.append("move", member_id=6, position=0)  # Before the cursor, so it shifts to 2
+        self.store.append("remove", member_id=4)
+        self.store.append("rotate", index=3)
+        self.store.append("remove", member_id=1)  # Before the cursor again
+        self.store.append("set_schedule", day=2, hour=8, minute=30)
+        reloaded = self.store.read()
+        self.assertEqual(reloaded[MEMBER_IDS], [6, 2, 3, 5])
+        self.assertEqual(reloaded[INDEX], 2)
+        self.assertEqual(reloaded[SCHEDULE_HOUR], 8)
+
+    def test_hand_edited_index_survives_the_tail(self):
+        self.store.append("set_schedule", day=2, hour=8, minute=30)
+        self.store.append("add", member_id=6, position=5)
+        self.edit_by_hand(**{INDEX: 3})
+        reloaded = self.store.read()
+        self.assertEqual(reloaded[INDEX], 3)
+        self.assertEqual(reloaded[SCHEDULE_HOUR], 8)
+        self.assertEqual(reloaded[MEMBER_IDS], [1, 2, 3, 4, 5, 6])
+
+    def test_hand_edited_index_follows_its_member(self):
+        self.store.append("remove", member_id=1)
+        self.store.append("move", member_id=5, position=0)
+        self.edit_by_hand(**{INDEX: 3})  # Member 4
+        reloaded = self.store.read()
+        self.assertEqual(reloaded[MEMBER_IDS], [5, 2, 3, 4])
+        self.assertEqual(reloaded[MEMBER_IDS][reloaded[INDEX]], 4)
+
+    def test_records_that_carry_the_index_still_replay(self):
+        # Journals written before only rotate and set_index carried it have it on every record
+        self.store.append("remove", member_id=1, index=0)
+        self.store.append("set_index", index=2)
+        self.store.append("set_schedule", day=2, hour=8, minute=30, index=2)
+        reloaded = self.store.read()
+        self.assertEqual(reloaded[MEMBER_IDS], [2, 3, 4, 5])
+        self.assertEqual(reloaded[INDEX], 2)
+
+    def test_snapshot_skips_the_records_it_covers(self):
+        self.store.append("remove", member_id=1)
+        self.current = config([2, 3, 4, 5], index=0)
+        self.store.save()
+        with open(self.path) as fp:
+            self.assertEqual(json.load(fp)[JOURNAL_SEQ_KEY], 1)
+        self.store.append("rotate", index=1)
+        reloaded = self.store.read()
+        self.assertEqual(reloaded[MEMBER_IDS], [2, 3, 4, 5])
+        self.assertEqual(reloaded[INDEX], 1)
+
+    def test_torn_tail_is_cut_off(self):
+        self.store.append("rotate", index=2)
+        with open(self.store.journal_path, "a") as fp:
+            fp.write('{"seq": 2, "op": "rot')
+        self.assertEqual(self.store.read()[INDEX], 2)
+        self.store.append("rotate", index=3)
+        self.assertEqual(self.store.read()[INDEX], 3)
+
+    def test_stale_temp_files_are_removed(self):
+        stale, fresh = self.path.with_name(".conf.json.killed.tmp"), self.path.with_name(".conf.json.writing.tmp")
+        other = self.path.with_name(".other.json.killed.tmp")
+        for tmp in (stale, fresh, other):
+            tmp.write_text("{")
+        old = time.time() - STALE_TEMP_SECONDS - 1
+        os.utime(stale, (old, old))
+        os.utime(other, (old, old))
+        ConfigStore(self.path, dict, apply_journal_record)
+        self.assertFalse(stale.exists())
+        self.assertTrue(fresh.exists())  # Could be another process's write in progress
+        self.assertTrue(other.exists())
+
+
+# The writer CrashTest kills. Every write journals one more member, and a snapshot is written every COMPACT_BYTES,
+# so kills land in journal appends, snapshots and renames alike
+KILLS = 15
+COMPACT_BYTES = 512
+FIRST_ID = 1_000_000
+
+
+async def run_writer(path: Path):
+    """Adds members through ConfigStore as fast as it can. Prints how many it added after each one is on disk."""
+    config = {}
+    store = ConfigStore(path, lambda: config, apply_journal_record, delay=0, compact_bytes=COMPACT_BYTES)
+    config = store.read()
+    ids = config[MEMBER_IDS]
+    written = sum(1 for member_id in ids if member_id >= FIRST_ID)
+    print("ready", flush=True)
+    while True:
+        ids.append(FIRST_ID + written)
+        store.append("add", member_id=FIRST_ID + written, position=len(ids) - 1)
+        await store.flush()
+        written += 1
+        print(written, flush=True)
+
+
+class CrashTest(unittest.TestCase):
+    def test_killed_writer_leaves_old_or_new(self):
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "conf.json"
+            base = [1, 2, 3, 4, 5]
+            write_atomic(path, config(base))
+            confirmed = 0
+            for kill in range(KILLS):
+                writer = subprocess.Popen([sys.executable, __file__, "--writer", str(path)], stdout=subprocess.PIPE,
+                                          cwd=Path(__file__).parent, text=True)
+                self.assertEqual(writer.stdout.readline(), "ready\n")
+                time.sleep(rng.uniform(0.001, 0.05))
+                writer.kill()
+                for line in writer.stdout.read().splitlines():
+                    confirmed = max(confirmed, int(line))
+                writer.wait()
+
+                with self.subTest(kill=kill):
+                    with open(path) as fp:
+                        json.load(fp)  # Never truncated
+                    ids = ConfigStore(path, dict, apply_journal_record).read()[MEMBER_IDS]
+                    written = len(ids) - len(base)
+                    # The last write the writer confirmed, or the one it was doing when it was killed
+                    self.assertIn(written, (confirmed, confirmed + 1))
+                    self.assertEqual(ids, base + list(range(FIRST_ID, FIRST_ID + written)))
+                confirmed = written
+            self.assertGreater(confirmed, KILLS)
+
+            # Whatever temp files the kills left are removed by the next store, once they are old enough
+            stale = time.time() - STALE_TEMP_SECONDS - 1
+            for left in Path(tmp).glob(".conf.json.*.tmp"):
+                os.utime(left, (stale, stale))
+            ConfigStore(path, dict, apply_journal_record)
+            self.assertEqual(list(Path(tmp).glob(".conf.json.*.tmp")), [])
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--writer"]:
+        asyncio.run(run_writer(Path(sys.argv[2])))
+    else:
+        unittest.main()
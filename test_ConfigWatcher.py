@@ -0,0 +1,100 @@
+"""
+Checks that ConfigWatcher hot reloads hand edits, only redoes what changed, and keeps a hand edit over a change still
+in the journal. Runs against the fake backend in FakeDiscord.py with `python -m unittest` (or pytest).
+"""
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from bench import make_rotation, stop_rotations
+from ConfigStore import ConfigStore, write_atomic
+from ConfigWatcher import ConfigWatcher
+from FakeDiscord import FakeAPI, member_ids
+from RoleRotation import ConfKeys, ReloadReport, apply_journal_record
+
+SIZE = 10
+
+
+class ConfigWatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.api = FakeAPI()
+        self.rotation = await make_rotation(Path(self._tmp.name), SIZE, self.api, gateway_cache=False, chunking=False,
+                                            extra_members=1)
+        self.watcher = ConfigWatcher(lambda: [self.rotation])
+
+    async def asyncTearDown(self):
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    def on_disk(self) -> dict:
+        with open(self.rotation.store.path) as fp:
+            return json.load(fp)
+
+    def edit_by_hand(self, **changes):
+        write_atomic(self.rotation.store.path, {**self.on_disk(), **{key.value: value for key, value in changes.items()}})
+
+    async def reload(self) -> ReloadReport:
+        self.api.reset()
+        reports = await self.watcher.check()
+        report = reports[self.rotation.name]
+        self.assertIsInstance(report, ReloadReport)
+        return report
+
+    async def test_own_writes_are_not_reloaded(self):
+        await self.rotation.rotate_role()
+        self.assertEqual(await self.watcher.check(), {})
+
+    async def test_schedule_edit_only_moves_the_schedule(self):
+        self.edit_by_hand(**{ConfKeys.SCHEDULE_MINUTE: 30})
+        report = await self.reload()
+        self.assertEqual(report.parts, ["schedule"])
+        self.assertEqual(self.rotation.schedule_minute, 30)
+        self.assertEqual(self.api.total, 0)
+
+    async def test_added_member_is_the_only_fetch(self):
+        new_id = member_ids(SIZE + 1)[-1]
+        self.edit_by_hand(**{ConfKeys.MEMBER_IDS: member_ids(SIZE + 1)})
+        report = await self.reload()
+        self.assertEqual(report.parts, ["members (+1 fetched, -0)"])
+        self.assertIn(new_id, self.rotation.members)
+        self.assertEqual(dict(self.api.calls), {"fetch_member": 1})
+
+    async def test_index_edit_survives_the_journal(self):
+        # A move after the cursor is in the journal but not yet in conf.json
+        self.rotation.move_member(self.rotation.members[SIZE - 1], 5)
+        await self.rotation.store.flush()
+        self.edit_by_hand(**{ConfKeys.INDEX: 3})
+        report = await self.reload()
+        self.assertEqual(report.parts, ["index"])
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(self.rotation.index, 3)
+        self.assertEqual(self.rotation.members[5].id, member_ids(SIZE)[-1])
+
+    async def test_conflicting_edit_is_kept_and_reported(self):
+        await self.rotation.rotate_role()  # index 1, in the journal but not yet in conf.json
+        self.assertEqual(self.on_disk()[ConfKeys.INDEX.value], 0)
+        self.edit_by_hand(**{ConfKeys.INDEX: 4, ConfKeys.SCHEDULE_HOUR: 8})
+        report = await self.reload()
+        self.assertEqual(report.conflicts, ["index"])
+        self.assertIn("index", str(report))
+        self.assertEqual(self.rotation.index, 4)
+        self.assertEqual(self.rotation.schedule_hour, 8)
+
+        # The edit was written back, so a restart, which has nothing to compare with, doesnt lose it
+        await self.rotation.store.flush()
+        restarted = ConfigStore(self.rotation.store.path, dict, apply_journal_record).read()
+        self.assertEqual(restarted[ConfKeys.INDEX.value], 4)
+        self.assertEqual(await self.watcher.check(), {})
+
+    async def test_broken_edit_keeps_the_old_config(self):
+        self.edit_by_hand(**{ConfKeys.INDEX: SIZE + 5})
+        reports = await self.watcher.check()
+        self.assertIsInstance(reports[self.rotation.name], Exception)
+        self.assertEqual(self.rotation.index, 0)
+        self.assertTrue(self.rotation.config_good)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Checks how MemberImport reads a pasted list or a CSV, and that an import lands on disk as one write, both through
+/import_members against the fake backend in FakeDiscord.py and through the CLI's import_into_config.
+Runs with `python -m unittest` (or pytest).
+"""
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from bench import check_invariants, make_rotation, stop_rotations, write_conf
+from ConfigStore import ConfigStore
+from FakeDiscord import FakeAPI, member_ids
+from MemberImport import (ADDED, ALREADY_LISTED, DUPLICATE, INVALID, MAX_IMPORT_ROWS, NOT_FOUND, check_duplicates,
+                          export_csv, import_into_config, parse_member_rows)
+from RoleRotation import ConfKeys, apply_journal_record
+from RotationOrder import MemberRecord
+
+SIZE = 10
+COHORT = 50
+
+
+class ParseTest(unittest.TestCase):
+    def test_ids_and_mentions(self):
+        rows = parse_member_rows("<@1001>, <@!1002>;1003\n\n1004 12x34 0")
+        self.assertEqual([row.member_id for row in rows], [1001, 1002, 1003, 1004, None, None])
+        self.assertEqual([row.row for row in rows], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([row.status for row in rows[4:]], [INVALID, INVALID])
+
+    def test_export_reads_back(self):
+        members = [MemberRecord(1001, "=cmd()"), MemberRecord(1002, "two, with a comma")]
+        text = export_csv(members, 1, {1001: 2.0})
+        self.assertIn("'=cmd()", text)  # Not a formula when opened in a spreadsheet
+        self.assertEqual([row.member_id for row in parse_member_rows(text)], [1001, 1002])
+
+    def test_too_many_rows(self):
+        with self.assertRaises(ValueError):
+            parse_member_rows(" ".join(str(member_id) for member_id in range(1, MAX_IMPORT_ROWS + 2)))
+
+    def test_duplicates(self):
+        rows = parse_member_rows("1 2 3 2 x 4")
+        self.assertEqual(check_duplicates(rows, {3}), [1, 2, 4])
+        self.assertEqual([row.status for row in rows], [None, None, ALREADY_LISTED, DUPLICATE, INVALID, None])
+
+
+class ImportIntoConfigTest(unittest.TestCase):
+    def test_appends_after_the_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "conf.json"
+            write_conf(path, [1, 2, 3])
+            store = ConfigStore(path, dict, apply_journal_record)
+            store.read()
+            store.append("remove", member_id=2)  # Not in conf.json yet, only in the journal
+
+            report = import_into_config(ConfigStore(path, dict, apply_journal_record), parse_member_rows("4 1 5"),
+                                        ConfKeys.MEMBER_IDS.value, ConfKeys.INDEX.value)
+            self.assertEqual(report.counts(), {ADDED: 2, ALREADY_LISTED: 1})
+            with open(path) as fp:
+                self.assertEqual(json.load(fp)[ConfKeys.MEMBER_IDS.value], [1, 3, 4, 5])
+            # The snapshot covers the journal, so reading it back doesnt remove member 2 a second time
+            reloaded = ConfigStore(path, dict, apply_journal_record).read()
+            self.assertEqual(reloaded[ConfKeys.MEMBER_IDS.value], [1, 3, 4, 5])
+
+
+class ImportMembersTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.new_ids = member_ids(SIZE + COHORT)[SIZE:]
+        self.missing = self.new_ids[-1] + 1
+        self.api = FakeAPI(fail_ids=[self.missing])
+        self.rotation = await make_rotation(Path(self._tmp.name), SIZE, self.api, gateway_cache=False, chunking=False,
+                                            extra_members=COHORT)
+        self.rotation.store.delay = 0.5  # Like the bot, so separate writes would show up as separate writes
+
+    async def asyncTearDown(self):
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    async def test_import_is_one_write(self):
+        rotation = self.rotation
+        writes, events = rotation.store.writes, rotation.history.count(rotation.name)
+        # Mentions, plus a duplicate, a typo, someone already listed and someone who isnt in the guild
+        text = (" ".join(f"<@{member_id}>" for member_id in self.new_ids)
+                + f" {self.new_ids[0]} 12x34 {member_ids(1)[0]} {self.missing}")
+        report = await rotation.executor.submit("import_members", rotation.import_members, parse_member_rows(text))
+
+        self.assertEqual(report.counts(), {ADDED: COHORT, DUPLICATE: 1, INVALID: 1, ALREADY_LISTED: 1, NOT_FOUND: 1})
+        self.assertEqual(rotation.store.writes - writes, 1)
+        await rotation.history.wait()
+        self.assertEqual(rotation.history.count(rotation.name) - events, COHORT)
+        self.assertEqual(rotation.read_config()[ConfKeys.MEMBER_IDS.value], member_ids(SIZE) + self.new_ids)
+        self.assertEqual(check_invariants(rotation), [])
+
+    async def test_nothing_new_writes_nothing(self):
+        writes = self.rotation.store.writes
+        report = await self.rotation.import_members(parse_member_rows(" ".join(map(str, member_ids(SIZE)))))
+        self.assertEqual(report.counts(), {ALREADY_LISTED: SIZE})
+        self.assertEqual(self.rotation.store.writes, writes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+Checks that NotificationOutbox sends every message once: keys already queued are ignored, failures are retried or
+given up on, and rows left over by a restart are sent by the next start. Runs with `python -m unittest` (or pytest).
+"""
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+import discord
+
+from bench import make_rotation, stop_rotations
+from FakeDiscord import FakeAPI, FakeResponse, member_ids
+from NotificationOutbox import CHANNEL, DM, MESSAGE_LIMIT, NotificationOutbox
+
+WAIT = 5.0  # Seconds, far more than any of this takes
+
+
+class Recorder:
+    """A send that records what it was given, and fails the first `failures` calls with `error`"""
+
+    def __init__(self, failures: int = 0, error: Exception = None):
+        self.sent = []
+        self.calls = 0
+        self.failures = failures
+        self.error = error or discord.HTTPException(FakeResponse(500, "Internal Server Error"), "Injected failure")
+
+    async def __call__(self, kind: str, target_id: int, content: str):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        self.sent.append((kind, target_id, content))
+
+
+class NotificationOutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name) / "outbox.db"
+        self.outboxes = []
+
+    async def asyncTearDown(self):
+        for outbox in self.outboxes:
+            outbox.close()
+        self._tmp.cleanup()
+
+    def outbox(self, send=None) -> NotificationOutbox:
+        outbox = NotificationOutbox(self.path, send=send, rate=(1000, 1.0), retry_delay=0.01)
+        self.outboxes.append(outbox)
+        return outbox
+
+    async def drained(self, outbox: NotificationOutbox):
+        async def drain():
+            await outbox.wait()
+            while outbox.pending():
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(drain(), WAIT)
+
+    async def deliver_all(self, outbox: NotificationOutbox):
+        """What the worker does, but finished when this returns, counters included"""
+        async def deliver():
+            delay = await outbox.deliver_due()
+            while delay is not None:
+                await asyncio.sleep(delay)
+                delay = await outbox.deliver_due()
+        await outbox.wait()
+        await asyncio.wait_for(deliver(), WAIT)
+
+    async def test_same_key_is_sent_once(self):
+        send = Recorder()
+        outbox = self.outbox(send)
+        outbox.start()
+        first = outbox.enqueue("remind:1", "default", DM, 1001, "Reminder")
+        again = outbox.enqueue("remind:1", "default", DM, 1001, "Reminder")
+        await self.drained(outbox)
+        self.assertEqual((first.result(), again.result()), (True, False))
+        outbox.enqueue("remind:1", "default", DM, 1001, "Reminder")  # After it was sent too
+        await self.drained(outbox)
+        self.assertEqual(send.sent, [(DM, 1001, "Reminder")])
+        self.assertEqual(outbox.stats()["duplicates"], 2)
+
+    async def test_due_rows_for_one_destination_are_one_message(self):
+        outbox = self.outbox()
+        for n in range(3):
+            outbox.enqueue(f"channel:{n}", "default", CHANNEL, 777, f"line {n}")
+        outbox.enqueue("dm", "default", DM, 1001, "just for you")
+        outbox.enqueue("long", "default", CHANNEL, 778, "x" * MESSAGE_LIMIT)
+        outbox.enqueue("long too", "default", CHANNEL, 778, "y")
+        await outbox.wait()
+        outbox.send = send = Recorder()
+        await outbox.deliver_due()
+        self.assertEqual(sorted(send.sent), [(CHANNEL, 777, "line 0\nline 1\nline 2"),
+                                             (CHANNEL, 778, "x" * MESSAGE_LIMIT), (CHANNEL, 778, "y"),
+                                             (DM, 1001, "just for you")])
+
+    async def test_failed_send_is_retried(self):
+        send = Recorder(failures=2)
+        outbox = self.outbox(send)
+        outbox.enqueue("duty", "default", DM, 1001, "On duty")
+        await self.deliver_all(outbox)
+        self.assertEqual(send.sent, [(DM, 1001, "On duty")])
+        self.assertEqual((outbox.retried, outbox.sent, outbox.failed), (2, 1, 0))
+
+    async def test_closed_dms_arent_retried(self):
+        send = Recorder(failures=1, error=discord.Forbidden(FakeResponse(403, "Forbidden"), "DMs closed"))
+        outbox = self.outbox(send)
+        outbox.enqueue("duty", "default", DM, 1001, "On duty")
+        with self.assertLogs("NotificationOutbox", "WARNING"):
+            await self.deliver_all(outbox)
+        self.assertEqual((send.calls, outbox.retried, outbox.failed), (1, 0, 1))
+
+    async def test_restart_sends_what_was_left(self):
+        stopped = self.outbox()  # No send, like a bot that stopped before it got to it
+        stopped.enqueue("left", "default", DM, 1001, "Left over")
+        await stopped.wait()
+        stopped.close()
+
+        send = Recorder()
+        restarted = self.outbox(send)
+        self.assertEqual([row[0] for row in restarted.pending()], ["left"])
+        restarted.start()
+        await self.drained(restarted)
+        restarted.enqueue("left", "default", DM, 1001, "Left over")  # Planned again after the restart
+        await self.drained(restarted)
+        self.assertEqual(send.sent, [(DM, 1001, "Left over")])
+
+
+class RotationNotificationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.rotation = await make_rotation(Path(self._tmp.name), 5, FakeAPI())
+        self.send = Recorder()
+        self.rotation.outbox.send = self.send
+        self.rotation.outbox.retry_delay = 0.01
+
+    async def asyncTearDown(self):
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    async def test_rotation_and_reminders(self):
+        rotation = self.rotation
+        rotation.set_notifications(dm=True, channel_id=777, remind_hours=[24, 1])
+        rotation.outbox.start()
+        await rotation.rotate_role()
+        for _ in range(2):  # Planned again, by a /reload or a restart
+            for hours in rotation.notify["remind_hours"]:
+                await rotation.send_reminder(rotation.next_fire, hours)
+        await rotation.outbox.wait()
+        while rotation.outbox.pending():
+            await asyncio.sleep(0.01)
+
+        on_duty, next_up = member_ids(5)[1:3]
+        self.assertEqual(rotation.outbox.duplicates, 4)
+        # Lines due together for one destination may have gone out as one message
+        lines = sorted((kind, target_id, line) for kind, target_id, content in self.send.sent
+                       for line in content.splitlines())
+        self.assertEqual([(kind, target_id) for kind, target_id, line in lines],
+                         [(CHANNEL, 777)] * 3 + [(DM, on_duty)] + [(DM, next_up)] * 2)
+        self.assertEqual(sum(line.startswith("Reminder") for kind, target_id, line in lines), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
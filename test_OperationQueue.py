@@ -0,0 +1,73 @@
+"""
+Checks OperationQueue's merging, superseding and priorities against the fake backend in FakeDiscord.py.
+Runs with `python -m unittest` (or pytest).
+"""
+import asyncio
+import unittest
+
+from FakeDiscord import FakeAPI, FakeClient, build_guild, member_ids
+from OperationQueue import OperationQueue, interactive
+
+ROLE_ID = 500
+
+
+class OperationQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = FakeAPI()
+        self.guild = build_guild(FakeClient(self.api), 6, role_id=ROLE_ID, holder=0)
+        self.role = self.guild.roles[ROLE_ID]
+        self.ids = member_ids(6)
+        self.queue = OperationQueue()
+
+    async def asyncTearDown(self):
+        self.queue.stop()
+
+    def holders(self):
+        return {member.id for member in self.role.members}
+
+    async def test_stale_member_still_gets_the_call(self):
+        # Fetched before someone handed them the role by hand, so this copy says they dont have it
+        fetched = await self.guild.fetch_member(self.ids[1])
+        self.guild.members[self.ids[1]].roles.append(self.role)
+        self.assertNotIn(self.role, fetched.roles)
+        self.assertTrue(await self.queue.remove_role(fetched, self.role))
+        self.assertEqual(self.holders(), {self.ids[0]})
+
+    async def test_newest_of_add_and_remove_wins(self):
+        member = self.guild.members[self.ids[2]]
+        added, removed, added_again = await asyncio.gather(self.queue.add_role(member, self.role),
+                                                           self.queue.remove_role(member, self.role),
+                                                           self.queue.add_role(member, self.role))
+        self.assertEqual((added, removed, added_again), (False, False, True))
+        self.assertEqual(self.api.calls["add_roles"], 1)
+        self.assertEqual(self.api.calls["remove_roles"], 0)
+        self.assertEqual(self.queue.superseded, 2)
+        self.assertIn(self.ids[2], self.holders())
+
+    async def test_identical_operations_are_merged(self):
+        fetched = await asyncio.gather(*(self.queue.fetch_member(self.guild, self.ids[3]) for _ in range(5)))
+        self.assertEqual({member.id for member in fetched}, {self.ids[3]})
+        self.assertEqual(self.api.calls["fetch_member"], 1)
+        self.assertEqual(self.queue.merged, 4)
+
+    async def test_interactive_work_goes_first(self):
+        # One fetch per window, so the rest have to wait their turn
+        self.queue.stop()
+        self.queue = OperationQueue(buckets={"fetch_member": (1, 0.02)})
+        order = []
+
+        async def fetch(member_id, priority):
+            await self.queue.fetch_member(self.guild, member_id)
+            order.append(priority)
+
+        background = [asyncio.ensure_future(fetch(member_id, "background")) for member_id in self.ids[:5]]
+        await asyncio.sleep(0)
+        with interactive():
+            urgent = asyncio.ensure_future(fetch(self.ids[5], "interactive"))
+        await asyncio.gather(*background, urgent)
+        # The first background fetch went out before the interactive one was queued, but none after it
+        self.assertEqual(order.index("interactive"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Checks that reconciling costs nothing when the role is right and fixes only what drifted when it isnt, against the fake
+backend in FakeDiscord.py. Runs with `python -m unittest` (or pytest).
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from bench import check_invariants, make_rotation, stop_rotations
+from FakeDiscord import FakeAPI, member_ids
+from Reconciler import Reconciler
+
+SIZE = 10
+
+
+class ReconcilerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.api = FakeAPI()
+        self.rotation = await make_rotation(Path(self._tmp.name), SIZE, self.api)
+        self.guild = self.rotation.client.guilds[1]
+        self.role = self.rotation.managed_role
+        self.ids = member_ids(SIZE)
+        self.reconciler = Reconciler(lambda: [self.rotation])
+
+    async def asyncTearDown(self):
+        self.reconciler.stop()
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    def drift(self):
+        """The member on duty loses the role, three others get it by hand"""
+        on_duty = self.guild.members[self.ids[0]]
+        on_duty.roles.remove(self.role)
+        for member_id in self.ids[3:6]:
+            self.guild.members[member_id].roles.append(self.role)
+        self.rotation.cache.forget_member(1, on_duty.id)  # As the member update event would have
+
+    async def test_nothing_drifted_costs_nothing(self):
+        self.api.reset()
+        self.assertEqual(await self.reconciler.reconcile_all(), 0)
+        self.assertEqual(self.api.total, 0)
+        self.assertEqual(self.reconciler.stats()["checks"], 1)
+
+    async def test_only_the_drift_is_fixed(self):
+        self.drift()
+        self.api.reset()
+        with self.assertLogs(self.rotation.log.logger, "WARNING") as logged:
+            self.assertEqual(await self.reconciler.reconcile_all(), 4)
+        self.assertEqual(len(logged.records), 4)  # One line per repair
+        self.assertEqual(self.api.calls["add_roles"], 1)
+        self.assertEqual(self.api.calls["remove_roles"], 3)
+        self.assertEqual(check_invariants(self.rotation), [])
+        self.assertEqual(self.reconciler.stats()["repairs"], 4)
+
+        self.api.reset()
+        self.assertEqual(await self.reconciler.reconcile_all(), 0)
+        self.assertEqual(self.api.total, 0)
+
+    async def test_holders_outside_the_rotation_are_left_alone(self):
+        self.guild.add_member(5000, roles=[self.role])
+        self.assertEqual(await self.rotation.reconcile(), ([], []))
+        self.assertIn(self.role, self.guild.members[5000].roles)
+
+    async def test_failed_rotation_is_reconciled(self):
+        add_role = self.rotation.operations.add_role
+
+        async def fail_once(member, role):
+            self.rotation.operations.add_role = add_role
+            raise RuntimeError("add_roles failed")
+
+        self.rotation.operations.add_role = fail_once
+        with self.assertRaises(RuntimeError), self.assertLogs(self.rotation.log.logger, "WARNING"):
+            await self.rotation.scheduled_rotation()
+        # The index had moved on before the role call failed, so reconcile gave the role to the new member
+        self.assertEqual(self.rotation.index, 1)
+        self.assertEqual(check_invariants(self.rotation), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Checks that rotate_role only touches the members whose role is wrong, against the fake backend in FakeDiscord.py.
+Runs with `python -m unittest` (or pytest).
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from bench import check_invariants, make_rotation, stop_rotations
+from FakeDiscord import FakeAPI, member_ids
+from OperationQueue import Bucket
+
+SIZE = 10
+
+
+class RotateRoleTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.api = FakeAPI()
+        self.rotation = await make_rotation(Path(self._tmp.name), SIZE, self.api)
+        self.guild = self.rotation.client.guilds[1]
+        self.ids = member_ids(SIZE)
+        # A full cycle is more role calls than the real bucket allows in its window
+        self.rotation.operations.buckets["member_roles"] = Bucket(10_000, 1.0)
+
+    async def asyncTearDown(self):
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    def holders(self):
+        return {member.id for member in self.rotation.managed_role.members}
+
+    async def test_rotation_is_two_calls(self):
+        self.api.reset()
+        report = await self.rotation.rotate_role()
+        self.assertEqual(dict(self.api.calls), {"remove_roles": 1, "add_roles": 1})
+        self.assertEqual((report.previous_index, report.index), (0, 1))
+        self.assertEqual([member.id for member in report.added], [self.ids[1]])
+        self.assertEqual([member.id for member in report.removed], [self.ids[0]])
+        self.assertEqual(self.holders(), {self.ids[1]})
+
+    async def test_a_full_cycle_wraps_around(self):
+        for step in range(1, SIZE + 1):
+            self.api.reset()
+            report = await self.rotation.rotate_role()
+            self.assertEqual(report.index, step % SIZE)
+            self.assertEqual(self.api.total, 2)
+            self.assertEqual(check_invariants(self.rotation), [])
+
+    async def test_hand_given_roles_are_taken_back(self):
+        role = self.rotation.managed_role
+        for member_id in self.ids[4:7]:
+            self.guild.members[member_id].roles.append(role)
+        self.api.reset()
+        report = await self.rotation.rotate_role()
+        self.assertEqual({member.id for member in report.removed}, {self.ids[0], *self.ids[4:7]})
+        self.assertEqual(dict(self.api.calls), {"remove_roles": 4, "add_roles": 1})
+        self.assertEqual(self.holders(), {self.ids[1]})
+
+    async def test_incoming_member_who_has_the_role_isnt_called(self):
+        self.guild.members[self.ids[1]].roles.append(self.rotation.managed_role)
+        self.api.reset()
+        report = await self.rotation.rotate_role()
+        self.assertEqual(report.added, [])
+        self.assertEqual(dict(self.api.calls), {"remove_roles": 1})
+        self.assertEqual(self.holders(), {self.ids[1]})
+
+    async def test_repair_sweeps_everyone(self):
+        self.guild.members[self.ids[5]].roles.append(self.rotation.managed_role)
+        self.api.reset()
+        report = await self.rotation.rotate_role(repair=True)
+        self.assertTrue(report.repair)
+        self.assertEqual({member.id for member in report.removed}, {self.ids[0], self.ids[5]})
+        self.assertEqual(self.holders(), {self.ids[1]})
+        self.assertEqual(check_invariants(self.rotation), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+Fires hundreds of concurrent commands at a rotation on the fake backend in FakeDiscord.py, like a crowd of slash commands
+racing a scheduled rotation, and checks the rotation is still consistent afterwards. Also checks the executor runs
+mutations one at a time and merges duplicates. Runs with `python -m unittest` (or pytest).
+"""
+import asyncio
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from bench import check_invariants, make_rotation, stop_rotations
+from FakeDiscord import FakeAPI, member_ids
+from OperationQueue import Bucket
+from RoleRotation import ConfKeys, RoleRotation
+
+SIZE = 10
+COMMANDS = 300
+SEEDS = range(3)
+
+
+class RotationExecutorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.api = FakeAPI()
+        self.rotation = await make_rotation(Path(self._tmp.name), SIZE, self.api, extra_members=SIZE)
+        # This is about ordering, not rate limits. With the real buckets the commands would take minutes
+        self.rotation.operations.buckets["member_roles"] = Bucket(10_000, 1.0)
+
+    async def asyncTearDown(self):
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    def random_command(self, rng: random.Random):
+        rotation = self.rotation
+        submit = rotation.executor.submit
+        extra = member_ids(SIZE * 2)[SIZE:]
+        pick = rng.random()
+        if pick < 0.2:
+            return submit("rotate_role", rotation.rotate_role)
+        if pick < 0.4:
+            return submit("add_user", rotation.add_user, rng.choice(extra), rng.randrange(-1, SIZE), merge=True)
+        if pick < 0.55:
+            return submit("remove_user", rotation.remove_user, rng.choice(rotation.members.ids() + extra), merge=True)
+        if pick < 0.7:
+            member = rotation.members[rng.randrange(len(rotation.members))]
+            return submit("move_member", rotation.move_member, member, rng.randrange(len(rotation.members)))
+        if pick < 0.85:
+            return submit("set_index", rotation.set_index, rng.randrange(len(rotation.members)), merge=True)
+        if pick < 0.95:
+            return submit("set_new_schedule", rotation.set_new_schedule, rng.randrange(7), rng.randrange(24), 0)
+        return submit("load_config", rotation.load_config, merge=True)
+
+    async def test_concurrent_commands_keep_the_rotation_consistent(self):
+        rotation = self.rotation
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                before = rotation.executor.executed + rotation.executor.merged
+                await asyncio.gather(*(self.random_command(rng) for _ in range(COMMANDS)), return_exceptions=True)
+                await rotation.store.flush()
+
+                self.assertEqual(check_invariants(rotation), [])
+                self.assertTrue(rotation.config_good)
+                self.assertEqual(rotation.executor.executed + rotation.executor.merged - before, COMMANDS)
+                reloaded = RoleRotation(rotation.client, 1, config_path=rotation.store.path).read_config()
+                self.assertEqual(reloaded[ConfKeys.MEMBER_IDS.value], rotation.members.ids())
+                self.assertEqual(reloaded[ConfKeys.INDEX.value], rotation.index)
+
+    async def test_mutations_run_one_at_a_time_in_order(self):
+        running, ran = [], []
+
+        async def mutation(n):
+            running.append(n)
+            self.assertEqual(running, [n])
+            await asyncio.sleep(0)
+            ran.append(n)
+            running.remove(n)
+            return n
+
+        results = await asyncio.gather(*(self.rotation.executor.submit("mutation", mutation, n) for n in range(20)))
+        self.assertEqual(results, list(range(20)))
+        self.assertEqual(ran, list(range(20)))
+
+    async def test_queued_duplicates_are_merged(self):
+        calls = []
+
+        async def mutation(n):
+            calls.append(n)
+            await asyncio.sleep(0)
+            return n
+
+        submit = self.rotation.executor.submit
+        results = await asyncio.gather(submit("first", mutation, 0), submit("merged", mutation, 1, merge=True),
+                                       submit("merged", mutation, 1, merge=True), submit("unmerged", mutation, 1))
+        self.assertEqual(results, [0, 1, 1, 1])
+        self.assertEqual(calls, [0, 1, 1])
+        self.assertEqual(self.rotation.executor.merged, 1)
+
+    async def test_failed_mutation_doesnt_stop_the_next(self):
+        async def fail():
+            raise ValueError("nope")
+
+        submit = self.rotation.executor.submit
+        failed, report = await asyncio.gather(submit("fail", fail), submit("rotate_role", self.rotation.rotate_role),
+                                              return_exceptions=True)
+        self.assertIsInstance(failed, ValueError)
+        self.assertEqual(report.index, 1)
+        self.assertEqual(check_invariants(self.rotation), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Checks RotationOrder against a plain list of ids, the list semantics it replaced, with random operations.
+Runs with `python -m unittest` (or pytest). bench.py --scenarios rotation_order times the same operations.
+"""
+import random
+import sys
+import unittest
+
+from RotationOrder import MemberRecord, RotationOrder, cursor_after_move, cursor_after_remove
+
+SEEDS = range(25)
+STEPS = 400
+
+
+class RotationOrderTest(unittest.TestCase):
+    def assertMatches(self, order: RotationOrder, reference: list):
+        self.assertEqual(order.ids(), reference)
+        self.assertEqual(len(order), len(reference))
+        self.assertEqual([member.id for member in order], reference)
+        for position, member_id in enumerate(reference):
+            self.assertEqual(order.position(member_id), position)
+            self.assertIn(member_id, order)
+            self.assertEqual(order[position].id, member_id)
+            self.assertEqual(order[position - len(reference)].id, member_id)  # Negative indexes, like a list
+
+    def test_random_operations_match_a_list(self):
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                order, reference = RotationOrder(), []
+                next_id, on_duty, cursor = 1, None, 0
+                for _ in range(STEPS):
+                    choice = rng.random()
+                    if choice < 0.4 or len(reference) < 2:
+                        # Negative and out of range positions too
+                        position = rng.randint(-len(reference) - 3, len(reference) + 3)
+                        reference.insert(position, next_id)
+                        landed = order.insert(position, MemberRecord(next_id, f"member {next_id}"))
+                        self.assertEqual(reference[landed], next_id)
+                        next_id += 1
+                        on_duty = on_duty or reference[0]
+                        cursor = reference.index(on_duty)
+                    elif choice < 0.7:
+                        # Whoever is on duty cant be removed, RoleRotation.remove_user refuses
+                        member_id = rng.choice([member_id for member_id in reference if member_id != on_duty])
+                        expected = reference.index(member_id)
+                        reference.remove(member_id)
+                        position, member = order.remove(member_id)
+                        self.assertEqual((position, member.id), (expected, member_id))
+                        cursor = cursor_after_remove(cursor, position)
+                    else:
+                        member_id = rng.choice(reference)
+                        position = rng.randrange(len(reference))
+                        expected = reference.index(member_id)
+                        reference.remove(member_id)
+                        reference.insert(position, member_id)
+                        self.assertEqual(order.move(member_id, position), expected)
+                        cursor = cursor_after_move(cursor, expected, position)
+                    self.assertEqual(reference[cursor], on_duty)
+                    self.assertNotIn(next_id, order)
+                    self.assertIsNone(order.get(next_id))
+                self.assertMatches(order, reference)
+
+    def test_lookups_after_shifts(self):
+        order = RotationOrder(MemberRecord(member_id, str(member_id)) for member_id in range(1, 11))
+        reference = list(range(1, 11))
+        order.move(10, 0)  # Shifts everyone
+        order.remove(5)
+        order.insert(7, MemberRecord(11, "11"))
+        reference.remove(10)
+        reference.insert(0, 10)
+        reference.remove(5)
+        reference.insert(7, 11)
+        self.assertMatches(order, reference)
+        # Only the range between the old and new position shifts
+        order.move(9, 8)
+        self.assertEqual(order.position(10), 0)
+        self.assertEqual(order.position(8), 9)
+        self.assertEqual(order.position(9), 8)
+
+    def test_many_lookups_after_a_shift_refresh_the_positions(self):
+        reference = list(range(1, RotationOrder.REFRESH_AFTER * 4))
+        order = RotationOrder(MemberRecord(member_id, str(member_id)) for member_id in reference)
+        order.insert(0, MemberRecord(0, "0"))
+        reference.insert(0, 0)
+        self.assertMatches(order, reference)  # Scans for the first few, then rewrites the rest
+        self.assertEqual(order._stale_from, len(reference))
+
+    def test_lookup_after_a_shift_skips_bytes_across_two_ids(self):
+        # Little endian, the last 4 bytes of the first id and the first 4 of the second spell out the third
+        first, second, third = 0x11111111_00000000, 0x00000000_22222222, 0x22222222_11111111
+        if sys.byteorder == "big":
+            first, second, third = 0x00000000_11111111, 0x22222222_00000000, 0x11111111_22222222
+        order = RotationOrder(MemberRecord(member_id, str(member_id)) for member_id in (first, second, third))
+        order.insert(0, MemberRecord(1, "1"))  # Every stored position is off by one now
+        self.assertEqual(order.position(third), 3)
+        self.assertEqual(order.remove(third)[0], 3)
+        self.assertMatches(order, [1, first, second])
+
+    def test_errors(self):
+        order = RotationOrder(MemberRecord(member_id, str(member_id)) for member_id in (1, 2, 3))
+        with self.assertRaises(ValueError):
+            order.append(MemberRecord(2, "again"))
+        with self.assertRaises(KeyError):
+            order.remove(4)
+        with self.assertRaises(IndexError):
+            order.move(1, 3)
+        with self.assertRaises(IndexError):
+            order.move(1, -1)
+        self.assertMatches(order, [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
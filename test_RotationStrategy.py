@@ -0,0 +1,156 @@
+"""
+Checks the rotation strategies against plain versions that scan every member, and that rotate_role with each of them
+keeps the role on whoever is on duty. Runs with `python -m unittest` (or pytest).
+"""
+import random
+import tempfile
+import unittest
+from collections import Counter
+from pathlib import Path
+
+from bench import check_invariants, make_rotation, stop_rotations
+from FakeDiscord import FakeAPI
+from OperationQueue import Bucket
+from RotationOrder import MemberRecord, RotationOrder
+from RotationStrategy import (LEAST_RECENT, ROUND_ROBIN, STRATEGIES, WEIGHTED, Availability, Fenwick, make_strategy,
+                              windows_from_conf, windows_to_conf)
+
+SIZE = 12
+SEEDS = range(10)
+
+
+def order(size: int) -> RotationOrder:
+    return RotationOrder(MemberRecord(member_id, str(member_id)) for member_id in range(1, size + 1))
+
+
+def run(strategy, members: RotationOrder, picks: int, start=0.0) -> list:
+    """Who goes on duty for `picks` rotations, one a second from `start`"""
+    index, chosen = 0, []
+    for pick in range(picks):
+        now = start + pick
+        index = strategy.choose(members, index, now)
+        strategy.on_duty(members[index].id, now)
+        chosen.append(members[index].id)
+    return chosen
+
+
+class AvailabilityTest(unittest.TestCase):
+    def test_matches_checking_every_window(self):
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                windows = {member_id: [(start, start + rng.randint(1, 20))
+                                       for start in rng.sample(range(100), rng.randint(0, 4))]
+                           for member_id in range(1, 8)}
+                availability = Availability(windows)
+                for now in sorted(rng.uniform(-5, 130) for _ in range(60)):
+                    availability.advance(now)
+                    for member_id, spans in windows.items():
+                        away = any(start <= now < end for start, end in spans)
+                        self.assertEqual(availability.available(member_id), not away)
+
+    def test_back_to_back_windows_and_going_back(self):
+        availability = Availability({1: [(10, 20), (20, 30)]})
+        availability.advance(20)
+        self.assertFalse(availability.available(1))
+        availability.advance(30)
+        self.assertTrue(availability.available(1))
+        self.assertIsNone(availability.advance(15))  # Replayed
+        self.assertFalse(availability.available(1))
+
+
+class FenwickTest(unittest.TestCase):
+    def test_matches_a_list(self):
+        rng = random.Random(0)
+        flags = [rng.randint(0, 1) for _ in range(50)]
+        tree = Fenwick(flags)
+        for _ in range(500):
+            position, flag = rng.randrange(len(flags)), rng.randint(0, 1)
+            flags[position] = flag
+            tree.set(position, flag)
+            stop = rng.randrange(len(flags) + 1)
+            self.assertEqual(tree.prefix(stop), sum(flags[:stop]))
+            self.assertEqual(tree.total, sum(flags))
+            if tree.total:
+                k = rng.randint(1, tree.total)
+                self.assertEqual(tree.find(k), [i for i, flag in enumerate(flags) if flag][k - 1])
+
+
+class StrategyTest(unittest.TestCase):
+    def test_round_robin_skips_whoever_is_away(self):
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                members = order(SIZE)
+                away = set(rng.sample(members.ids(), rng.randint(0, SIZE)))
+                strategy = make_strategy(ROUND_ROBIN, Availability({member_id: [(-1, 1000)] for member_id in away}))
+                index = rng.randrange(SIZE)
+                chosen = strategy.choose(members, index, 0)
+                # The plain version: walk forward from the next member until someone is available
+                following = [(index + step) % SIZE for step in range(1, SIZE + 1)]
+                expected = next((i for i in following if members[i].id not in away), (index + 1) % SIZE)
+                self.assertEqual(chosen, expected)
+
+    def test_weighted_shares_follow_the_weights(self):
+        members = order(4)
+        strategy = make_strategy(WEIGHTED, weights={1: 3.0, 2: 2.0})
+        counts = Counter(run(strategy, members, 700))
+        self.assertEqual(counts, {1: 300, 2: 200, 3: 100, 4: 100})
+
+    def test_weighted_newcomer_doesnt_catch_up(self):
+        members = order(3)
+        strategy = make_strategy(WEIGHTED)
+        run(strategy, members, 30)
+        members.append(MemberRecord(4, "4"))
+        strategy.member_added(members, 4)
+        counts = Counter(run(strategy, members, 8, start=100))
+        self.assertEqual(counts, {1: 2, 2: 2, 3: 2, 4: 2})
+
+    def test_least_recent_goes_to_whoever_waited_longest(self):
+        members = order(5)
+        strategy = make_strategy(LEAST_RECENT, last_duty={1: 50.0, 2: 10.0, 3: 40.0, 5: 30.0})
+        # Member 4 never had a shift, then the oldest shifts first
+        self.assertEqual(run(strategy, members, 5, start=100), [4, 2, 5, 3, 1])
+
+    def test_nobody_available_falls_back_to_the_next_member(self):
+        members = order(3)
+        everyone_away = Availability({member_id: [(-1, 1000)] for member_id in members.ids()})
+        for name in STRATEGIES:
+            with self.subTest(strategy=name):
+                self.assertEqual(make_strategy(name, everyone_away).choose(members, 2, 0), 0)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            make_strategy("alphabetical")
+
+    def test_windows_survive_the_config(self):
+        windows = {1: [(1_700_000_000.0, 1_700_086_400.0)], 2: []}
+        self.assertEqual(windows_from_conf(windows_to_conf(windows)), {1: windows[1]})
+
+
+class RotateWithStrategyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.rotation = await make_rotation(Path(self._tmp.name), SIZE, FakeAPI())
+        self.rotation.operations.buckets["member_roles"] = Bucket(10_000, 1.0)
+
+    async def asyncTearDown(self):
+        await stop_rotations()
+        self._tmp.cleanup()
+
+    async def test_away_members_are_never_put_on_duty(self):
+        rotation = self.rotation
+        away = set(rotation.members.ids()[1::3])
+        for member_id in away:
+            rotation.set_unavailable(member_id, [(0, 2_000_000_000)])
+        for name in STRATEGIES:
+            with self.subTest(strategy=name):
+                rotation.set_strategy(name)
+                for _ in range(SIZE):
+                    report = await rotation.rotate_role()
+                    self.assertNotIn(rotation.members[report.index].id, away)
+                    self.assertEqual(check_invariants(rotation), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
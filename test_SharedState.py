@@ -0,0 +1,131 @@
+"""
+Checks that replicas sharing a state.db never overwrite each other's changes, that one leader at a time holds the
+lease, and, with bench.py's failover scenario, that killing or stopping the leader loses no acknowledged command.
+Runs with `python -m unittest` (or pytest).
+"""
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from bench import bench_failover, write_conf
+from ConfigStore import JOURNAL_SEQ_KEY
+from FakeDiscord import FakeAPI
+from LeaderLease import LeaderLease
+from RoleRotation import ConfKeys, apply_journal_record
+from SharedState import SharedConfigStore, SharedState, StaleConfig
+
+MEMBER_IDS = ConfKeys.MEMBER_IDS.value
+
+
+class SharedStateTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.states = []
+
+    def tearDown(self):
+        for state in self.states:
+            state.close()
+        self._tmp.cleanup()
+
+    def state(self) -> SharedState:
+        state = SharedState(self.tmp / "state.db")
+        self.states.append(state)
+        return state
+
+    def store(self, state: SharedState, holder: str) -> SharedConfigStore:
+        config = {}
+        store = SharedConfigStore(state, "default", self.tmp / "conf.json", lambda: config, apply_journal_record,
+                                  holder=holder)
+        config.update(store.read())
+        return store
+
+    def test_commit_only_goes_through_from_the_latest_seq(self):
+        state = self.state()
+        self.assertTrue(state.create("default", {MEMBER_IDS: [1, 2]}))
+        self.assertFalse(state.create("default", {MEMBER_IDS: [3]}))  # Another replica already added it
+        seq = state.commit("default", 0, [{"seq": 1, "op": "add", "member_id": 3, "position": 2}])
+        with self.assertRaises(StaleConfig):
+            state.commit("default", 0, [{"seq": 1, "op": "remove", "member_id": 1}])
+        config, records, read_seq = state.read("default")
+        self.assertEqual((seq, read_seq), (1, 1))
+        self.assertEqual([record["op"] for record in records], ["add"])
+
+    def test_snapshot_replaces_the_journal(self):
+        state = self.state()
+        state.create("default", {MEMBER_IDS: [1, 2]})
+        state.commit("default", 0, [{"seq": 1, "op": "add", "member_id": 3, "position": 2}])
+        state.commit("default", 1, [], snapshot={MEMBER_IDS: [1, 2, 3]})
+        config, records, seq = state.read("default")
+        self.assertEqual((config[MEMBER_IDS], config[JOURNAL_SEQ_KEY], records, seq), ([1, 2, 3], 2, [], 2))
+
+    def test_replicas_dont_overwrite_each_other(self):
+        write_conf(self.tmp / "conf.json", [1, 2, 3])
+        first, second = self.store(self.state(), "first"), self.store(self.state(), "second")
+        self.assertFalse(second.changed_on_disk())
+        first.append("remove", member_id=2)
+        self.assertTrue(second.changed_on_disk())
+        with self.assertRaises(StaleConfig):
+            second.append("add", member_id=4, position=3)
+        # Reloading catches up, and then the change goes through on top of the other one
+        reloaded = second.read()
+        self.assertEqual(reloaded[MEMBER_IDS], [1, 3])
+        second.append("add", member_id=4, position=2)
+        self.assertEqual(self.store(self.state(), "third").read()[MEMBER_IDS], [1, 3, 4])
+
+    def test_conf_json_is_only_copied_in_once(self):
+        write_conf(self.tmp / "conf.json", [1, 2, 3])
+        first = self.store(self.state(), "first")
+        first.append("rotate", index=1)
+        write_conf(self.tmp / "conf.json", [9])  # Not read anymore
+        self.assertEqual(self.store(self.state(), "second").read()[MEMBER_IDS], [1, 2, 3])
+
+    def test_one_lease_holder(self):
+        state = self.state()
+        holder, expires, term = state.claim_lease("leader", "first", 10.0)
+        self.assertEqual((holder, term), ("first", 1))
+        self.assertEqual(state.claim_lease("leader", "second", 10.0)[0], "first")
+        self.assertEqual(state.claim_lease("leader", "first", 10.0)[2], 1)  # Renewed, same term
+        state.release_lease("leader", "first")
+        self.assertEqual(state.claim_lease("leader", "second", 10.0)[::2], ("second", 2))
+
+    def test_expired_lease_is_taken_over(self):
+        state = self.state()
+        first = LeaderLease(state, "first", ttl=0.3)
+        second = LeaderLease(state, "second", ttl=0.3)
+        self.assertTrue(first.check())
+        self.assertFalse(second.check())
+        time.sleep(0.25)
+        # Stops trusting the lease an interval before it expires, so it never overlaps the next holder
+        self.assertFalse(first.held())
+        self.assertFalse(second.check())
+        time.sleep(0.1)
+        self.assertTrue(second.check())
+        self.assertEqual(second.term, 2)
+        with self.assertLogs("LeaderLease", "WARNING"):
+            self.assertFalse(first.check())
+
+
+class FailoverTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failover_loses_nothing(self):
+        # Three replica processes, the leader is killed, the next one stopped. Takes a few seconds
+        with tempfile.TemporaryDirectory() as tmp:
+            result = await bench_failover(Path(tmp), 10, FakeAPI, phase_seconds=1.0)
+        self.assertEqual(len(result["leaders"]), 3)
+        self.assertEqual(result["terms"], sorted(result["terms"]))
+        self.assertLessEqual(result["failover_ms"], result["failover_bound_ms"] + 500)
+        self.assertGreater(result["rotations"], 0)
+        self.assertIn(result["rotations_recorded"] - result["rotations"], (0, 1))
+        self.assertGreater(result["commands_acked"], 0)
+        self.assertEqual(result["by_non_leader"], [])
+        self.assertEqual(result["out_of_order"], 0)
+        self.assertEqual(result["lost"], [])
+        self.assertEqual(result["stale_next_fire"], 0)
+        self.assertEqual(result["duplicate_ids"], 0)
+        self.assertTrue(result["index_in_range"])
+        self.assertTrue(result["last_leader_matches"])
+
+
+if __name__ == "__main__":
+    unittest.main()